@@ -0,0 +1,120 @@
+from datetime import datetime
+from sqlalchemy import insert, select, literal
+from app import db, cache
+from models import Skill, SavedSearch, SkillSubscription, MatchAlert, canonical_skill_key
+
+# Alerts shown on the notifications page
+ALERTS_LIMIT = 50
+
+
+@cache.memoize(timeout=300)  # Cache for 5 minutes
+def get_unread_alert_count(user_id):
+    return MatchAlert.query.filter_by(user_id=user_id, is_read=False).count()
+
+
+def clear_alert_counts(user_ids):
+    for user_id in user_ids:
+        cache.delete_memoized(get_unread_alert_count, user_id)
+
+
+def subscribe_skill(user_id, skill_id, saved_search_id=None):
+    """Alert the user when someone starts offering the skill. The caller commits.
+
+    Without a saved search the subscription is explicit, and an existing one a
+    saved search created is kept even after that search is deleted.
+    """
+    subscription = SkillSubscription.query.filter_by(skill_id=skill_id, user_id=user_id).first()
+    if subscription:
+        if saved_search_id is None:
+            subscription.saved_search_id = None
+        return subscription
+    subscription = SkillSubscription(skill_id=skill_id, user_id=user_id, saved_search_id=saved_search_id)
+    db.session.add(subscription)
+    return subscription
+
+
+def unsubscribe_skill(user_id, subscription_id):
+    deleted = SkillSubscription.query.filter_by(id=subscription_id, user_id=user_id).delete()
+    db.session.commit()
+    return deleted
+
+
+def _search_skill(search):
+    return Skill.query.filter_by(canonical_key=canonical_skill_key(search)).first() if search else None
+
+
+def save_search(user_id, search, availability):
+    """Save a directory search; a search naming a skill also subscribes to that skill.
+
+    Returns the saved search and the skill it alerts on, or None when the
+    search doesn't name a skill exactly and so creates no alert.
+    """
+    saved_search = SavedSearch(user_id=user_id, search=search, availability=availability)
+    db.session.add(saved_search)
+    db.session.flush()
+    skill = _search_skill(search)
+    if skill:
+        subscribe_skill(user_id, skill.id, saved_search.id)
+    db.session.commit()
+    return saved_search, skill
+
+
+def delete_saved_search(user_id, saved_search_id):
+    """Delete one of the user's saved searches and the subscription it created.
+
+    The subscription is handed to another of the user's saved searches naming
+    the same skill, if there is one, instead of being deleted.
+    """
+    subscription = SkillSubscription.query.filter_by(user_id=user_id, saved_search_id=saved_search_id).first()
+    if subscription:
+        other = next((saved_search for saved_search in get_saved_searches(user_id)
+                      if saved_search.id != saved_search_id
+                      and canonical_skill_key(saved_search.search) == subscription.skill.canonical_key), None)
+        if other:
+            subscription.saved_search_id = other.id
+        else:
+            db.session.delete(subscription)
+    deleted = SavedSearch.query.filter_by(id=saved_search_id, user_id=user_id).delete()
+    db.session.commit()
+    return deleted
+
+
+def get_saved_searches(user_id):
+    return SavedSearch.query.filter_by(user_id=user_id).order_by(SavedSearch.created_at.desc()).all()
+
+
+def get_subscriptions(user_id):
+    return SkillSubscription.query.filter_by(user_id=user_id).order_by(SkillSubscription.created_at.desc()).all()
+
+
+def fan_out_new_offers(offerer_id, skill_ids):
+    """Alert every subscriber of newly offered skills and return their ids. The caller commits.
+
+    Only the subscribers of `skill_ids` are touched, through the skill_id
+    index, and all alerts are written by one INSERT ... SELECT.
+    """
+    if not skill_ids:
+        return []
+    subscribed = (SkillSubscription.skill_id.in_(skill_ids), SkillSubscription.user_id != offerer_id)
+    user_ids = [row[0] for row in db.session.query(SkillSubscription.user_id).filter(*subscribed).distinct()]
+    if not user_ids:
+        return []
+    db.session.execute(insert(MatchAlert).from_select(
+        ['user_id', 'skill_id', 'offerer_id', 'is_read', 'created_at'],
+        select(SkillSubscription.user_id, SkillSubscription.skill_id, literal(offerer_id),
+               literal(False), literal(datetime.utcnow())).where(*subscribed)
+    ))
+    return user_ids
+
+
+def get_match_alerts(user_id):
+    return MatchAlert.query.filter_by(user_id=user_id).order_by(MatchAlert.id.desc()).limit(ALERTS_LIMIT).all()
+
+
+def mark_alerts_read(user_id):
+    updated = MatchAlert.query.filter_by(user_id=user_id, is_read=False).update(
+        {'is_read': True}, synchronize_session=False
+    )
+    db.session.commit()
+    if updated:
+        clear_alert_counts([user_id])
@@ -6,6 +6,8 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_caching import Cache
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
+from replicas import RoutingSession, replica_binds_from_env, init_replicas
+from ratelimit import init_ratelimit
 
 # Load environment variables from .env file
 load_dotenv()
@@ -17,16 +19,24 @@ logging.basicConfig(level=log_level)
 class Base(DeclarativeBase):
     pass
 
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={'class_': RoutingSession})
 cache = Cache()
 
 # Create the app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "skill-swap-secret-key-2025")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+# Trust one reverse proxy; x_for makes remote_addr the client's IP, which rate limits key anonymous clients on
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
+
+# Limit request bodies (profile photo uploads)
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', 5)) * 1024 * 1024
 
 # Configure caching
-app.config['CACHE_TYPE'] = 'simple'  # Use 'redis' for production with Redis
+# The default cache lives in each process. With several workers use a shared backend
+# (CACHE_TYPE=RedisCache with CACHE_REDIS_URL) so invalidations reach every worker
+app.config['CACHE_TYPE'] = os.environ.get('CACHE_TYPE', 'simple')
+if os.environ.get('CACHE_REDIS_URL'):
+    app.config['CACHE_REDIS_URL'] = os.environ['CACHE_REDIS_URL']
 app.config['CACHE_DEFAULT_TIMEOUT'] = 300  # 5 minutes
 
 # Configure the database with performance optimizations
@@ -34,25 +44,78 @@ app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_recycle": 300,
     "pool_pre_ping": True,
-    "pool_size": 10,  # Increase pool size
-    "max_overflow": 20,  # Allow more overflow connections
-    "pool_timeout": 30,  # Connection timeout
+    "pool_size": int(os.environ.get("DB_POOL_SIZE", 10)),  # Increase pool size
+    "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 20)),  # Allow more overflow connections
+    # Seconds to wait for a free connection; past this the request gets a fast 503
+    "pool_timeout": int(os.environ.get("DB_POOL_TIMEOUT", 3)),
     "echo": False,  # Disable SQL query logging for performance
 }
+# Optional read replicas (DATABASE_REPLICA_URLS) serve GET traffic on read-only routes
+app.config["SQLALCHEMY_BINDS"] = replica_binds_from_env()
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 # Initialize extensions
 db.init_app(app)
 cache.init_app(app)
+init_replicas(app)
+init_ratelimit(app)
 
 with app.app_context():
     # Import models and routes
     import models
     import routes
     
+    # Pool telemetry (/admin/pool) and per-route statement timeouts
+    from poolstats import init_pool_metrics
+    init_pool_metrics(app)
+    
     # Create all tables
     db.create_all()
     
+    # Canonical skill keys must exist before anything looks skills up by name
+    from skills import init_skills
+    init_skills(app)
+    
     # Add sample data if tables are empty
     from utils import create_sample_data
     create_sample_data()
+    
+    # Start the background job worker once tables exist
+    from jobs import init_jobs
+    init_jobs(app)
+    
+    from leaderboard import init_leaderboard
+    init_leaderboard(app)
+    
+    from inbox import init_inbox
+    init_inbox(app)
+    
+    from archive import init_archive
+    init_archive(app)
+    
+    from sync import init_sync
+    init_sync(app)
+    
+    from snapshot import init_snapshot
+    init_snapshot(app)
+    
+    # Profile view and swap request counters, buffered per worker (ENGAGEMENT_FLUSH_SECONDS)
+    from engagement import init_engagement
+    init_engagement(app)
+    
+    # Opt-in request profiling (PROFILE_SAMPLE_EVERY, PROFILE_ROUTES or an admin X-Profile header)
+    from profiling import init_profiling
+    init_profiling(app)
+    
+    # Fingerprinted, gzipped static files served with immutable caching
+    from assets import init_assets
+    init_assets(app)
+    
+    # Compile templates once, through the on-disk bytecode cache (JINJA_CACHE_DIR)
+    from streaming import init_templates
+    init_templates(app)
+    
+    # Precompute hot cache entries so the first visitors don't pay for them
+    if os.environ.get('CACHE_WARM_ON_BOOT', '1') == '1':
+        from warmup import warm_caches
+        warm_caches()
@@ -0,0 +1,162 @@
+import json
+import time
+import zlib
+import click
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from sqlalchemy import exists, or_
+from sqlalchemy.orm import selectinload
+from app import db
+from models import User, SwapRequest, Message, Rating, ConversationSummary, SwapArchive
+from sync import record_swap_change
+
+# Statuses after which a swap never changes again
+CLOSED_STATUSES = ('rejected', 'completed')
+# Archived swaps listed on /swap_requests
+ARCHIVED_LIST_LIMIT = 50
+
+
+def _serialize(swap_request, messages):
+    data = {
+        'id': swap_request.id,
+        'requester_id': swap_request.requester_id,
+        'receiver_id': swap_request.receiver_id,
+        'offered_skill': {'id': swap_request.offered_skill_id, 'name': swap_request.offered_skill.name},
+        'wanted_skill': {'id': swap_request.wanted_skill_id, 'name': swap_request.wanted_skill.name},
+        'message': swap_request.message,
+        'status': swap_request.status,
+        'created_at': swap_request.created_at.isoformat() if swap_request.created_at else None,
+        'updated_at': swap_request.updated_at.isoformat() if swap_request.updated_at else None,
+        'messages': [{
+            'id': m.id,
+            'sender_id': m.sender_id,
+            'receiver_id': m.receiver_id,
+            'content': m.content,
+            'created_at': m.created_at.isoformat() if m.created_at else None,
+        } for m in messages],
+    }
+    return zlib.compress(json.dumps(data).encode('utf-8'))
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def _unpack(archived):
+    data = json.loads(zlib.decompress(archived.payload))
+    messages = [SimpleNamespace(**dict(m, created_at=_parse_time(m['created_at']))) for m in data.pop('messages')]
+    swap_request = SimpleNamespace(**dict(
+        data,
+        offered_skill=SimpleNamespace(**data['offered_skill']),
+        wanted_skill=SimpleNamespace(**data['wanted_skill']),
+        offered_skill_id=data['offered_skill']['id'],
+        wanted_skill_id=data['wanted_skill']['id'],
+        created_at=_parse_time(data['created_at']),
+        updated_at=_parse_time(data['updated_at'])
+    ))
+    return swap_request, messages
+
+
+def load_archived_swap(swap_request_id):
+    """Rebuild an archived swap and its messages as read-only objects shaped like the models"""
+    archived = db.session.get(SwapArchive, swap_request_id)
+    if archived is None:
+        return None
+    return _unpack(archived)
+
+
+def get_archived_swaps(user_id, status='', limit=ARCHIVED_LIST_LIMIT):
+    """A user's archived swaps that no longer have a swap_request row, most recently closed first.
+
+    Archived swaps that kept their row (because of ratings) are still listed
+    with the live requests, so they're left out here. Returns read-only objects
+    shaped like SwapRequest, with requester, receiver and message_count set.
+    """
+    query = SwapArchive.query.filter(
+        SwapArchive.swap_removed == True,
+        or_(SwapArchive.requester_id == user_id, SwapArchive.receiver_id == user_id)
+    )
+    if status:
+        query = query.filter(SwapArchive.status == status)
+    archived = query.order_by(SwapArchive.closed_at.desc(), SwapArchive.swap_request_id.desc()).limit(limit).all()
+
+    user_ids = {row.requester_id for row in archived} | {row.receiver_id for row in archived}
+    users = {user.id: user for user in User.query.filter(User.id.in_(user_ids))} if user_ids else {}
+    swaps = []
+    for row in archived:
+        swap_request, _ = _unpack(row)
+        swap_request.requester = users.get(row.requester_id)
+        swap_request.receiver = users.get(row.receiver_id)
+        swap_request.message_count = row.message_count
+        swaps.append(swap_request)
+    return swaps
+
+
+def archive_batch(cutoff, after_id, batch_size):
+    """Archive up to `batch_size` swaps closed before `cutoff` with id > `after_id`.
+
+    Each batch commits on its own, so an interrupted run resumes where it
+    stopped. Swaps still referenced by ratings keep their row; only their
+    messages move. Returns the last swap id processed (None when nothing is
+    left) and the number of swaps archived.
+    """
+    swaps = SwapRequest.query.options(selectinload(SwapRequest.messages)).filter(
+        SwapRequest.id > after_id,
+        SwapRequest.status.in_(CLOSED_STATUSES),
+        SwapRequest.updated_at < cutoff,
+        ~exists().where(SwapArchive.swap_request_id == SwapRequest.id)
+    ).order_by(SwapRequest.id).limit(batch_size).all()
+    if not swaps:
+        return None, 0
+
+    swap_ids = [swap.id for swap in swaps]
+    rated_ids = {row[0] for row in db.session.query(Rating.swap_request_id).filter(
+        Rating.swap_request_id.in_(swap_ids)
+    ).distinct()}
+
+    db.session.add_all([SwapArchive(
+        swap_request_id=swap.id,
+        requester_id=swap.requester_id,
+        receiver_id=swap.receiver_id,
+        status=swap.status,
+        closed_at=swap.updated_at,
+        message_count=len(swap.messages),
+        swap_removed=swap.id not in rated_ids,
+        payload=_serialize(swap, sorted(swap.messages, key=lambda m: m.id))
+    ) for swap in swaps])
+
+    # Set-based deletes, children first
+    Message.query.filter(Message.swap_request_id.in_(swap_ids)).delete(synchronize_session=False)
+    ConversationSummary.query.filter(ConversationSummary.swap_request_id.in_(swap_ids)).delete(synchronize_session=False)
+    removable = [swap_id for swap_id in swap_ids if swap_id not in rated_ids]
+    if removable:
+        for swap in swaps:
+            if swap.id not in rated_ids:
+                record_swap_change(swap)
+        SwapRequest.query.filter(SwapRequest.id.in_(removable)).delete(synchronize_session=False)
+    db.session.commit()
+    db.session.expunge_all()
+    return swap_ids[-1], len(swap_ids)
+
+
+def archive_closed_swaps(days, batch_size=500, pause=0.1):
+    """Archive every swap closed for more than `days` days, pausing between batches"""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    last_id, total = 0, 0
+    while True:
+        last_id, archived = archive_batch(cutoff, last_id, batch_size)
+        if last_id is None:
+            return total
+        total += archived
+        time.sleep(pause)
+
+
+def init_archive(app):
+    @app.cli.command('archive-swaps')
+    @click.option('--days', default=180, show_default=True, help='Archive swaps closed for more than this many days.')
+    @click.option('--batch-size', default=500, show_default=True, help='Swaps moved per transaction.')
+    @click.option('--pause', default=0.1, show_default=True, help='Seconds to sleep between batches.')
+    def archive_swaps_command(days, batch_size, pause):
+        """Move long-closed swaps and their messages into the archive table."""
+        total = archive_closed_swaps(days, batch_size, pause)
+        print(f'Archived {total} swaps')
@@ -0,0 +1,185 @@
+# ASGI entry point: uvicorn asgi:app --workers 4
+#
+# The messaging and read-only API endpoints below run natively on asyncio with
+# async SQLAlchemy sessions, so an idle long-poll connection costs a coroutine
+# instead of a worker. Every other route is the unchanged Flask app, run in a
+# thread pool through WsgiToAsgi.
+import os
+import re
+import json
+import math
+import asyncio
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+from asgiref.wsgi import WsgiToAsgi
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import selectinload
+from app import app as flask_app
+from models import User, UserSkill, SwapRequest, Message
+from routes import get_all_skills_cached
+
+# Longest a long-poll request may wait for new messages
+MAX_POLL_WAIT = float(os.environ.get('ASGI_MAX_POLL_WAIT', 30))
+# How often a waiting long-poll checks for new messages
+POLL_INTERVAL = float(os.environ.get('ASGI_POLL_INTERVAL', 1))
+
+
+def async_database_url(url):
+    """Map the sync DATABASE_URL to its asyncio driver"""
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    if url.startswith('postgresql://'):
+        return 'postgresql+asyncpg://' + url[len('postgresql://'):]
+    if url.startswith('sqlite://'):
+        return 'sqlite+aiosqlite://' + url[len('sqlite://'):]
+    return url
+
+
+def _async_engine_options(url):
+    options = {'pool_recycle': 300, 'pool_pre_ping': True}
+    if not url.startswith('sqlite'):
+        options.update(pool_size=int(os.environ.get('ASGI_POOL_SIZE', 10)),
+                       max_overflow=int(os.environ.get('ASGI_MAX_OVERFLOW', 20)),
+                       pool_timeout=30)
+    return options
+
+
+_database_url = async_database_url(flask_app.config['SQLALCHEMY_DATABASE_URI'])
+# asyncpg takes sslmode as connect argument ssl, not as a URL query parameter
+_connect_args = {}
+if _database_url.startswith('postgresql+asyncpg') and 'sslmode=' in _database_url:
+    _database_url = re.sub(r'[?&](sslmode|channel_binding)=[^&]*', '', _database_url)
+    _connect_args['ssl'] = 'require'
+async_engine = create_async_engine(_database_url, connect_args=_connect_args,
+                                   **_async_engine_options(_database_url))
+AsyncSession = async_sessionmaker(async_engine, expire_on_commit=False)
+
+_session_serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+
+
+def _current_user_id(scope):
+    """Read user_id from the signed Flask session cookie"""
+    for name, value in scope['headers']:
+        if name == b'cookie':
+            cookie = SimpleCookie(value.decode('latin-1'))
+            morsel = cookie.get(flask_app.config['SESSION_COOKIE_NAME'])
+            if morsel:
+                try:
+                    return _session_serializer.loads(morsel.value).get('user_id')
+                except Exception:
+                    return None
+    return None
+
+
+async def _send_json(send, data, status=200, headers=()):
+    body = json.dumps(data).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())] + list(headers),
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def api_skills(scope, send):
+    # The catalog is process-cached; only the cold path touches the database (in a thread)
+    skills = await asyncio.to_thread(_cached_skills)
+    await _send_json(send, [{'id': skill[0], 'name': skill[1]} for skill in skills],
+                     headers=[(b'cache-control', b'public, max-age=300')])
+
+
+def _cached_skills():
+    with flask_app.app_context():
+        return get_all_skills_cached()
+
+
+async def api_user_skills(scope, send, user_id):
+    async with AsyncSession() as db_session:
+        user = await db_session.get(User, user_id, options=[
+            selectinload(User.skills_offered).selectinload(UserSkill.skill),
+            selectinload(User.skills_wanted).selectinload(UserSkill.skill)
+        ])
+        if user is None:
+            return await _send_json(send, {'error': 'Not found'}, status=404)
+        await _send_json(send, {
+            'offered': [{'id': us.skill.id, 'name': us.skill.name} for us in user.skills_offered],
+            'wanted': [{'id': us.skill.id, 'name': us.skill.name} for us in user.skills_wanted]
+        })
+
+
+async def api_messages(scope, send, swap_request_id):
+    """New messages after ?after=<id>, waiting up to ?wait=<seconds> for one to arrive"""
+    user_id = _current_user_id(scope)
+    if user_id is None:
+        return await _send_json(send, {'error': 'Login required'}, status=401)
+
+    params = parse_qs(scope['query_string'].decode())
+    try:
+        after_id = int(params.get('after', ['0'])[0])
+        wait = float(params.get('wait', ['0'])[0])
+        # nan and inf would never reach the deadline
+        if not math.isfinite(wait):
+            raise ValueError(wait)
+        wait = max(0.0, min(wait, MAX_POLL_WAIT))
+    except ValueError:
+        return await _send_json(send, {'error': 'Invalid parameters'}, status=400)
+
+    async with AsyncSession() as db_session:
+        swap_request = await db_session.get(SwapRequest, swap_request_id)
+        if swap_request is None:
+            return await _send_json(send, {'error': 'Not found'}, status=404)
+        if user_id not in (swap_request.requester_id, swap_request.receiver_id):
+            return await _send_json(send, {'error': 'Not a participant of this swap'}, status=403)
+
+    query = select(Message.id, Message.sender_id, Message.content, Message.created_at).where(
+        Message.swap_request_id == swap_request_id, Message.id > after_id
+    ).order_by(Message.id).limit(100)
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    while True:
+        # Check out a connection only for the query, never while idle
+        async with AsyncSession() as db_session:
+            rows = (await db_session.execute(query)).all()
+        if rows or loop.time() >= deadline:
+            break
+        await asyncio.sleep(min(POLL_INTERVAL, deadline - loop.time()))
+
+    await _send_json(send, [{
+        'id': row.id,
+        'sender_id': row.sender_id,
+        'content': row.content,
+        'created_at': row.created_at.isoformat()
+    } for row in rows])
+
+
+_async_routes = [
+    (re.compile(r'^/api/skills$'), api_skills),
+    (re.compile(r'^/api/user_skills/(\d+)$'), api_user_skills),
+    (re.compile(r'^/api/messages/(\d+)$'), api_messages),
+]
+
+_wsgi_app = WsgiToAsgi(flask_app)
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD'):
+        for pattern, handler in _async_routes:
+            match = pattern.match(scope['path'])
+            if match:
+                return await handler(scope, send, *(int(arg) for arg in match.groups()))
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    return await _wsgi_app(scope, receive, send)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await async_engine.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
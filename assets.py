@@ -0,0 +1,133 @@
+import os
+import json
+import gzip
+import hashlib
+import logging
+import mimetypes
+import tempfile
+from flask import request, send_from_directory, abort
+from werkzeug.security import safe_join
+
+logger = logging.getLogger(__name__)
+
+STATIC_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+# Fingerprinted copies and their .gz variants are written here, under /static/dist/
+DIST_DIR = 'dist'
+MANIFEST_PATH = os.path.join(STATIC_ROOT, DIST_DIR, 'manifest.json')
+# Build the assets when the app starts; turn off when a deploy step runs `flask build-assets`
+ASSETS_BUILD_ON_BOOT = os.environ.get('ASSETS_BUILD_ON_BOOT', '1') == '1'
+# The service worker keeps a stable URL and is served from /sw.js instead
+UNHASHED = {'sw.js'}
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.ico', '.map'}
+IMMUTABLE_MAX_AGE = 31536000
+
+_manifest = {}
+
+
+def _write(path, data):
+    # Written to a temporary file first so workers building at once never serve a partial file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as out:
+        out.write(data)
+    os.replace(temp_path, path)
+
+
+def build_assets():
+    """Fingerprint and gzip every static file; returns the manifest {logical path: hashed path}"""
+    manifest = {}
+    for directory, subdirectories, filenames in os.walk(STATIC_ROOT):
+        if directory == STATIC_ROOT:
+            subdirectories[:] = [name for name in subdirectories if name != DIST_DIR]
+        for filename in filenames:
+            source = os.path.join(directory, filename)
+            logical = os.path.relpath(source, STATIC_ROOT).replace(os.sep, '/')
+            if logical in UNHASHED:
+                continue
+            with open(source, 'rb') as f:
+                data = f.read()
+            stem, extension = os.path.splitext(logical)
+            hashed = f'{DIST_DIR}/{stem}.{hashlib.sha256(data).hexdigest()[:12]}{extension}'
+            target = os.path.join(STATIC_ROOT, hashed)
+            if not os.path.exists(target):
+                _write(target, data)
+                if extension in COMPRESSIBLE:
+                    # mtime=0 keeps the .gz byte-identical across builds
+                    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+                    if len(compressed) < len(data):
+                        _write(target + '.gz', compressed)
+            manifest[logical] = hashed
+    _write(MANIFEST_PATH, json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+def load_manifest():
+    global _manifest
+    try:
+        with open(MANIFEST_PATH) as f:
+            _manifest = json.load(f)
+    except (OSError, ValueError):
+        _manifest = {}
+    return _manifest
+
+
+def asset_version():
+    """Short digest of the manifest; changes whenever any asset does"""
+    return hashlib.sha256(json.dumps(_manifest, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def hashed_asset_urls():
+    return {f'/static/{logical}': f'/static/{hashed}' for logical, hashed in _manifest.items()}
+
+
+def service_worker_script():
+    """static/sw.js with the asset version and fingerprinted URLs prepended"""
+    with open(os.path.join(STATIC_ROOT, 'sw.js')) as f:
+        source = f.read()
+    return (f'const ASSET_VERSION = {json.dumps(asset_version())};\n'
+            f'const ASSET_URLS = {json.dumps(hashed_asset_urls(), sort_keys=True)};\n' + source)
+
+
+def serve_static(filename):
+    """Flask's static view, plus precompressed, year-long immutable responses for fingerprinted files"""
+    if not filename.startswith(DIST_DIR + '/'):
+        return send_from_directory(STATIC_ROOT, filename)
+    path = safe_join(STATIC_ROOT, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    encoding = None
+    if 'gzip' in request.accept_encodings and os.path.isfile(path + '.gz'):
+        encoding = 'gzip'
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = send_from_directory(STATIC_ROOT, filename + '.gz' if encoding else filename,
+                                   mimetype=mimetype, conditional=True, max_age=IMMUTABLE_MAX_AGE)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def init_assets(app):
+    if ASSETS_BUILD_ON_BOOT:
+        try:
+            build_assets()
+        except OSError as e:
+            logger.warning(f'Could not build static assets: {e}')
+    load_manifest()
+
+    app.view_functions['static'] = serve_static
+
+    # Every url_for('static', filename=...) gets the fingerprinted file when there is one
+    @app.url_defaults
+    def fingerprint_static(endpoint, values):
+        if endpoint == 'static' and values.get('filename') in _manifest:
+            values['filename'] = _manifest[values['filename']]
+
+    @app.cli.command('build-assets')
+    def build_assets_command():
+        """Fingerprint and gzip static files and write static/dist/manifest.json."""
+        manifest = build_assets()
+        print(f'Built {len(manifest)} assets into {os.path.join(STATIC_ROOT, DIST_DIR)}')
@@ -0,0 +1,89 @@
+from sqlalchemy import select, or_, func, literal
+from app import db, cache
+from models import User, Skill, UserSkill
+
+# Skills listed in the "top skills" facet
+TOP_SKILL_FACETS = 10
+
+
+def normalize_query(value):
+    return ' '.join(value.split()).lower()
+
+
+def directory_filters(search_query, availability_filter):
+    """Criteria on User shared by the directory listing and its facet counts"""
+    criteria = [User.is_public == True, User.is_banned == False]
+
+    if search_query:
+        skill_users = select(UserSkill.user_id).join(Skill).where(
+            Skill.name.ilike(f'%{search_query}%'),
+            Skill.is_approved == True
+        )
+        criteria.append(or_(
+            User.name.ilike(f'%{search_query}%'),
+            User.location.ilike(f'%{search_query}%'),
+            User.id.in_(skill_users)
+        ))
+
+    if availability_filter:
+        criteria.append(User.availability.ilike(f'%{availability_filter}%'))
+
+    return criteria
+
+
+def availability_facet(value_counts):
+    """Users per availability term, counted the way the availability filter matches them.
+
+    Availability is free text such as "Weekends, Evenings" and the filter matches
+    every user whose availability contains the chosen text, so each comma-separated
+    term counts all users whose availability contains it, not only exact matches.
+    """
+    terms = {}
+    for value, _ in value_counts:
+        for term in value.split(','):
+            if term.strip():
+                terms.setdefault(term.strip().lower(), term.strip())
+    return [(term, sum(count for value, count in value_counts if key in value.lower()))
+            for key, term in terms.items()]
+
+
+def get_directory_facets(search_query, availability_filter):
+    """Result counts per skill category, offered skill and availability for a directory search"""
+    return _directory_facets(normalize_query(search_query), normalize_query(availability_filter))
+
+
+def clear_directory_facets():
+    """Drop every cached facet result, e.g. after users leave the directory"""
+    cache.delete_memoized(_directory_facets)
+
+
+@cache.memoize(timeout=60)  # Cache for 1 minute per normalized query
+def _directory_facets(search_query, availability_filter):
+    matched = select(User.id, User.availability).where(
+        *directory_filters(search_query, availability_filter)
+    ).cte('matched')
+
+    offered = select(matched.c.id.label('user_id'), Skill.name, Skill.category).select_from(matched).join(
+        UserSkill, (UserSkill.user_id == matched.c.id) & (UserSkill.skill_type == 'offered')
+    ).join(Skill, Skill.id == UserSkill.skill_id).where(Skill.is_approved == True).subquery()
+
+    # All three facets in one round trip
+    statement = select(
+        literal('category').label('facet'), offered.c.category.label('value'),
+        func.count(func.distinct(offered.c.user_id)).label('count')
+    ).where(offered.c.category.isnot(None)).group_by(offered.c.category).union_all(
+        select(literal('skill'), offered.c.name, func.count(func.distinct(offered.c.user_id))
+               ).group_by(offered.c.name),
+        select(literal('availability'), matched.c.availability, func.count()
+               ).where(matched.c.availability.isnot(None), matched.c.availability != ''
+               ).group_by(matched.c.availability)
+    )
+
+    facets = {'category': [], 'skill': [], 'availability': []}
+    for facet, value, count in db.session.execute(statement):
+        facets[facet].append((value, count))
+    facets['availability'] = availability_facet(facets['availability'])
+    for values in facets.values():
+        values.sort(key=lambda item: (-item[1], item[0]))
+    facets['skill'] = facets['skill'][:TOP_SKILL_FACETS]
+    return facets
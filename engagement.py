@@ -0,0 +1,132 @@
+import os
+import atexit
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from models import EngagementCounter
+
+logger = logging.getLogger(__name__)
+
+PLATFORM = 0
+METRICS = ('profile_view', 'request_sent', 'request_received')
+# Seconds between flushes; a worker that dies without a clean exit loses at most this much
+ENGAGEMENT_FLUSH_SECONDS = float(os.environ.get('ENGAGEMENT_FLUSH_SECONDS', 10))
+# Flush early once this many distinct counters are pending
+ENGAGEMENT_MAX_PENDING = int(os.environ.get('ENGAGEMENT_MAX_PENDING', 1000))
+
+# (subject id, metric) -> increments this worker hasn't written yet
+_pending = Counter()
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_flusher_pid = None
+_app = None
+
+
+def count_event(metric, user_id):
+    """Count one event for a user and the platform total; written to the database on the next flush"""
+    with _lock:
+        _pending[(user_id, metric)] += 1
+        _pending[(PLATFORM, metric)] += 1
+        full = len(_pending) >= ENGAGEMENT_MAX_PENDING
+    _ensure_flusher()
+    if full:
+        _wakeup.set()
+
+
+def get_engagement(subject_id):
+    """{metric: count} for a user (or PLATFORM): the stored totals plus this worker's unflushed increments"""
+    counts = dict.fromkeys(METRICS, 0)
+    counts.update(db.session.query(EngagementCounter.metric, EngagementCounter.count).filter(
+        EngagementCounter.subject_id == subject_id).all())
+    with _lock:
+        for metric in METRICS:
+            counts[metric] += _pending.get((subject_id, metric), 0)
+    return counts
+
+
+def _upsert_statement():
+    # Add to the stored count instead of overwriting it, so concurrent workers' flushes never clobber each other
+    dialect = db.session.get_bind(EngagementCounter).dialect.name
+    if dialect not in ('postgresql', 'sqlite'):
+        return None
+    statement = (postgresql if dialect == 'postgresql' else sqlite).insert(EngagementCounter)
+    return statement.on_conflict_do_update(
+        index_elements=[EngagementCounter.subject_id, EngagementCounter.metric],
+        set_={'count': EngagementCounter.count + statement.excluded['count'],
+              'updated_at': statement.excluded.updated_at}
+    )
+
+
+def flush_engagement():
+    """Write this worker's pending increments as one batched upsert; returns the number of counters written"""
+    global _pending
+    with _lock:
+        batch, _pending = _pending, Counter()
+    if not batch:
+        return 0
+
+    now = datetime.utcnow()
+    # Sorted so concurrent flushes lock rows in the same order and can't deadlock
+    rows = [{'subject_id': subject_id, 'metric': metric, 'count': count, 'updated_at': now}
+            for (subject_id, metric), count in sorted(batch.items())]
+    try:
+        statement = _upsert_statement()
+        if statement is not None:
+            db.session.execute(statement, rows)
+        else:
+            for row in rows:
+                updated = EngagementCounter.query.filter_by(subject_id=row['subject_id'], metric=row['metric']).update(
+                    {'count': EngagementCounter.count + row['count'], 'updated_at': now})
+                if not updated:
+                    db.session.execute(insert(EngagementCounter), row)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        # Put the batch back so the next flush retries it
+        with _lock:
+            _pending.update(batch)
+        logger.error(f'Engagement counter flush failed: {e}')
+        return 0
+    return len(rows)
+
+
+def _run_flusher():
+    while True:
+        _wakeup.wait(ENGAGEMENT_FLUSH_SECONDS)
+        _wakeup.clear()
+        with _app.app_context():
+            flush_engagement()
+
+
+def _flush_at_exit():
+    if _app is not None and _pending:
+        with _app.app_context():
+            flush_engagement()
+
+
+def _ensure_flusher():
+    # Started lazily in the process that counts, so every forked Gunicorn worker gets its own
+    global _flusher_pid
+    if _flusher_pid == os.getpid() or _app is None:
+        return
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    threading.Thread(target=_run_flusher, name='engagement-flusher', daemon=True).start()
+
+
+def init_engagement(app):
+    global _app
+    _app = app
+    atexit.register(_flush_at_exit)
+
+    @app.cli.command('engagement-stats')
+    def engagement_stats_command():
+        """Show the platform-wide engagement totals."""
+        for metric, count in get_engagement(PLATFORM).items():
+            print(f'{metric}: {count}')
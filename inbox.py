@@ -0,0 +1,87 @@
+from datetime import datetime
+from sqlalchemy import func
+from app import db
+from models import SwapRequest, Message, ConversationSummary
+
+PREVIEW_LENGTH = 100
+
+
+def _preview(content):
+    return content if len(content) <= PREVIEW_LENGTH else content[:PREVIEW_LENGTH - 1] + '…'
+
+
+def open_conversation(swap_request):
+    """Create both participants' summary rows when a swap is accepted. The caller commits."""
+    now = datetime.utcnow()
+    for user_id, other_user_id in ((swap_request.requester_id, swap_request.receiver_id),
+                                   (swap_request.receiver_id, swap_request.requester_id)):
+        if not ConversationSummary.query.filter_by(swap_request_id=swap_request.id, user_id=user_id).first():
+            db.session.add(ConversationSummary(swap_request_id=swap_request.id, user_id=user_id,
+                                               other_user_id=other_user_id, last_activity=now))
+
+
+def record_message(message):
+    """Update both participants' summaries for a new message. The caller commits."""
+    values = {
+        'last_message_preview': _preview(message.content),
+        'last_sender_id': message.sender_id,
+        'last_activity': message.created_at or datetime.utcnow(),
+    }
+    for user_id, other_user_id, unread_increment in ((message.sender_id, message.receiver_id, 0),
+                                                     (message.receiver_id, message.sender_id, 1)):
+        # Increment in SQL so concurrent messages don't lose unread counts
+        updated = ConversationSummary.query.filter_by(
+            swap_request_id=message.swap_request_id, user_id=user_id
+        ).update(dict(values, unread_count=ConversationSummary.unread_count + unread_increment),
+                 synchronize_session=False)
+        if not updated:
+            db.session.add(ConversationSummary(swap_request_id=message.swap_request_id, user_id=user_id,
+                                               other_user_id=other_user_id, unread_count=unread_increment,
+                                               **values))
+
+
+def mark_conversation_read(swap_request_id, user_id):
+    """Reset a participant's unread count. The caller commits."""
+    ConversationSummary.query.filter(
+        ConversationSummary.swap_request_id == swap_request_id,
+        ConversationSummary.user_id == user_id,
+        ConversationSummary.unread_count > 0
+    ).update({'unread_count': 0}, synchronize_session=False)
+
+
+def get_inbox_page(user_id, page, per_page):
+    """One page of a user's conversations, newest activity first, and whether more follow"""
+    rows = ConversationSummary.query.filter_by(user_id=user_id).order_by(
+        ConversationSummary.last_activity.desc()
+    ).offset((page - 1) * per_page).limit(per_page + 1).all()
+    return rows[:per_page], len(rows) > per_page
+
+
+def rebuild_conversation_summaries():
+    """Recompute every summary from the message table"""
+    ConversationSummary.query.delete()
+    for swap_request in SwapRequest.query.filter_by(status='accepted').all():
+        open_conversation(swap_request)
+    db.session.flush()
+
+    last_ids = db.session.query(func.max(Message.id)).group_by(Message.swap_request_id)
+    for message in Message.query.filter(Message.id.in_(last_ids)).all():
+        record_message(message)
+    db.session.flush()
+
+    ConversationSummary.query.update({'unread_count': 0}, synchronize_session=False)
+    unread = db.session.query(Message.swap_request_id, Message.receiver_id, func.count(Message.id)).filter(
+        Message.is_read == False
+    ).group_by(Message.swap_request_id, Message.receiver_id).all()
+    for swap_request_id, receiver_id, count in unread:
+        ConversationSummary.query.filter_by(swap_request_id=swap_request_id, user_id=receiver_id).update(
+            {'unread_count': count}, synchronize_session=False)
+    db.session.commit()
+
+
+def init_inbox(app):
+    @app.cli.command('rebuild-inbox')
+    def rebuild_inbox_command():
+        """Recompute conversation summaries from existing messages."""
+        rebuild_conversation_summaries()
+        print(f'Rebuilt {ConversationSummary.query.count()} conversation summaries')
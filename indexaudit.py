@@ -0,0 +1,363 @@
+# Index audit: captures the SQL issued by the main pages, EXPLAINs it, and reports
+# indexes no captured plan uses, indexes made redundant by a wider one, and
+# low-cardinality indexes. It then times inserts into the busiest tables with and
+# without those indexes to show their write cost.
+#
+#   python indexaudit.py
+#   python indexaudit.py --seed 500 --database-url postgresql://...
+#   python indexaudit.py --check          # plan-regression check only; exits 1 on a regression
+#
+# The plan-regression check EXPLAINs each query in hot_queries() and fails when
+# its plan no longer uses the index it was designed around. Works on SQLite and
+# PostgreSQL; on PostgreSQL sequential scans are disabled while explaining so small
+# test databases still show which index the planner would pick.
+import os
+import re
+import sys
+import time
+import shutil
+import sqlite3
+import argparse
+import tempfile
+from collections import defaultdict
+from datetime import datetime
+
+WRITE_TABLES = ('user', 'swap_request', 'message')
+# Statements that can use an index; INSERTs are measured separately
+EXPLAINABLE = ('SELECT', 'WITH', 'UPDATE', 'DELETE')
+LOW_CARDINALITY_MIN_ROWS = 100
+
+
+def hot_queries():
+    """(name, statement, accepted index names) for the queries each composite index exists for"""
+    from sqlalchemy import select, func, exists
+    from sqlalchemy.orm import aliased
+    from models import (User, Skill, UserSkill, SwapRequest, Rating, Message, Job, LeaderboardEntry,
+                        ConversationSummary, ChangeLog, SkillSubscription, MatchAlert)
+    now = datetime.utcnow()
+    newer = aliased(ChangeLog)
+    return [
+        ('login by username', select(User).where(User.username == 'marc_demo'),
+         {'ix_user_username', 'sqlite_autoindex_user_1'}),
+        ('skill by canonical key', select(Skill).where(Skill.canonical_key == 'python'),
+         {'ix_skill_canonical_key'}),
+        ('user skills by type', select(UserSkill).where(UserSkill.user_id == 2, UserSkill.skill_type == 'offered'),
+         {'idx_user_skill_type'}),
+        ('received requests by status',
+         select(SwapRequest).where(SwapRequest.receiver_id == 2, SwapRequest.status == 'pending'),
+         {'idx_receiver_status'}),
+        ('sent requests by status',
+         select(SwapRequest).where(SwapRequest.requester_id == 2, SwapRequest.status == 'accepted'),
+         {'idx_requester_status'}),
+        ('conversation messages',
+         select(Message).where(Message.swap_request_id == 2).order_by(Message.created_at),
+         {'idx_swap_request_created'}),
+        ('unread messages',
+         select(func.count()).select_from(Message).where(Message.receiver_id == 2, Message.is_read == False),
+         {'idx_receiver_read'}),
+        ('inbox page',
+         select(ConversationSummary).where(ConversationSummary.user_id == 2).order_by(
+             ConversationSummary.last_activity.desc()).limit(20),
+         {'idx_conversation_user_activity'}),
+        ('due jobs',
+         select(Job.id).where(Job.status == 'queued', Job.run_at <= now).order_by(Job.run_at).limit(10),
+         {'idx_job_status_run_at'}),
+        ('leaderboard top',
+         select(LeaderboardEntry).where(LeaderboardEntry.scope == 'all', LeaderboardEntry.scope_key == '').order_by(
+             LeaderboardEntry.score.desc()).limit(20),
+         {'idx_leaderboard_scope_score'}),
+        ('sync changes for user',
+         select(ChangeLog).where(ChangeLog.audience_id == 2, ChangeLog.id > 0).order_by(ChangeLog.id),
+         {'idx_change_log_audience'}),
+        ('skill subscribers',
+         select(SkillSubscription.user_id).where(SkillSubscription.skill_id == 1),
+         {'uq_skill_subscriber', 'sqlite_autoindex_skill_subscription_1'}),
+        ('unread alerts',
+         select(func.count()).select_from(MatchAlert).where(MatchAlert.user_id == 2, MatchAlert.is_read == False),
+         {'idx_match_alert_user'}),
+        # Write paths and background jobs, which the captured page workload doesn't cover
+        ('job dedup', select(Job.status).where(Job.dedup_key == 'refresh_availability_options'),
+         {'ix_job_dedup_key'}),
+        ('leaderboard refresh', select(LeaderboardEntry.id).where(LeaderboardEntry.user_id == 2),
+         {'ix_leaderboard_entry_user_id'}),
+        ('existing rating', select(Rating.id).where(Rating.swap_request_id == 2, Rating.rater_id == 2),
+         {'ix_rating_swap_request_id', 'ix_rating_rater_id'}),
+        ('change log compaction', select(ChangeLog.id).where(exists().where(
+            newer.entity == ChangeLog.entity, newer.entity_id == ChangeLog.entity_id,
+            newer.audience_id == ChangeLog.audience_id, newer.id > ChangeLog.id)),
+         {'idx_change_log_entity'}),
+    ]
+
+
+def prepare(args):
+    """Point the app at the database (seeding load accounts if asked) and return (app, db)"""
+    database_url = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'indexaudit.db')
+    if args.seed:
+        from loadtest import seed_database
+        seed_database(database_url, args.seed)
+    os.environ.update(DATABASE_URL=database_url, JOBS_INPROCESS='0', CACHE_WARM_ON_BOOT='0',
+                      RATE_LIMIT_ENABLED='0', STREAM_TEMPLATES='0')
+    from app import app, db
+    return app, db
+
+
+def explain(connection, statement, parameters=()):
+    """Names of the indexes the plan for `statement` reads"""
+    if connection.dialect.name == 'postgresql':
+        plan = connection.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + statement, parameters).scalar()
+        names, nodes = set(), [plan[0]['Plan']]
+        while nodes:
+            node = nodes.pop()
+            if 'Index Name' in node:
+                names.add(node['Index Name'])
+            nodes.extend(node.get('Plans', []))
+        return names
+    rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+    return {match for row in rows for match in re.findall(r'USING (?:COVERING )?INDEX (\w+)', row[-1])}
+
+
+def explain_connection(db):
+    connection = db.engine.connect()
+    if connection.dialect.name == 'postgresql':
+        connection.exec_driver_sql('SET enable_seqscan = off')
+    return connection
+
+
+def check_plans(db):
+    """Print each hot query's plan verdict; returns the names of regressed queries"""
+    failures = []
+    with explain_connection(db) as connection:
+        for name, statement, accepted in hot_queries():
+            sql = str(statement.compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True}))
+            used = explain(connection, sql)
+            ok = bool(used & accepted)
+            print(f"{'ok ' if ok else 'FAIL'} {name:<30} uses {', '.join(sorted(used)) or 'no index'}"
+                  + ('' if ok else f" (expected {' or '.join(sorted(accepted))})"))
+            if not ok:
+                failures.append(name)
+    return failures
+
+
+def workload_paths(db):
+    from models import SwapRequest, User
+    user = User.query.filter_by(username='marc_demo').first()
+    other = User.query.filter(User.id != user.id, User.is_admin == False).first()
+    swap = SwapRequest.query.filter(
+        SwapRequest.status == 'accepted',
+        (SwapRequest.requester_id == user.id) | (SwapRequest.receiver_id == user.id)
+    ).first()
+    paths = ['/', '/?search=Python', '/?availability=Weekends', '/?page=2', '/profile', f'/user/{other.id}',
+             '/swap_requests', '/swap_requests?status=pending', '/inbox', '/notifications', '/leaderboard',
+             '/api/skills', '/api/sync', '/api/skill_suggestions?q=pythn', f'/send_request/{other.id}']
+    if swap:
+        paths.append(f'/messages/{swap.id}')
+    return [('marc_demo', 'password123', paths), ('admin', 'admin123', ['/admin'])]
+
+
+def capture_workload(app, db):
+    """Run the main pages through the test client; returns {(endpoint, statement): parameters}"""
+    from flask import request, has_request_context
+    from sqlalchemy import event
+
+    captured = {}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if executemany or not statement.lstrip().upper().startswith(EXPLAINABLE):
+            return
+        endpoint = request.endpoint if has_request_context() else None
+        captured.setdefault((endpoint, statement), parameters)
+
+    with app.app_context():
+        paths = workload_paths(db)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            for username, password, user_paths in paths:
+                client = app.test_client()
+                client.post('/login', data={'username': username, 'password': password})
+                for path in user_paths:
+                    response = client.get(path)
+                    response.get_data()
+                    if response.status_code >= 400:
+                        print(f'warning: GET {path} returned {response.status_code}')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+    return captured
+
+
+def audit_indexes(db, captured):
+    """Classify every named index as used, unused, redundant or low cardinality"""
+    from sqlalchemy import inspect, Boolean
+
+    used = defaultdict(set)
+    with explain_connection(db) as connection:
+        for (endpoint, statement), parameters in captured.items():
+            try:
+                for name in explain(connection, statement, parameters):
+                    used[name].add(endpoint or 'startup')
+            except Exception as e:
+                print(f'warning: could not explain for {endpoint}: {type(e).__name__}')
+        for _, statement, _ in hot_queries():
+            sql = str(statement.compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True}))
+            for name in explain(connection, sql):
+                used[name].add('hot query')
+
+    inspector = inspect(db.engine)
+    findings = []
+    for table in inspector.get_table_names():
+        indexes = inspector.get_indexes(table)
+        column_types = {column['name']: column['type'] for column in inspector.get_columns(table)}
+        row_count = db.session.execute(db.text(f'SELECT COUNT(*) FROM "{table}"')).scalar()
+        for index in indexes:
+            columns = index['column_names']
+            wider = [other['name'] for other in indexes if other is not index
+                     and len(other['column_names']) > len(columns)
+                     and other['column_names'][:len(columns)] == columns]
+            distinct = None
+            if len(columns) == 1:
+                distinct = db.session.execute(db.text(
+                    f'SELECT COUNT(DISTINCT "{columns[0]}") FROM "{table}"')).scalar()
+            # Booleans always qualify; other columns only once the table holds enough rows to tell
+            low_cardinality = len(columns) == 1 and (
+                isinstance(column_types[columns[0]], Boolean)
+                or (row_count >= LOW_CARDINALITY_MIN_ROWS and distinct <= 2)
+            )
+            findings.append({
+                'table': table,
+                'name': index['name'],
+                'columns': columns,
+                'unique': bool(index.get('unique')),
+                'used_by': sorted(used.get(index['name'], ())),
+                'redundant_with': wider,
+                'distinct_values': distinct,
+                'low_cardinality': low_cardinality,
+            })
+    return findings
+
+
+def drop_candidates(findings):
+    """Non-unique indexes that no plan used, or that a wider index being kept makes redundant.
+
+    Widest indexes are decided first, so a used index is never suggested for
+    dropping alongside the wider, unused index that made it look redundant.
+    """
+    dropped = set()
+    for f in sorted(findings, key=lambda f: -len(f['columns'])):
+        kept_wider = [name for name in f['redundant_with'] if (f['table'], name) not in dropped]
+        if not f['unique'] and (not f['used_by'] or kept_wider):
+            dropped.add((f['table'], f['name']))
+    return [f for f in findings if (f['table'], f['name']) in dropped]
+
+
+def insert_rows(connection, table, rows):
+    from sqlalchemy import text
+    ids = {name: connection.execute(text(f'SELECT MIN(id) FROM "{name}"')).scalar()
+           for name in ('user', 'skill', 'swap_request')}
+    now = datetime.utcnow()
+    started = time.perf_counter()
+    for i in range(rows):
+        if table == 'user':
+            connection.execute(text(
+                'INSERT INTO "user" (username, password_hash, name, location, availability, '
+                'is_public, is_admin, is_banned, created_at) '
+                'VALUES (:username, :hash, :name, :location, :availability, :public, :admin, :banned, :now)'
+            ), {'username': f'audit_{i}', 'hash': 'x', 'name': f'Audit {i}', 'location': 'Nowhere',
+                'availability': 'Weekends', 'public': True, 'admin': False, 'banned': False, 'now': now})
+        elif table == 'swap_request':
+            connection.execute(text(
+                'INSERT INTO swap_request (requester_id, receiver_id, offered_skill_id, wanted_skill_id, '
+                'status, created_at) VALUES (:user, :user, :skill, :skill, :status, :now)'
+            ), {'user': ids['user'], 'skill': ids['skill'], 'status': 'pending', 'now': now})
+        else:
+            connection.execute(text(
+                'INSERT INTO message (swap_request_id, sender_id, receiver_id, content, is_read, created_at) '
+                'VALUES (:swap, :user, :user, :content, :read, :now)'
+            ), {'swap': ids['swap_request'], 'user': ids['user'], 'content': 'audit', 'read': False, 'now': now})
+    return (time.perf_counter() - started) / rows
+
+
+def write_cost(db, table, drop, rows):
+    """Seconds per inserted row with all indexes, then with `drop` removed; nothing is kept"""
+    from sqlalchemy import create_engine, text
+
+    engine, scratch = db.engine, None
+    if engine.dialect.name == 'sqlite':
+        # SQLite commits DDL outside a transaction, so work on a copy of the file
+        scratch = tempfile.mkdtemp()
+        copy = os.path.join(scratch, 'copy.db')
+        source = sqlite3.connect(engine.url.database)
+        target = sqlite3.connect(copy)
+        source.backup(target)
+        source.close()
+        target.close()
+        engine = create_engine(f'sqlite:///{copy}')
+    try:
+        costs = []
+        for names in ((), drop):
+            with engine.connect() as connection:
+                transaction = connection.begin()
+                try:
+                    for name in names:
+                        connection.execute(text(f'DROP INDEX "{name}"'))
+                    costs.append(insert_rows(connection, table, rows))
+                finally:
+                    transaction.rollback()
+        return costs
+    finally:
+        if scratch:
+            engine.dispose()
+            shutil.rmtree(scratch, ignore_errors=True)
+
+
+def print_report(findings, rows, db):
+    print(f"\n{'index':<40}{'columns':<36}{'distinct':>9}  used by")
+    for f in sorted(findings, key=lambda f: (f['table'], f['name'])):
+        notes = list(f['used_by'])
+        if f['redundant_with']:
+            notes.append(f"redundant with {', '.join(f['redundant_with'])}")
+        if f['unique']:
+            notes.append('unique')
+        distinct = '' if f['distinct_values'] is None else f['distinct_values']
+        print(f"{f['name']:<40}{', '.join(f['columns']):<36}{distinct:>9}  {'; '.join(notes) or 'UNUSED'}")
+
+    low = [f['name'] for f in findings if f['low_cardinality']]
+    if low:
+        print(f"\nLow cardinality (boolean or two or fewer values): {', '.join(sorted(low))}")
+
+    candidates = drop_candidates(findings)
+    print('\nWrite amplification (per inserted row):')
+    for table in WRITE_TABLES:
+        drop = [f['name'] for f in candidates if f['table'] == table]
+        count = sum(1 for f in findings if f['table'] == table)
+        before, after = write_cost(db, table, drop, rows)
+        print(f'  {table:<14}{count:>3} indexes {before * 1e6:>8.0f} us   '
+              f'without {len(drop)} candidates {after * 1e6:>8.0f} us   ({(after - before) / before:+.0%})')
+
+    if candidates:
+        print('\nCandidates to drop (check against production traffic first):')
+        for f in candidates:
+            print(f'  DROP INDEX {f["name"]};')
+
+
+def main(args):
+    app, db = prepare(args)
+    with app.app_context():
+        print('Hot query plans:')
+        failures = check_plans(db)
+    if args.check:
+        sys.exit(1 if failures else 0)
+
+    captured = capture_workload(app, db)
+    with app.app_context():
+        print(f'\nCaptured {len(captured)} distinct statements from {len({e for e, _ in captured})} endpoints')
+        findings = audit_indexes(db, captured)
+        print_report(findings, args.rows, db)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Audit indexes against captured query plans')
+    parser.add_argument('--database-url', help='Database to audit (default: a fresh SQLite file with sample data)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed this many load-test account pairs first')
+    parser.add_argument('--rows', type=int, default=500, help='Rows inserted per write-cost measurement')
+    parser.add_argument('--check', action='store_true', help='Only run the hot query plan-regression check')
+    main(parser.parse_args())
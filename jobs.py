@@ -0,0 +1,207 @@
+import os
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import event, update, or_, and_, func
+from app import db
+from models import Job
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKER_THREADS = int(os.environ.get('JOB_WORKER_THREADS', 2))
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1))
+JOB_RETRY_DELAY = float(os.environ.get('JOB_RETRY_DELAY', 5))  # Doubled on every retry
+JOB_LOCK_TIMEOUT = int(os.environ.get('JOB_LOCK_TIMEOUT', 300))  # Reclaim jobs from crashed workers
+
+# Registered job handlers by name
+_handlers = {}
+
+# Per-process counters: enqueued, deduplicated, succeeded, retried, failed
+_metrics = Counter()
+_metrics_lock = threading.Lock()
+
+# Wakes the in-process worker as soon as a transaction with new jobs commits
+_wakeup = threading.Event()
+
+
+def job(name):
+    """Register a function as the handler for jobs called `name`"""
+    def decorator(func):
+        _handlers[name] = func
+        return func
+    return decorator
+
+
+def _count(metric, n=1):
+    with _metrics_lock:
+        _metrics[metric] += n
+
+
+def enqueue(name, payload=None, dedup_key=None, delay=0, max_attempts=3):
+    """Add a job to the current transaction; it runs once the caller commits.
+
+    If `dedup_key` is given and a queued job with the same key exists, nothing
+    is added and None is returned.
+    """
+    if name not in _handlers:
+        raise ValueError(f'Unknown job: {name}')
+
+    # Filter on the key alone: with a status filter too, SQLite reads every queued job off the status index
+    if dedup_key and 'queued' in {row[0] for row in db.session.query(Job.status).filter_by(dedup_key=dedup_key)}:
+        _count('deduplicated')
+        return None
+
+    new_job = Job(
+        name=name,
+        payload=payload or {},
+        dedup_key=dedup_key,
+        max_attempts=max_attempts,
+        run_at=datetime.utcnow() + timedelta(seconds=delay)
+    )
+    db.session.add(new_job)
+    db.session.info['jobs_enqueued'] = True
+    _count('enqueued')
+    return new_job
+
+
+@event.listens_for(db.session, 'after_commit')
+def _wake_worker(db_session):
+    if db_session.info.pop('jobs_enqueued', False):
+        _wakeup.set()
+
+
+def job_metrics():
+    """Process-local counters plus the current queue depth by status"""
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    depth = db.session.query(Job.status, func.count(Job.id)).group_by(Job.status).all()
+    metrics['queue'] = {status: count for status, count in depth}
+    return metrics
+
+
+def _claim_jobs(limit):
+    """Atomically move up to `limit` due jobs to running and return their ids"""
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=JOB_LOCK_TIMEOUT)
+    candidates = [row[0] for row in db.session.query(Job.id).filter(or_(
+        and_(Job.status == 'queued', Job.run_at <= now),
+        and_(Job.status == 'running', Job.locked_at < stale)
+    )).order_by(Job.run_at).limit(limit).all()]
+
+    claimed = []
+    for job_id in candidates:
+        # Conditional update so two workers can never claim the same job
+        result = db.session.execute(update(Job).where(
+            Job.id == job_id,
+            or_(Job.status == 'queued', and_(Job.status == 'running', Job.locked_at < stale))
+        ).values(status='running', locked_at=now, attempts=Job.attempts + 1))
+        if result.rowcount:
+            claimed.append(job_id)
+    db.session.commit()
+    return claimed
+
+
+def _run_job(app, job_id):
+    with app.app_context():
+        current = db.session.get(Job, job_id)
+        if current is None:
+            return
+        try:
+            _handlers[current.name](**(current.payload or {}))
+            db.session.delete(current)
+            db.session.commit()
+            _count('succeeded')
+        except Exception as e:
+            db.session.rollback()
+            try:
+                _record_failure(job_id, e)
+            except Exception as bookkeeping_error:
+                # The job stays running and is reclaimed once its lock times out
+                db.session.rollback()
+                logger.error(f'Job #{job_id} failed ({e}) and its retry could not be recorded: {bookkeeping_error}')
+
+
+def _record_failure(job_id, error):
+    current = db.session.get(Job, job_id)
+    if current is None:
+        return
+    current.last_error = repr(error)
+    current.locked_at = None
+    if current.attempts < current.max_attempts:
+        current.status = 'queued'
+        current.run_at = datetime.utcnow() + timedelta(
+            seconds=JOB_RETRY_DELAY * 2 ** (current.attempts - 1))
+        _count('retried')
+        logger.warning(f'Job {current.name} #{job_id} failed, retrying: {error}')
+    else:
+        current.status = 'failed'
+        _count('failed')
+        logger.error(f'Job {current.name} #{job_id} failed permanently: {error}')
+    db.session.commit()
+
+
+def run_worker(app, threads=JOB_WORKER_THREADS, stop_event=None):
+    """Poll for due jobs and run them on a thread pool until `stop_event` is set"""
+    stop_event = stop_event or threading.Event()
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='job') as pool:
+        while not stop_event.is_set():
+            try:
+                with app.app_context():
+                    job_ids = _claim_jobs(threads)
+            except Exception as e:
+                logger.error(f'Job worker could not claim jobs: {e}')
+                job_ids = []
+
+            for job_id, future in [(job_id, pool.submit(_run_job, app, job_id)) for job_id in job_ids]:
+                # One job's failure must not end the loop: this thread is never restarted
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f'Job worker could not run job #{job_id}: {e}')
+
+            if not job_ids:
+                _wakeup.wait(JOB_POLL_INTERVAL)
+                _wakeup.clear()
+
+
+def start_worker_thread(app):
+    """Run the job worker in a daemon thread inside this (e.g. Gunicorn worker) process"""
+    thread = threading.Thread(target=run_worker, args=(app,), name='job-worker', daemon=True)
+    thread.start()
+    return thread
+
+
+_worker_pid = None
+_worker_pid_lock = threading.Lock()
+
+
+def ensure_worker_thread(app):
+    """Start this process's worker thread on its first request.
+
+    CLI commands never serve requests, and a `gunicorn --preload` master forks
+    before any do, so each serving worker process gets exactly one thread.
+    """
+    global _worker_pid
+    if _worker_pid == os.getpid():
+        return
+    with _worker_pid_lock:
+        if _worker_pid == os.getpid():
+            return
+        _worker_pid = os.getpid()
+    start_worker_thread(app)
+
+
+def init_jobs(app):
+    @app.cli.command('worker')
+    def worker_command():
+        """Run the background job worker in the foreground."""
+        print(f'Job worker started with {JOB_WORKER_THREADS} threads')
+        run_worker(app)
+
+    # Disable with JOBS_INPROCESS=0 when running a separate `flask worker` process
+    if os.environ.get('JOBS_INPROCESS', '1') == '1':
+        @app.before_request
+        def start_job_worker():
+            ensure_worker_thread(app)
@@ -0,0 +1,84 @@
+import os
+from sqlalchemy import func
+from app import db
+from models import User, Skill, UserSkill, Rating, LeaderboardEntry
+
+# Entries returned per leaderboard
+LEADERBOARD_SIZE = int(os.environ.get('LEADERBOARD_SIZE', 10))
+# Bayesian prior: every user starts with PRIOR_WEIGHT virtual ratings of PRIOR_MEAN,
+# so a single 5-star review can't outrank a long track record
+PRIOR_MEAN = float(os.environ.get('LEADERBOARD_PRIOR_MEAN', 3.0))
+PRIOR_WEIGHT = float(os.environ.get('LEADERBOARD_PRIOR_WEIGHT', 5))
+
+
+def bayesian_score(rating_count, average_rating):
+    return (PRIOR_MEAN * PRIOR_WEIGHT + average_rating * rating_count) / (PRIOR_WEIGHT + rating_count)
+
+
+def refresh_user_leaderboard(user_id):
+    """Rewrite one user's leaderboard entries from their ratings and offered skills.
+
+    Cost depends only on that user's ratings and skills, so it can run after
+    every rating without touching anyone else's rows. The caller commits.
+    """
+    LeaderboardEntry.query.filter_by(user_id=user_id).delete()
+
+    user = db.session.get(User, user_id)
+    if not user or user.is_banned or not user.is_public:
+        return
+
+    rating_count, average_rating = db.session.query(
+        func.count(Rating.id), func.avg(Rating.rating)
+    ).filter(Rating.rated_id == user_id).one()
+    if not rating_count:
+        return
+
+    average_rating = float(average_rating)
+    score = bayesian_score(rating_count, average_rating)
+
+    offered = db.session.query(Skill.id, Skill.category).join(UserSkill).filter(
+        UserSkill.user_id == user_id,
+        UserSkill.skill_type == 'offered',
+        Skill.is_approved == True
+    ).all()
+    scopes = {('all', '')}
+    for skill_id, category in offered:
+        scopes.add(('skill', str(skill_id)))
+        if category:
+            scopes.add(('category', category))
+
+    db.session.add_all([
+        LeaderboardEntry(scope=scope, scope_key=scope_key, user_id=user_id, score=score,
+                         average_rating=average_rating, rating_count=rating_count)
+        for scope, scope_key in scopes
+    ])
+
+
+def rebuild_leaderboard():
+    """Recompute every user's entries, e.g. after changing the prior"""
+    LeaderboardEntry.query.delete()
+    for (user_id,) in db.session.query(Rating.rated_id).distinct().all():
+        refresh_user_leaderboard(user_id)
+    db.session.commit()
+
+
+def get_leaderboard(skill_id=None, category=None, limit=LEADERBOARD_SIZE):
+    """Top entries for a skill, a category or overall, read straight off the scope/score index"""
+    if skill_id:
+        scope, scope_key = 'skill', str(skill_id)
+    elif category:
+        scope, scope_key = 'category', category
+    else:
+        scope, scope_key = 'all', ''
+
+    return LeaderboardEntry.query.filter_by(scope=scope, scope_key=scope_key).order_by(
+        LeaderboardEntry.score.desc()
+    ).limit(limit).all()
+
+
+def init_leaderboard(app):
+    @app.cli.command('rebuild-leaderboard')
+    def rebuild_leaderboard_command():
+        """Recompute all leaderboard entries from the ratings table."""
+        rebuild_leaderboard()
+        print(f'Leaderboard rebuilt with {LeaderboardEntry.query.count()} entries')
@@ -0,0 +1,119 @@
+# Compare connection capacity and latency of the WSGI and ASGI serving modes.
+#
+# Start the app in one mode, e.g.
+#   gunicorn --bind 127.0.0.1:5000 --workers 4 main:app
+#   uvicorn asgi:app --port 5000 --workers 4
+# then run:
+#   python loadcompare.py --url http://127.0.0.1:5000 --idle 1000 --requests 500
+#
+# The script logs in, opens --idle long-poll connections to /api/messages/<id>
+# that sit waiting, and while they are held measures /api/skills latency.
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlsplit, urlencode
+
+
+async def http_request(host, port, method, path, headers=None, body=b'', timeout=60):
+    """Minimal HTTP/1.1 request over a fresh connection; returns (status, headers, body)"""
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {host}:{port}', 'Connection: close',
+                 f'Content-Length: {len(body)}']
+        lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+        raw = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    head, _, payload = raw.partition(b'\r\n\r\n')
+    status_line, *header_lines = head.decode('latin-1').split('\r\n')
+    response_headers = [tuple(line.split(': ', 1)) for line in header_lines if ': ' in line]
+    return int(status_line.split()[1]), response_headers, payload
+
+
+async def login(host, port, username, password):
+    body = urlencode({'username': username, 'password': password}).encode()
+    _, headers, _ = await http_request(host, port, 'POST', '/login', {
+        'Content-Type': 'application/x-www-form-urlencoded'}, body)
+    for name, value in headers:
+        if name.lower() == 'set-cookie' and value.startswith('session='):
+            return value.split(';', 1)[0]
+    raise SystemExit('Login failed; check --username/--password')
+
+
+async def hold_idle(host, port, path, cookie, results):
+    try:
+        status, _, _ = await http_request(host, port, 'GET', path, {'Cookie': cookie}, timeout=120)
+        results.append(status)
+    except Exception as e:
+        results.append(type(e).__name__)
+
+
+async def timed_get(host, port, path, latencies, errors, semaphore):
+    async with semaphore:
+        started = time.perf_counter()
+        try:
+            status, _, _ = await http_request(host, port, 'GET', path, timeout=60)
+            if status != 200:
+                errors.append(status)
+        except Exception as e:
+            errors.append(type(e).__name__)
+        latencies.append(time.perf_counter() - started)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def main(args):
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    cookie = await login(host, port, args.username, args.password)
+
+    idle_results = []
+    idle_path = f'/api/messages/{args.swap_request_id}?after=999999999&wait={args.wait}'
+    idle_tasks = [asyncio.create_task(hold_idle(host, port, idle_path, cookie, idle_results))
+                  for _ in range(args.idle)]
+    await asyncio.sleep(args.settle)
+
+    latencies, errors = [], []
+    semaphore = asyncio.Semaphore(args.concurrency)
+    started = time.perf_counter()
+    await asyncio.gather(*[timed_get(host, port, '/api/skills', latencies, errors, semaphore)
+                           for _ in range(args.requests)])
+    elapsed = time.perf_counter() - started
+    still_idle = sum(1 for task in idle_tasks if not task.done())
+
+    report = {
+        'url': args.url,
+        'idle_connections_requested': args.idle,
+        'idle_connections_held': still_idle,
+        'requests': args.requests,
+        'errors': len(errors),
+        'throughput_rps': round(args.requests / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+    }
+    print(json.dumps(report, indent=2))
+
+    for task in idle_tasks:
+        task.cancel()
+    await asyncio.gather(*idle_tasks, return_exceptions=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare WSGI and ASGI serving modes')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--username', default='michell')
+    parser.add_argument('--password', default='password123')
+    parser.add_argument('--swap-request-id', type=int, default=2, help='An accepted swap the user takes part in')
+    parser.add_argument('--idle', type=int, default=500, help='Long-poll connections to hold open')
+    parser.add_argument('--wait', type=float, default=30, help='Long-poll wait in seconds')
+    parser.add_argument('--settle', type=float, default=2, help='Seconds to let idle connections establish')
+    parser.add_argument('--requests', type=int, default=500, help='Timed /api/skills requests')
+    parser.add_argument('--concurrency', type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,301 @@
+# Closed-loop load test: seeds a database, starts the app under Gunicorn and runs
+# virtual users through scripted journeys (browse, search, open a profile, send a
+# swap request, accept it, chat, rate), then reports per-step latency percentiles.
+#
+#   python loadtest.py --users 200 --duration 60 --workers 4 --threads 4
+#   python loadtest.py --database-url postgresql://... --baseline loadtest-results/before.json
+#
+# Each virtual user drives a pair of seeded accounts (requester and receiver) so
+# journeys never collide. Rate limiting is disabled on the server under test.
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import base64
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+from urllib.parse import urlencode, urlsplit, quote
+from loadcompare import http_request, percentile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PASSWORD = 'loadtest123'
+STEPS = ('login', 'browse', 'search', 'profile', 'send_request', 'pending', 'accept',
+         'chat_send', 'chat_read', 'rate')
+
+
+def seed_database(database_url, pairs):
+    """Create `pairs` requester/receiver accounts; returns [(requester, receiver)] as dicts"""
+    os.environ.update(DATABASE_URL=database_url, JOBS_INPROCESS='0', CACHE_WARM_ON_BOOT='0')
+    from werkzeug.security import generate_password_hash
+    from app import app, db
+    from models import User, Skill, UserSkill
+
+    with app.app_context():
+        skills = Skill.query.filter_by(is_approved=True).order_by(Skill.id).all()
+        existing = {user.username: user for user in User.query.filter(User.username.like('load_%')).all()}
+        # Hashing is deliberately slow, so every load user shares one hash
+        password_hash = generate_password_hash(PASSWORD)
+
+        accounts = []
+        for i in range(pairs * 2):
+            username = f'load_{i}'
+            user = existing.get(username)
+            if user is None:
+                user = User(username=username, password_hash=password_hash, name=f'Load User {i}',
+                            location='Benchmark City', availability=random.choice(['Weekends', 'Evenings', 'Weekdays']))
+                db.session.add(user)
+                db.session.flush()
+                for skill in random.sample(skills, 3):
+                    db.session.add(UserSkill(user_id=user.id, skill_id=skill.id, skill_type='offered'))
+                db.session.add(UserSkill(user_id=user.id, skill_id=random.choice(skills).id, skill_type='wanted'))
+            accounts.append(user)
+        db.session.commit()
+
+        offered = {}
+        for user_id, skill_id in db.session.query(UserSkill.user_id, UserSkill.skill_id).filter(
+            UserSkill.user_id.in_([user.id for user in accounts]), UserSkill.skill_type == 'offered'
+        ):
+            offered.setdefault(user_id, []).append(skill_id)
+
+        def account(user):
+            return {'id': user.id, 'username': user.username, 'offered': offered[user.id]}
+
+        return ([(account(accounts[i]), account(accounts[i + 1])) for i in range(0, len(accounts), 2)],
+                [skill.name for skill in skills])
+
+
+def start_server(args, database_url):
+    env = dict(os.environ, DATABASE_URL=database_url, RATE_LIMIT_ENABLED='0', CACHE_WARM_ON_BOOT='1')
+    command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{args.port}',
+               '--workers', str(args.workers), '--threads', str(args.threads), '--log-level', 'warning']
+    if args.threads > 1:
+        command += ['--worker-class', 'gthread']
+    return subprocess.Popen(command + ['main:app'], cwd=HERE, env=env)
+
+
+async def wait_until_ready(host, port, server, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server is not None and server.poll() is not None:
+            raise SystemExit('Gunicorn exited during startup')
+        try:
+            status, _, _ = await http_request(host, port, 'GET', '/login', timeout=5)
+            if status == 200:
+                return
+        except OSError:
+            pass
+        await asyncio.sleep(0.5)
+    raise SystemExit('Server did not become ready')
+
+
+def flashed_errors(cookie):
+    """Messages flashed with the 'error' category in a Flask session cookie (reading needs no secret)"""
+    value = cookie.split('=', 1)[1]
+    compressed = value.startswith('.')
+    data = value.lstrip('.').split('.', 1)[0]
+    try:
+        raw = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+        session = json.loads(zlib.decompress(raw) if compressed else raw)
+    except ValueError:
+        return []
+    # Flashes are (category, message) tuples, which Flask's session serializer tags as {" t": [...]}
+    flashes = [item.get(' t', item) if isinstance(item, dict) else item for item in session.get('_flashes', [])]
+    return [message for category, message in flashes if category == 'error']
+
+
+class Client:
+    """One browser: a session cookie plus timed requests recorded under step names"""
+
+    def __init__(self, host, port, results):
+        self.host, self.port, self.results = host, port, results
+        self.cookie = None
+
+    async def request(self, step, method, path, form=None, expect=None):
+        """Time one request; with `expect` the step only succeeds if it redirects to that path.
+
+        Form posts answer validation failures with a redirect and a flashed
+        error, so a step that flashes an error counts as failed too.
+        """
+        headers = {'Cookie': self.cookie} if self.cookie else {}
+        earlier_errors = flashed_errors(self.cookie) if self.cookie else []
+        body = b''
+        if form is not None:
+            body = urlencode(form).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        started = time.perf_counter()
+        try:
+            status, response_headers, payload = await http_request(self.host, self.port, method, path, headers, body)
+        except Exception as e:
+            self.results.append((step, time.perf_counter() - started, type(e).__name__))
+            return None, b''
+        elapsed = time.perf_counter() - started
+        error = status if status >= 400 else None
+        location = None
+        for name, value in response_headers:
+            if name.lower() == 'set-cookie' and value.startswith('session='):
+                self.cookie = value.split(';', 1)[0]
+                # Flashes not yet shown stay in the cookie, so only count the ones this request added
+                errors = flashed_errors(self.cookie)
+                if errors[:len(earlier_errors)] == earlier_errors:
+                    errors = errors[len(earlier_errors):]
+                if error is None and errors:
+                    error = f'flashed: {errors[0]}'
+            elif name.lower() == 'location':
+                location = urlsplit(value).path
+        if error is None and expect is not None and location != expect:
+            error = f'redirect to {location}' if location else f'status {status}'
+        self.results.append((step, elapsed, error))
+        return status, payload
+
+    async def login(self, username):
+        await self.request('login', 'POST', '/login', {'username': username, 'password': PASSWORD}, expect='/')
+
+
+async def virtual_user(host, port, pair, skill_names, deadline, think, results):
+    requester_account, receiver_account = pair
+    requester, receiver = Client(host, port, results), Client(host, port, results)
+    await requester.login(requester_account['username'])
+    await receiver.login(receiver_account['username'])
+
+    async def pause():
+        await asyncio.sleep(random.expovariate(1 / think) if think else 0)
+
+    while time.monotonic() < deadline:
+        await requester.request('browse', 'GET', '/')
+        await pause()
+        await requester.request('search', 'GET', '/?search=' + quote(random.choice(skill_names)))
+        await pause()
+        await requester.request('profile', 'GET', f'/user/{receiver_account["id"]}')
+        await pause()
+        await requester.request('send_request', 'POST', f'/send_request/{receiver_account["id"]}', {
+            'offered_skill_id': random.choice(requester_account['offered']),
+            'wanted_skill_id': random.choice(receiver_account['offered']),
+            'message': 'Load test swap'
+        }, expect=f'/user/{receiver_account["id"]}')
+        await pause()
+        _, page = await receiver.request('pending', 'GET', '/swap_requests')
+        pending = [int(i) for i in re.findall(rb'/handle_request/(\d+)/accept', page)]
+        if not pending:
+            results.append(('accept', 0, 'no pending request'))
+            continue
+        swap_id = max(pending)
+        await receiver.request('accept', 'GET', f'/handle_request/{swap_id}/accept', expect='/swap_requests')
+        await pause()
+        for client in (requester, receiver, requester):
+            await client.request('chat_send', 'POST', f'/send_message/{swap_id}', {'content': 'Hello from the load test'},
+                                 expect=f'/messages/{swap_id}')
+            await pause()
+        await receiver.request('chat_read', 'GET', f'/messages/{swap_id}')
+        await pause()
+        await requester.request('rate', 'POST', f'/rate_user/{swap_id}', {
+            'rating': random.randint(3, 5), 'feedback': 'Load test rating'
+        }, expect='/swap_requests')
+        await pause()
+
+
+def summarize(results, elapsed, args):
+    steps = {}
+    for step in STEPS:
+        samples = [r for r in results if r[0] == step]
+        if not samples:
+            continue
+        latencies = [r[1] for r in samples]
+        errors = [r[2] for r in samples if r[2] is not None]
+        steps[step] = {
+            'requests': len(samples),
+            'error_rate': round(len(errors) / len(samples), 4),
+            'errors': sorted({str(e) for e in errors}),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        }
+    total = sum(step['requests'] for step in steps.values())
+    return {
+        'started_at': datetime.utcnow().isoformat(),
+        'config': {'users': args.users, 'duration': args.duration, 'think': args.think,
+                   'workers': args.workers, 'threads': args.threads},
+        'throughput_rps': round(total / elapsed, 1),
+        'requests': total,
+        'error_rate': round(sum(1 for r in results if r[2] is not None) / max(total, 1), 4),
+        'steps': steps,
+    }
+
+
+def print_report(report, baseline=None):
+    print(f"{report['requests']} requests, {report['throughput_rps']} req/s, "
+          f"error rate {report['error_rate']:.2%}")
+    print(f"{'step':<14}{'requests':>10}{'errors':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, step in report['steps'].items():
+        line = (f"{name:<14}{step['requests']:>10}{step['error_rate']:>9.2%}"
+                f"{step['p50_ms']:>10}{step['p95_ms']:>10}{step['p99_ms']:>10}")
+        before = (baseline or {}).get('steps', {}).get(name)
+        if before and before['p95_ms']:
+            line += f"   p95 {(step['p95_ms'] - before['p95_ms']) / before['p95_ms']:+.1%} vs baseline"
+        print(line)
+    if baseline:
+        change = (report['throughput_rps'] - baseline['throughput_rps']) / max(baseline['throughput_rps'], 0.1)
+        print(f"throughput {change:+.1%} vs baseline")
+
+
+async def run(args):
+    database_url = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'loadtest.db')
+    pairs, skill_names = seed_database(database_url, args.users)
+
+    server = None if args.url else start_server(args, database_url)
+    if args.url:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        host, port = '127.0.0.1', args.port
+    try:
+        await wait_until_ready(host, port, server)
+        results = []
+        started = time.monotonic()
+        deadline = started + args.duration
+
+        async def delayed(i, pair):
+            # Spread virtual user start-up over the ramp period
+            await asyncio.sleep(args.ramp * i / max(len(pairs), 1))
+            await virtual_user(host, port, pair, skill_names, deadline, args.think, results)
+
+        await asyncio.gather(*[delayed(i, pair) for i, pair in enumerate(pairs)])
+        elapsed = time.monotonic() - started
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report = summarize(results, elapsed, args)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    output = args.output or os.path.join('loadtest-results', f'{datetime.utcnow():%Y%m%dT%H%M%S}.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results saved to {output}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Closed-loop load test with scripted user journeys')
+    parser.add_argument('--users', type=int, default=100, help='Concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds to run journeys')
+    parser.add_argument('--ramp', type=float, default=10, help='Seconds over which virtual users start')
+    parser.add_argument('--think', type=float, default=0.5, help='Mean think time between steps in seconds')
+    parser.add_argument('--workers', type=int, default=4, help='Gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=4, help='Threads per Gunicorn worker')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--database-url', help='Database to seed and serve (default: a fresh SQLite file)')
+    parser.add_argument('--url', help='Test an already running server (http://host:port) instead of starting one')
+    parser.add_argument('--output', help='Where to save the JSON results')
+    parser.add_argument('--baseline', help='Earlier results file to compare against')
+    asyncio.run(run(parser.parse_args()))
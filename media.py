@@ -0,0 +1,114 @@
+import os
+import hashlib
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from flask import url_for
+
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media'))
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+ALLOWED_IMAGE_FORMATS = {'png', 'jpeg', 'mpo', 'gif', 'webp'}  # MPO: multi-picture JPEG from some cameras
+# Only thumbnails are public; originals and partial uploads live outside this directory and are never served
+THUMBNAIL_ROOT = os.path.join(MEDIA_ROOT, 'thumbs')
+# Square JPEG thumbnails at 2x the avatar sizes the templates render (60, 80 and 120 px)
+THUMBNAIL_SIZES = (120, 160, 240)
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', 2))
+CHUNK_SIZE = 64 * 1024
+
+_pool = None
+
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def original_path(digest):
+    return os.path.join(MEDIA_ROOT, 'originals', digest[:2], digest)
+
+
+def thumbnail_name(digest, size):
+    """Path of a thumbnail under THUMBNAIL_ROOT, as it appears in /media/thumbs/ URLs"""
+    return f'{digest[:2]}/{digest}_{size}.jpg'
+
+
+def _verify_image(path):
+    # Checks the file's structure without decoding the pixels
+    from PIL import Image
+
+    try:
+        with Image.open(path) as image:
+            image_format = (image.format or '').lower()
+            image.verify()
+    except Exception:
+        raise ValueError('Not a valid image')
+    if image_format not in ALLOWED_IMAGE_FORMATS:
+        raise ValueError(f'Unsupported image format: {image_format}')
+
+
+def store_upload(file_storage):
+    """Stream an upload to content-addressed storage and return its SHA-256 digest.
+
+    Identical files are stored once. Raises ValueError if the file isn't a
+    PNG, JPEG, GIF or WebP image.
+    """
+    tmp_dir = os.path.join(MEDIA_ROOT, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    sha256 = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in iter(lambda: file_storage.stream.read(CHUNK_SIZE), b''):
+                sha256.update(chunk)
+                out.write(chunk)
+        _verify_image(tmp_path)
+        digest = sha256.hexdigest()
+        target = original_path(digest)
+        if os.path.exists(target):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(tmp_path, target)
+        return digest
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _render_thumbnails(source, targets):
+    """Decode once and write every thumbnail; runs in a pool process"""
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        for size, target in targets:
+            thumb = ImageOps.fit(image, (size, size), Image.LANCZOS)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp_path = f'{target}.tmp'
+            thumb.save(tmp_path, 'JPEG', quality=85, optimize=True, progressive=True)
+            os.replace(tmp_path, target)
+
+
+def generate_thumbnails(digest):
+    """Create any missing thumbnails for a stored original in the process pool"""
+    global _pool
+    targets = [(size, os.path.join(THUMBNAIL_ROOT, thumbnail_name(digest, size))) for size in THUMBNAIL_SIZES]
+    missing = [(size, target) for size, target in targets if not os.path.exists(target)]
+    if not missing:
+        return
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+    _pool.submit(_render_thumbnails, original_path(digest), missing).result()
+
+
+def discard_original(digest):
+    """Remove a stored original and any thumbnails written for it, e.g. after thumbnailing failed"""
+    paths = [original_path(digest)] + [os.path.join(THUMBNAIL_ROOT, thumbnail_name(digest, size)) for size in THUMBNAIL_SIZES]
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def avatar_url(digest, size):
+    """URL of the smallest thumbnail that stays sharp at `size` CSS pixels"""
+    thumb_size = next((s for s in THUMBNAIL_SIZES if s >= size * 2), THUMBNAIL_SIZES[-1])
+    return url_for('media_file', filename=thumbnail_name(digest, thumb_size))
@@ -1,7 +1,10 @@
+import re
+import unicodedata
 from app import db, cache
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy import Index, func
+from sqlalchemy.orm import validates
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -57,15 +60,29 @@ class User(db.Model):
     def get_rating_count(self):
         return self.received_ratings.count()
 
+def canonical_skill_key(name):
+    """Case-folded, whitespace- and punctuation-free form of a skill name"""
+    key = unicodedata.normalize('NFKC', name).casefold()
+    # Keep C, C++ and C# apart
+    key = key.replace('+', 'plus').replace('#', 'sharp')
+    return re.sub(r'[\W_]+', '', key) or key.strip()
+
 class Skill(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False, index=True)
+    # One row per canonical_skill_key(name), so "python" and "Python " are the same skill
+    canonical_key = db.Column(db.String(100), unique=True, nullable=True, index=True)
     category = db.Column(db.String(50), nullable=True, index=True)
     is_approved = db.Column(db.Boolean, default=True, nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
     user_skills = db.relationship('UserSkill', backref='skill', lazy='dynamic')
+    
+    @validates('name')
+    def _set_canonical_key(self, key, name):
+        self.canonical_key = canonical_skill_key(name)
+        return name
 
 class UserSkill(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -147,3 +164,136 @@ class AdminMessage(db.Model):
     # Relationships
     admin = db.relationship('User', foreign_keys=[admin_id], lazy='joined')
     recipient = db.relationship('User', foreign_keys=[recipient_id], lazy='joined')
+
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.JSON, nullable=True)
+    dedup_key = db.Column(db.String(200), nullable=True, index=True)
+    status = db.Column(db.String(20), default='queued', nullable=False)  # 'queued', 'running' or 'failed'
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=3, nullable=False)
+    last_error = db.Column(db.Text, nullable=True)
+    run_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Composite index for the worker's claim query
+    __table_args__ = (
+        Index('idx_job_status_run_at', 'status', 'run_at'),
+    )
+
+class LeaderboardEntry(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(20), nullable=False)  # 'all', 'skill' or 'category'
+    scope_key = db.Column(db.String(100), nullable=False, default='')  # skill id or category name
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    score = db.Column(db.Float, nullable=False)  # Bayesian-smoothed rating
+    average_rating = db.Column(db.Float, nullable=False)
+    rating_count = db.Column(db.Integer, nullable=False)
+    
+    # Relationships
+    user = db.relationship('User', lazy='joined')
+    
+    # Composite index so a top-k read is a single index range scan
+    __table_args__ = (
+        Index('idx_leaderboard_scope_score', 'scope', 'scope_key', 'score'),
+    )
+
+class ConversationSummary(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    swap_request_id = db.Column(db.Integer, db.ForeignKey('swap_request.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # Participant this row belongs to
+    other_user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    last_message_preview = db.Column(db.String(200), nullable=True)
+    last_sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    last_activity = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    unread_count = db.Column(db.Integer, default=0, nullable=False)
+    
+    # Relationships
+    swap_request = db.relationship('SwapRequest', lazy='joined')
+    other_user = db.relationship('User', foreign_keys=[other_user_id], lazy='joined')
+    
+    # One row per participant; the inbox reads (user_id, last_activity) in order
+    __table_args__ = (
+        db.UniqueConstraint('swap_request_id', 'user_id', name='uq_conversation_participant'),
+        Index('idx_conversation_user_activity', 'user_id', 'last_activity'),
+    )
+
+class SwapArchive(db.Model):
+    # Original SwapRequest id, so old links keep resolving
+    swap_request_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    requester_id = db.Column(db.Integer, nullable=False, index=True)
+    receiver_id = db.Column(db.Integer, nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False)
+    closed_at = db.Column(db.DateTime, nullable=True)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    message_count = db.Column(db.Integer, default=0, nullable=False)
+    swap_removed = db.Column(db.Boolean, default=False, nullable=False)  # False when ratings still reference the swap
+    payload = db.Column(db.LargeBinary, nullable=False)  # zlib-compressed JSON of the swap and its messages
+
+class AdminMessageCursor(db.Model):
+    # Highest admin message ids a user has seen; everything above is unread
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True, autoincrement=False)
+    last_seen_broadcast_id = db.Column(db.Integer, default=0, nullable=False)
+    last_seen_direct_id = db.Column(db.Integer, default=0, nullable=False)
+
+class ChangeLog(db.Model):
+    # The id is the sync version; clients ask for everything above the last one they saw
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)  # 'skill', 'user' or 'swap'
+    entity_id = db.Column(db.Integer, nullable=False)
+    audience_id = db.Column(db.Integer, default=0, nullable=False)  # 0 for everyone, else the only user who sees it
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        Index('idx_change_log_audience', 'audience_id', 'id'),
+        # Compaction keeps only the newest row per entity and audience
+        Index('idx_change_log_entity', 'entity', 'entity_id', 'audience_id'),
+    )
+
+class SavedSearch(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    search = db.Column(db.String(100), nullable=False, default='')
+    availability = db.Column(db.String(200), nullable=False, default='')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class SkillSubscription(db.Model):
+    # Inverted index: who to alert when someone starts offering a skill
+    id = db.Column(db.Integer, primary_key=True)
+    skill_id = db.Column(db.Integer, db.ForeignKey('skill.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    saved_search_id = db.Column(db.Integer, db.ForeignKey('saved_search.id'), nullable=True, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    skill = db.relationship('Skill', lazy='joined')
+    
+    # Leading skill_id so fan-out reads a skill's subscribers from one index range
+    __table_args__ = (
+        db.UniqueConstraint('skill_id', 'user_id', name='uq_skill_subscriber'),
+    )
+
+class MatchAlert(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # Subscriber
+    skill_id = db.Column(db.Integer, db.ForeignKey('skill.id'), nullable=False)
+    offerer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    is_read = db.Column(db.Boolean, default=False, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    # Relationships
+    skill = db.relationship('Skill', lazy='joined')
+    offerer = db.relationship('User', foreign_keys=[offerer_id], lazy='joined')
+    
+    __table_args__ = (
+        Index('idx_match_alert_user', 'user_id', 'is_read', 'id'),
+    )
+
+class EngagementCounter(db.Model):
+    # Write-behind totals flushed from each worker's in-memory buffer (see engagement.py)
+    subject_id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # User id, or 0 for platform totals
+    metric = db.Column(db.String(30), primary_key=True)  # 'profile_view', 'request_sent' or 'request_received'
+    count = db.Column(db.BigInteger, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
@@ -0,0 +1,149 @@
+import os
+from datetime import datetime
+from sqlalchemy import select, update, delete, or_
+from app import db
+from models import User, Skill, UserSkill, SwapRequest, LeaderboardEntry, SkillSubscription, MatchAlert
+from sync import record_changes
+
+# Most ids a single bulk action accepts
+MODERATION_MAX_BATCH = int(os.environ.get('MODERATION_MAX_BATCH', 500))
+# Users and skills listed per page on /admin/moderation
+MODERATION_PER_PAGE = 100
+
+
+def parse_ids(values):
+    """Distinct positive integer ids from form values, in the order given; junk is ignored"""
+    ids = []
+    for value in values:
+        value = str(value).strip()
+        if value.isdigit() and int(value) not in ids:
+            ids.append(int(value))
+    return ids
+
+
+def _reject_pending_swaps(criterion):
+    # Both participants see the rejection on their next sync
+    swaps = db.session.execute(
+        select(SwapRequest.id, SwapRequest.requester_id, SwapRequest.receiver_id).where(
+            SwapRequest.status == 'pending', criterion)
+    ).all()
+    if swaps:
+        db.session.execute(update(SwapRequest).where(SwapRequest.id.in_([swap.id for swap in swaps])).values(
+            status='rejected', updated_at=datetime.utcnow()))
+        for swap in swaps:
+            record_changes('swap', [swap.id], (swap.requester_id, swap.receiver_id))
+    return swaps
+
+
+def set_users_banned(user_ids, banned):
+    """Ban or unban users with one UPDATE; admins and users already in that state are skipped.
+
+    Banning rejects the users' pending swap requests and drops their leaderboard
+    entries. Returns {'users': changed ids, 'swaps': rejected swap count}. The caller commits.
+    """
+    changed = db.session.scalars(select(User.id).where(
+        User.id.in_(user_ids), User.is_admin == False, User.is_banned != banned)).all()
+    if not changed:
+        return {'users': [], 'swaps': 0}
+
+    db.session.execute(update(User).where(User.id.in_(changed)).values(is_banned=banned))
+    swaps = []
+    if banned:
+        swaps = _reject_pending_swaps(or_(SwapRequest.requester_id.in_(changed),
+                                          SwapRequest.receiver_id.in_(changed)))
+        db.session.execute(delete(LeaderboardEntry).where(LeaderboardEntry.user_id.in_(changed)))
+    record_changes('user', changed)
+    return {'users': changed, 'swaps': len(swaps)}
+
+
+def approve_skills(skill_ids):
+    """Approve skills with one UPDATE; returns the ids that were pending. The caller commits."""
+    approved = db.session.scalars(select(Skill.id).where(Skill.id.in_(skill_ids), Skill.is_approved == False)).all()
+    if approved:
+        db.session.execute(update(Skill).where(Skill.id.in_(approved)).values(is_approved=True))
+        record_changes('skill', approved)
+    return approved
+
+
+def skill_offerers(skill_ids):
+    """Ids of the users offering any of the skills"""
+    if not skill_ids:
+        return []
+    return db.session.scalars(select(UserSkill.user_id).where(
+        UserSkill.skill_id.in_(skill_ids), UserSkill.skill_type == 'offered').distinct()).all()
+
+
+def delete_skills(skill_ids):
+    """Delete skills along with the profile entries, pending swaps, subscriptions and alerts that use them.
+
+    A skill used by an accepted or finished swap is taken off profiles and unapproved,
+    which hides it from the catalog, but kept so that swap's history still resolves. Returns {'skills': deleted ids, 'kept': kept ids,
+    'users': users whose profiles changed, 'alert_users': users who lost alerts, 'swaps':
+    deleted pending swap count}. The caller commits.
+    """
+    existing = db.session.scalars(select(Skill.id).where(Skill.id.in_(skill_ids))).all()
+    if not existing:
+        return {'skills': [], 'kept': [], 'users': [], 'alert_users': [], 'swaps': 0}
+
+    uses_skill = or_(SwapRequest.offered_skill_id.in_(existing), SwapRequest.wanted_skill_id.in_(existing))
+    kept = set()
+    for offered_id, wanted_id in db.session.execute(
+        select(SwapRequest.offered_skill_id, SwapRequest.wanted_skill_id).where(
+            SwapRequest.status != 'pending', uses_skill)
+    ):
+        kept.update({offered_id, wanted_id})
+    deleted = [skill_id for skill_id in existing if skill_id not in kept]
+    kept = [skill_id for skill_id in existing if skill_id in kept]
+
+    users = db.session.scalars(select(UserSkill.user_id).where(UserSkill.skill_id.in_(existing)).distinct()).all()
+    db.session.execute(delete(UserSkill).where(UserSkill.skill_id.in_(existing)))
+    if kept:
+        db.session.execute(update(Skill).where(Skill.id.in_(kept)).values(is_approved=False))
+    db.session.execute(delete(LeaderboardEntry).where(
+        LeaderboardEntry.scope == 'skill', LeaderboardEntry.scope_key.in_([str(skill_id) for skill_id in existing])))
+
+    alert_users, swaps = [], []
+    if deleted:
+        pending = select(SwapRequest.id, SwapRequest.requester_id, SwapRequest.receiver_id).where(
+            SwapRequest.status == 'pending', or_(SwapRequest.offered_skill_id.in_(deleted),
+                                                 SwapRequest.wanted_skill_id.in_(deleted)))
+        swaps = db.session.execute(pending).all()
+        if swaps:
+            db.session.execute(delete(SwapRequest).where(SwapRequest.id.in_([swap.id for swap in swaps])))
+            for swap in swaps:
+                record_changes('swap', [swap.id], (swap.requester_id, swap.receiver_id))
+
+        alert_users = db.session.scalars(select(MatchAlert.user_id).where(
+            MatchAlert.skill_id.in_(deleted), MatchAlert.is_read == False).distinct()).all()
+        db.session.execute(delete(MatchAlert).where(MatchAlert.skill_id.in_(deleted)))
+        db.session.execute(delete(SkillSubscription).where(SkillSubscription.skill_id.in_(deleted)))
+        db.session.execute(delete(Skill).where(Skill.id.in_(deleted)))
+
+    record_changes('user', users)
+    record_changes('skill', existing)
+    return {'skills': deleted, 'kept': kept, 'users': users, 'alert_users': alert_users, 'swaps': len(swaps)}
+
+
+def moderation_users(search='', status='', page=1):
+    """Users for the moderation page, newest first, optionally filtered by name and ban status"""
+    query = User.query
+    if search:
+        pattern = f'%{search}%'
+        query = query.filter(or_(User.username.ilike(pattern), User.name.ilike(pattern)))
+    if status == 'banned':
+        query = query.filter(User.is_banned == True)
+    elif status == 'active':
+        query = query.filter(User.is_banned == False)
+    return query.order_by(User.created_at.desc(), User.id.desc()).paginate(
+        page=page, per_page=MODERATION_PER_PAGE, error_out=False)
+
+
+def moderation_skills(search='', status='pending', page=1):
+    """Skills for the moderation page, newest first; pending approval unless status is 'all'"""
+    query = Skill.query
+    if search:
+        query = query.filter(Skill.name.ilike(f'%{search}%'))
+    if status != 'all':
+        query = query.filter(Skill.is_approved == False)
+    return query.order_by(Skill.created_at.desc(), Skill.id.desc()).paginate(
+        page=page, per_page=MODERATION_PER_PAGE, error_out=False)
@@ -0,0 +1,80 @@
+from bisect import bisect_right
+from sqlalchemy import func
+from app import db, cache
+from models import AdminMessage, AdminMessageCursor
+from warmup import coalesced_cache
+
+# Messages shown on the notifications page
+NOTIFICATIONS_LIMIT = 50
+
+
+# Broadcasts are fanned out on read: one row each, shared by every user
+@coalesced_cache(timeout=300)  # Cache for 5 minutes
+def get_broadcast_ids():
+    return [row[0] for row in db.session.query(AdminMessage.id).filter(
+        AdminMessage.is_broadcast == True
+    ).order_by(AdminMessage.id).all()]
+
+
+@cache.memoize(timeout=300)  # Cache for 5 minutes
+def get_admin_message_state(user_id):
+    """A user's read cursors and unread direct message count"""
+    cursor = db.session.get(AdminMessageCursor, user_id)
+    broadcast_cursor = cursor.last_seen_broadcast_id if cursor else 0
+    direct_cursor = cursor.last_seen_direct_id if cursor else 0
+    direct_unread = db.session.query(func.count(AdminMessage.id)).filter(
+        AdminMessage.recipient_id == user_id,
+        AdminMessage.id > direct_cursor
+    ).scalar()
+    return broadcast_cursor, direct_cursor, direct_unread
+
+
+def get_admin_unread_count(user_id):
+    """Unread broadcasts plus direct admin messages, without a query on a warm cache"""
+    broadcast_cursor, _, direct_unread = get_admin_message_state(user_id)
+    broadcast_ids = get_broadcast_ids()
+    return len(broadcast_ids) - bisect_right(broadcast_ids, broadcast_cursor) + direct_unread
+
+
+def send_admin_message(admin_id, subject, content, recipient_id=None):
+    """Store one admin message; broadcasts (no recipient) are a single row regardless of user count"""
+    message = AdminMessage(admin_id=admin_id, recipient_id=recipient_id, subject=subject,
+                           content=content, is_broadcast=recipient_id is None)
+    db.session.add(message)
+    db.session.commit()
+    if recipient_id is None:
+        get_broadcast_ids.invalidate()
+    else:
+        cache.delete_memoized(get_admin_message_state, recipient_id)
+    return message
+
+
+def start_cursor(user_id):
+    """Start a new user's broadcast cursor at the latest broadcast. The caller commits."""
+    broadcast_ids = get_broadcast_ids()
+    db.session.add(AdminMessageCursor(user_id=user_id,
+                                      last_seen_broadcast_id=broadcast_ids[-1] if broadcast_ids else 0))
+
+
+def get_notifications(user_id):
+    """Broadcasts merged with the user's direct admin messages, newest first"""
+    return AdminMessage.query.filter(
+        (AdminMessage.is_broadcast == True) | (AdminMessage.recipient_id == user_id)
+    ).order_by(AdminMessage.id.desc()).limit(NOTIFICATIONS_LIMIT).all()
+
+
+def mark_notifications_read(user_id, messages):
+    """Advance the user's cursors past the given messages"""
+    broadcast_ids = [m.id for m in messages if m.is_broadcast]
+    direct_ids = [m.id for m in messages if not m.is_broadcast]
+    if not broadcast_ids and not direct_ids:
+        return
+
+    cursor = db.session.get(AdminMessageCursor, user_id)
+    if cursor is None:
+        cursor = AdminMessageCursor(user_id=user_id, last_seen_broadcast_id=0, last_seen_direct_id=0)
+        db.session.add(cursor)
+    cursor.last_seen_broadcast_id = max([cursor.last_seen_broadcast_id] + broadcast_ids)
+    cursor.last_seen_direct_id = max([cursor.last_seen_direct_id] + direct_ids)
+    db.session.commit()
+    cache.delete_memoized(get_admin_message_state, user_id)
@@ -0,0 +1,194 @@
+import os
+import time
+import logging
+import threading
+from bisect import bisect_left
+from flask import request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from app import db
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds in milliseconds; the last bucket is open-ended
+BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+# Checked-out connections held longer than this are listed as long-held
+LONG_HOLD_SECONDS = float(os.environ.get('DB_LONG_HOLD_SECONDS', 5))
+# Default statement timeout in milliseconds for request queries; 0 for none
+STATEMENT_TIMEOUT_MS = int(os.environ.get('STATEMENT_TIMEOUT_MS', 0))
+# Per-endpoint overrides in milliseconds, e.g. "admin_dashboard:5000,index:2000"
+STATEMENT_TIMEOUTS = {
+    endpoint.strip(): int(ms)
+    for endpoint, _, ms in (item.partition(':') for item in os.environ.get('STATEMENT_TIMEOUTS', '').split(','))
+    if endpoint.strip() and ms.strip()
+}
+# SQLite checks its deadline every this many virtual machine instructions
+SQLITE_PROGRESS_STEPS = 1000
+NO_ROUTE = '-'
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms):
+        self.buckets[bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def _percentile(self, pct):
+        # Upper bound of the bucket holding the percentile
+        rank, seen = self.count * pct / 100, 0
+        for bound, count in zip(BUCKETS_MS + (self.max_ms,), self.buckets):
+            seen += count
+            if seen >= rank:
+                return round(min(bound, self.max_ms), 2)
+        return round(self.max_ms, 2)
+
+    def as_dict(self):
+        labels = [f'<={bound}' for bound in BUCKETS_MS] + [f'>{BUCKETS_MS[-1]}']
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total_ms / self.count, 2) if self.count else 0,
+            'p50_ms': self._percentile(50),
+            'p95_ms': self._percentile(95),
+            'p99_ms': self._percentile(99),
+            'max_ms': round(self.max_ms, 2),
+            'buckets': dict(zip(labels, self.buckets)),
+        }
+
+
+_lock = threading.Lock()
+_local = threading.local()
+_checkout_wait = Histogram()
+_hold_by_route = {}
+_held = {}  # id of the pooled connection -> (route, checked out at)
+_counters = {'checkouts': 0, 'new_connections': 0, 'invalidated': 0, 'statement_timeouts': 0}
+
+
+def _route():
+    return (request.endpoint or NO_ROUTE) if has_request_context() else NO_ROUTE
+
+
+def statement_timeout_ms():
+    """Timeout for the current request's statements, or 0"""
+    if not has_request_context():
+        return 0
+    return STATEMENT_TIMEOUTS.get(request.endpoint, STATEMENT_TIMEOUT_MS)
+
+
+def _on_orm_execute(orm_execute_state):
+    # First statement of a transaction: the session is about to ask the pool for a connection
+    if not orm_execute_state.session.in_transaction():
+        _local.wanted_at = time.perf_counter()
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    now = time.perf_counter()
+    wanted_at = _local.__dict__.pop('wanted_at', None)
+    with _lock:
+        _counters['checkouts'] += 1
+        if wanted_at is not None:
+            _checkout_wait.observe((now - wanted_at) * 1000)
+        _held[id(connection_record)] = (_route(), now)
+
+
+def _on_checkin(dbapi_connection, connection_record):
+    now = time.perf_counter()
+    with _lock:
+        held = _held.pop(id(connection_record), None)
+        if held:
+            route, started = held
+            _hold_by_route.setdefault(route, Histogram()).observe((now - started) * 1000)
+    if dbapi_connection is not None and hasattr(dbapi_connection, 'set_progress_handler'):
+        dbapi_connection.set_progress_handler(None, 0)
+
+
+def _on_connect(dbapi_connection, connection_record):
+    with _lock:
+        _counters['new_connections'] += 1
+
+
+def _on_invalidate(dbapi_connection, connection_record, exception):
+    with _lock:
+        _counters['invalidated'] += 1
+
+
+def _on_begin(session, transaction, connection):
+    # SET LOCAL ends with the transaction, so pooled connections never keep it
+    timeout = statement_timeout_ms()
+    if timeout and connection.dialect.name == 'postgresql':
+        connection.exec_driver_sql(f'SET LOCAL statement_timeout = {int(timeout)}')
+
+
+def _on_sqlite_statement(conn, cursor, statement, parameters, context, executemany):
+    timeout = statement_timeout_ms()
+    if timeout:
+        deadline = time.perf_counter() + timeout / 1000
+        # A true return value interrupts the running statement
+        conn.connection.driver_connection.set_progress_handler(
+            lambda: time.perf_counter() > deadline, SQLITE_PROGRESS_STEPS)
+
+
+def is_statement_timeout(error):
+    original = getattr(error, 'orig', None)
+    return getattr(original, 'pgcode', None) == '57014' or 'interrupted' in str(original)
+
+
+def pool_metrics():
+    """Process-local pool gauges per engine, checkout waits, and hold times per route"""
+    now = time.perf_counter()
+    engines = {}
+    for bind, engine in db.engines.items():
+        pool = engine.pool
+        gauges = {'class': type(pool).__name__}
+        for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+            if hasattr(pool, name):
+                gauges[name] = getattr(pool, name)()
+        if hasattr(pool, '_max_overflow'):
+            gauges['max_overflow'] = pool._max_overflow
+        engines[bind or 'primary'] = gauges
+
+    with _lock:
+        long_held = sorted(
+            ({'route': route, 'held_s': round(now - started, 2)} for route, started in _held.values()
+             if now - started >= LONG_HOLD_SECONDS),
+            key=lambda item: -item['held_s']
+        )
+        return {
+            'engines': engines,
+            'counters': dict(_counters),
+            'checkout_wait': _checkout_wait.as_dict(),
+            'hold_by_route': {route: histogram.as_dict() for route, histogram in sorted(_hold_by_route.items())},
+            'in_use': len(_held),
+            'long_held': long_held,
+            'statement_timeouts': {'default_ms': STATEMENT_TIMEOUT_MS, 'routes': STATEMENT_TIMEOUTS},
+        }
+
+
+def init_pool_metrics(app):
+    """Instrument every engine's pool and apply per-route statement timeouts"""
+    event.listen(Session, 'do_orm_execute', _on_orm_execute)
+    event.listen(Session, 'after_begin', _on_begin)
+    for engine in db.engines.values():
+        event.listen(engine.pool, 'checkout', _on_checkout)
+        event.listen(engine.pool, 'checkin', _on_checkin)
+        event.listen(engine.pool, 'connect', _on_connect)
+        event.listen(engine.pool, 'invalidate', _on_invalidate)
+        if engine.dialect.name == 'sqlite':
+            event.listen(engine, 'before_cursor_execute', _on_sqlite_statement)
+
+    @app.errorhandler(OperationalError)
+    def statement_timed_out(error):
+        if not is_statement_timeout(error):
+            raise error
+        db.session.rollback()
+        with _lock:
+            _counters['statement_timeouts'] += 1
+        logger.warning(f'Statement timeout ({statement_timeout_ms()}ms) on {request.endpoint}')
+        return 'This page took too long to load, please retry shortly.', 503, {'Content-Type': 'text/plain'}
@@ -0,0 +1,160 @@
+import os
+import sys
+import time
+import random
+import pstats
+import cProfile
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+from flask import g, request, session
+from app import db
+from models import User
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles'))
+# Profile 1 in N requests to any route; 0 disables sampling
+PROFILE_SAMPLE_EVERY = int(os.environ.get('PROFILE_SAMPLE_EVERY', 0))
+# Per-endpoint overrides, e.g. "index:20,swap_requests:50"
+PROFILE_ROUTES = {
+    endpoint.strip(): int(every)
+    for endpoint, _, every in (item.partition(':') for item in os.environ.get('PROFILE_ROUTES', '').split(','))
+    if endpoint.strip() and every.strip()
+}
+# Seconds between stack samples for the collapsed-stack output
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))
+# Oldest profiles are deleted beyond this many requests
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 200))
+PROFILE_HEADER = 'X-Profile'
+
+_sampling_enabled = bool(PROFILE_SAMPLE_EVERY or PROFILE_ROUTES)
+
+
+class StackSampler(threading.Thread):
+    """Sample one thread's Python stack at a fixed interval into collapsed-stack counts"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _should_sample(endpoint):
+    every = PROFILE_ROUTES.get(endpoint, PROFILE_SAMPLE_EVERY)
+    return every > 0 and random.randrange(every) == 0
+
+
+def _is_admin_request():
+    user_id = session.get('user_id')
+    return bool(user_id and db.session.query(User.is_admin).filter_by(id=user_id).scalar())
+
+
+def _start():
+    g.profile_started = time.perf_counter()
+    g.profile_sampler = StackSampler(threading.get_ident(), PROFILE_INTERVAL)
+    g.profile_sampler.start()
+    g.profiler = cProfile.Profile()
+    g.profiler.enable()
+
+
+def _stop():
+    """Stop the request's profilers and write its .prof and .collapsed files; returns the base name"""
+    profiler = g.pop('profiler')
+    profiler.disable()
+    sampler = g.pop('profile_sampler')
+    sampler.stop()
+    elapsed_ms = (time.perf_counter() - g.pop('profile_started')) * 1000
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = f'{datetime.utcnow():%Y%m%dT%H%M%S%f}_{request.endpoint}_{elapsed_ms:.0f}ms'
+    pstats.Stats(profiler).dump_stats(os.path.join(PROFILE_DIR, f'{name}.prof'))
+    with open(os.path.join(PROFILE_DIR, f'{name}.collapsed'), 'w') as out:
+        for stack, count in sampler.stacks.most_common():
+            out.write(f'{stack} {count}\n')
+    _prune()
+    return name
+
+
+def _prune():
+    names = sorted({filename.rsplit('.', 1)[0] for filename in os.listdir(PROFILE_DIR)})
+    for name in names[:-PROFILE_KEEP]:
+        for extension in ('prof', 'collapsed'):
+            path = os.path.join(PROFILE_DIR, f'{name}.{extension}')
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def is_profiling():
+    """Whether the current request is being profiled"""
+    return 'profiler' in g
+
+
+def list_profiles():
+    """Saved profiles, newest first, as dicts with name, endpoint, duration and files"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for filename in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        if not filename.endswith('.prof'):
+            continue
+        name = filename[:-len('.prof')]
+        stamp, _, rest = name.partition('_')
+        endpoint, _, duration = rest.rpartition('_')
+        profiles.append({
+            'name': name,
+            'created_at': datetime.strptime(stamp, '%Y%m%dT%H%M%S%f'),
+            'endpoint': endpoint,
+            'duration': duration,
+            'files': [f for f in (f'{name}.prof', f'{name}.collapsed') if os.path.exists(os.path.join(PROFILE_DIR, f))],
+        })
+    return profiles
+
+
+def init_profiling(app):
+    """Profile sampled requests, or a single admin request sent with an X-Profile header"""
+
+    @app.before_request
+    def start_profiling():
+        # Costs one header lookup when sampling is off
+        if PROFILE_HEADER in request.headers:
+            if not _is_admin_request():
+                return None
+        elif not _sampling_enabled or not _should_sample(request.endpoint):
+            return None
+        _start()
+        return None
+
+    @app.after_request
+    def finish_profiling(response):
+        if 'profiler' in g:
+            try:
+                response.headers['X-Profile-Id'] = _stop()
+            except OSError as e:
+                logger.warning(f'Could not save profile: {e}')
+        return response
+
+    @app.teardown_request
+    def abandon_profiling(error=None):
+        # The view raised before after_request could run
+        if 'profiler' in g:
+            g.pop('profiler').disable()
+            g.pop('profile_sampler').stop()
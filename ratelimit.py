@@ -0,0 +1,118 @@
+import os
+import time
+import random
+import sqlite3
+import logging
+import tempfile
+import threading
+from flask import request, session
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+# SQLite file holding the token buckets, shared by every worker process on the host
+RATE_LIMIT_STORE = os.environ.get('RATE_LIMIT_STORE', os.path.join(tempfile.gettempdir(), 'skillswap-ratelimit.db'))
+# After a pool checkout times out, shed new requests for this many seconds
+SHED_COOLDOWN = float(os.environ.get('SHED_COOLDOWN', 2))
+
+# endpoint -> [(scope, requests, per seconds)] for POSTs. 'client' is the logged-in
+# user or else the IP address; 'username' is the username posted to the form.
+RATE_LIMITS = {
+    'login': [('client', 10, 60), ('username', 5, 60)],
+    'register': [('client', 5, 600)],
+    'send_request': [('client', 10, 60)],
+    'send_message': [('client', 30, 60)],
+}
+
+# Endpoints that never touch the database and are never shed
+_EXEMPT_ENDPOINTS = {'static', 'media_file'}
+
+_local = threading.local()
+_shed_until = 0.0
+
+
+def _store():
+    connection = getattr(_local, 'connection', None)
+    if connection is None:
+        connection = sqlite3.connect(RATE_LIMIT_STORE, timeout=1, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=OFF')
+        connection.execute('CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+        _local.connection = connection
+    return connection
+
+
+def take_token(key, capacity, per_seconds):
+    """Take one token from the bucket `key`; return 0 if allowed, else seconds until a token is free"""
+    refill_rate = capacity / per_seconds
+    now = time.time()
+    connection = _store()
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        row = connection.execute('SELECT tokens, updated FROM bucket WHERE key = ?', (key,)).fetchone()
+        tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * refill_rate)
+        if tokens >= 1:
+            tokens -= 1
+            retry_after = 0
+        else:
+            retry_after = (1 - tokens) / refill_rate
+        connection.execute('INSERT OR REPLACE INTO bucket (key, tokens, updated) VALUES (?, ?, ?)',
+                           (key, tokens, now))
+        # Forget buckets idle long enough to have refilled
+        if random.random() < 0.001:
+            connection.execute('DELETE FROM bucket WHERE updated < ?', (now - 86400,))
+        connection.execute('COMMIT')
+    except Exception:
+        connection.execute('ROLLBACK')
+        raise
+    return retry_after
+
+
+def _bucket_key(endpoint, scope):
+    if scope == 'username':
+        username = request.form.get('username', '').strip().lower()
+        return f'{endpoint}:username:{username}' if username else None
+    user_id = session.get('user_id')
+    return f'{endpoint}:user:{user_id}' if user_id else f'{endpoint}:ip:{request.remote_addr}'
+
+
+def _too_busy(status, retry_after, message):
+    return message, status, {'Retry-After': str(max(1, int(retry_after + 0.999))), 'Content-Type': 'text/plain'}
+
+
+def init_ratelimit(app):
+    """Throttle abusable form posts per client and shed load while the DB pool is exhausted"""
+
+    @app.before_request
+    def limit_request():
+        if request.endpoint in _EXEMPT_ENDPOINTS:
+            return None
+
+        # Fail fast while the pool is exhausted instead of queueing behind it
+        remaining = _shed_until - time.monotonic()
+        if remaining > 0:
+            return _too_busy(503, remaining, 'Server is busy, please retry shortly.')
+
+        if not RATE_LIMIT_ENABLED or request.method != 'POST' or request.endpoint not in RATE_LIMITS:
+            return None
+        for scope, capacity, per_seconds in RATE_LIMITS[request.endpoint]:
+            key = _bucket_key(request.endpoint, scope)
+            if key is None:
+                continue
+            try:
+                retry_after = take_token(key, capacity, per_seconds)
+            except sqlite3.Error as e:
+                # Never turn a limiter problem into an outage
+                logger.warning(f'Rate limit store unavailable: {e}')
+                return None
+            if retry_after:
+                return _too_busy(429, retry_after, 'Too many requests, please slow down.')
+        return None
+
+    @app.errorhandler(PoolTimeoutError)
+    def pool_exhausted(error):
+        global _shed_until
+        _shed_until = time.monotonic() + SHED_COOLDOWN
+        logger.warning(f'Database pool checkout timed out; shedding load for {SHED_COOLDOWN}s')
+        return _too_busy(503, SHED_COOLDOWN, 'Server is busy, please retry shortly.')
@@ -0,0 +1,125 @@
+import os
+import time
+import random
+import logging
+from functools import wraps
+from flask import g, session, request, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.sql import Select
+
+logger = logging.getLogger(__name__)
+
+REPLICA_BIND_PREFIX = 'replica_'
+
+# Route a user's reads to the primary for this long after they write
+STICKY_SECONDS = float(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+# Seconds between health probes of each replica
+HEALTH_CHECK_INTERVAL = float(os.environ.get('REPLICA_HEALTH_INTERVAL', 10))
+
+# bind key -> (is_healthy, checked_at)
+_replica_health = {}
+
+
+def replica_binds_from_env():
+    """Build SQLALCHEMY_BINDS entries from DATABASE_REPLICA_URLS (comma separated)"""
+    urls = [u.strip() for u in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if u.strip()]
+    binds = {}
+    for i, url in enumerate(urls):
+        binds[f'{REPLICA_BIND_PREFIX}{i}'] = {
+            'url': url,
+            'pool_recycle': 300,
+            'pool_pre_ping': True,
+            'pool_size': int(os.environ.get('REPLICA_POOL_SIZE', 10)),
+            'max_overflow': int(os.environ.get('REPLICA_MAX_OVERFLOW', 20)),
+            'pool_timeout': int(os.environ.get('REPLICA_POOL_TIMEOUT', 10)),
+        }
+    return binds
+
+
+def _replica_keys(engines):
+    return [key for key in engines if key and key.startswith(REPLICA_BIND_PREFIX)]
+
+
+def is_replica_healthy(key, engine):
+    """Probe a replica with SELECT 1, caching the result for HEALTH_CHECK_INTERVAL"""
+    now = time.monotonic()
+    healthy, checked_at = _replica_health.get(key, (True, None))
+    if checked_at is not None and now - checked_at < HEALTH_CHECK_INTERVAL:
+        return healthy
+    try:
+        with engine.connect() as conn:
+            conn.execute(text('SELECT 1'))
+        healthy = True
+    except Exception as e:
+        if healthy:
+            logger.warning(f'Replica {key} failed health check, reading from primary: {e}')
+        healthy = False
+    _replica_health[key] = (healthy, now)
+    return healthy
+
+
+def _pick_replica(engines):
+    # Stay on one replica for the whole request so reads are consistent
+    key = g.get('replica_key')
+    if key is None:
+        healthy = [k for k in _replica_keys(engines) if is_replica_healthy(k, engines[k])]
+        key = random.choice(healthy) if healthy else ''
+        g.replica_key = key
+    return engines[key] if key else None
+
+
+def _is_plain_read(clause):
+    return clause is None or (isinstance(clause, Select) and clause._for_update_arg is None)
+
+
+class RoutingSession(Session):
+    """Session that sends reads from replica-enabled requests to a read replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and has_request_context()
+                and g.get('use_replica') and not g.get('db_wrote') and _is_plain_read(clause)):
+            engine = _pick_replica(self._db.engines)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_write(db_session, flush_context):
+    if has_request_context():
+        g.db_wrote = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _mark_bulk_write(orm_execute_state):
+    # Query.delete()/update() bypass the flush
+    if has_request_context() and not orm_execute_state.is_select:
+        g.db_wrote = True
+
+
+def _recently_wrote():
+    last_write_at = session.get('last_write_at')
+    return last_write_at is not None and time.time() - last_write_at < STICKY_SECONDS
+
+
+def read_replica(view):
+    """Allow a read-only view to serve GET/HEAD requests from a replica"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method in ('GET', 'HEAD') and not _recently_wrote():
+            g.use_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def init_replicas(app):
+    """Record the time of each user's last write so their reads stick to the primary"""
+    if not any(key.startswith(REPLICA_BIND_PREFIX) for key in app.config.get('SQLALCHEMY_BINDS', {})):
+        return
+
+    @app.after_request
+    def remember_last_write(response):
+        if g.get('db_wrote'):
+            session['last_write_at'] = time.time()
+        return response
@@ -1,85 +1,165 @@
-from flask import render_template, request, redirect, url_for, flash, session, jsonify
+from flask import (render_template, request, redirect, url_for, flash, session, jsonify, abort, send_from_directory,
+                   make_response)
 from app import app, db, cache
 from models import User, Skill, UserSkill, SwapRequest, Rating, Message, AdminMessage
-from sqlalchemy import or_, and_, func
+from sqlalchemy import func, select, exists, bindparam
 from sqlalchemy.orm import joinedload, selectinload
 from werkzeug.utils import secure_filename
 import os
+import logging
 from datetime import datetime
 from functools import lru_cache
+from replicas import read_replica
+from jobs import job, enqueue, job_metrics
+from warmup import coalesced_cache, warmer
+from leaderboard import get_leaderboard, refresh_user_leaderboard
+from inbox import open_conversation, record_message, mark_conversation_read, get_inbox_page
+from archive import load_archived_swap, get_archived_swaps
+from skills import get_or_create_skill, suggest_skills, get_skill_trigram_index
+from profiling import PROFILE_DIR, list_profiles
+from poolstats import pool_metrics
+from assets import service_worker_script
+from engagement import PLATFORM, count_event, get_engagement
+from sync import record_change, record_swap_change, get_sync_payload
+from moderation import (MODERATION_MAX_BATCH, parse_ids, set_users_banned, approve_skills, delete_skills,
+                        skill_offerers, moderation_users, moderation_skills)
+from alerts import (get_unread_alert_count, clear_alert_counts, subscribe_skill, unsubscribe_skill, save_search,
+                    delete_saved_search, get_saved_searches, get_subscriptions, fan_out_new_offers,
+                    get_match_alerts, mark_alerts_read)
+from directory import directory_filters, get_directory_facets, clear_directory_facets
+from streaming import Deferred, render_streamed
+from snapshot import SNAPSHOT_ENABLED, get_directory_snapshot
+from media import (THUMBNAIL_ROOT, allowed_file, store_upload, generate_thumbnails, discard_original,
+                   avatar_url)
+from notifications import (get_admin_unread_count, get_admin_message_state, send_admin_message,
+                           start_cursor, get_notifications, mark_notifications_read)
+
+logger = logging.getLogger(__name__)
 
 # Helper function to check if user is logged in
 def is_logged_in():
     return 'user_id' in session
 
 # Helper function to get current user with caching
-@cache.memoize(timeout=60)  # Cache for 1 minute
 def get_current_user():
     if is_logged_in():
-        return User.query.options(
-            selectinload(User.skills_offered),
-            selectinload(User.skills_wanted)
-        ).get(session['user_id'])
+        return get_cached_user(session['user_id'])
     return None
 
+# Memoized per user id so concurrent sessions never see each other's user
+@cache.memoize(timeout=60)  # Cache for 1 minute
+def get_cached_user(user_id):
+    return User.query.options(
+        selectinload(User.skills_offered).selectinload(UserSkill.skill),
+        selectinload(User.skills_wanted).selectinload(UserSkill.skill)
+    ).get(user_id)
+
 # Helper function to check if user is admin
 def is_admin():
     user = get_current_user()
     return user and user.is_admin
 
+# Directory page size, shared with the cache warmer
+DIRECTORY_PER_PAGE = 12
+# Number of directory pages the cache warmer precomputes
+WARM_DIRECTORY_PAGES = 2
+
 # Cached function to get all skills
-@cache.memoize(timeout=300)  # Cache for 5 minutes
+@coalesced_cache(timeout=300)  # Cache for 5 minutes
 def get_all_skills_cached():
     return [(skill.id, skill.name) for skill in Skill.query.filter_by(is_approved=True).all()]
 
+# Cached set of approved skill ids for O(1) membership checks
+@coalesced_cache(timeout=300)  # Cache for 5 minutes
+def get_approved_skill_ids():
+    return frozenset(skill[0] for skill in get_all_skills_cached())
+
+# Cached list of skill categories
+@coalesced_cache(timeout=300)  # Cache for 5 minutes
+def get_skill_categories():
+    return [row[0] for row in db.session.query(Skill.category).filter(
+        Skill.category.isnot(None), Skill.is_approved == True
+    ).distinct().order_by(Skill.category).all()]
+
+def clear_skill_caches():
+    get_all_skills_cached.invalidate()
+    get_approved_skill_ids.invalidate()
+    get_skill_categories.invalidate()
+    get_skill_trigram_index.invalidate()
+
+# Every send_request constraint in one statement; built once so SQLAlchemy's
+# compiled statement cache reuses it across requests
+_swap_validation_stmt = select(
+    exists().where(User.id == bindparam('receiver_id')).label('receiver_exists'),
+    exists().where(
+        UserSkill.user_id == bindparam('requester_id'),
+        UserSkill.skill_id == bindparam('offered_skill_id'),
+        UserSkill.skill_type == 'offered'
+    ).label('user_has_offered'),
+    exists().where(
+        UserSkill.user_id == bindparam('receiver_id'),
+        UserSkill.skill_id == bindparam('wanted_skill_id'),
+        UserSkill.skill_type == 'offered'
+    ).label('receiver_has_wanted'),
+    exists().where(
+        SwapRequest.requester_id == bindparam('requester_id'),
+        SwapRequest.receiver_id == bindparam('receiver_id'),
+        SwapRequest.offered_skill_id == bindparam('offered_skill_id'),
+        SwapRequest.wanted_skill_id == bindparam('wanted_skill_id'),
+        SwapRequest.status == 'pending'
+    ).label('duplicate_pending')
+)
+
+def validate_swap_request(requester_id, receiver_id, offered_skill_id, wanted_skill_id):
+    """Check receiver, skill ownership and duplicates in a single round trip"""
+    return db.session.execute(_swap_validation_stmt, {
+        'requester_id': requester_id,
+        'receiver_id': receiver_id,
+        'offered_skill_id': offered_skill_id,
+        'wanted_skill_id': wanted_skill_id,
+    }).one()
+
 # Cached function to get availability options
-@cache.memoize(timeout=300)  # Cache for 5 minutes
+@coalesced_cache(timeout=300)  # Cache for 5 minutes
 def get_availability_options():
     return [opt[0] for opt in db.session.query(User.availability).filter(
         User.availability.isnot(None), User.is_public == True, User.is_banned == False
     ).distinct().all() if opt[0]]
 
 @app.route('/')
+@read_replica
 def index():
     page = request.args.get('page', 1, type=int)
     search_query = request.args.get('search', '', type=str)
     availability_filter = request.args.get('availability', '', type=str)
     
+    # Without a search term the page comes from this worker's in-memory snapshot
+    if SNAPSHOT_ENABLED and not search_query.strip():
+        snapshot = get_directory_snapshot()
+        return render_streamed('index.html', users=snapshot.page(page, DIRECTORY_PER_PAGE, availability_filter),
+                             search_query=search_query, availability_filter=availability_filter,
+                             availability_options=get_availability_options(),
+                             facets=snapshot.facets(availability_filter))
+    
     # Base query with eager loading for better performance
     query = User.query.options(
         selectinload(User.skills_offered).selectinload(UserSkill.skill),
         selectinload(User.skills_wanted).selectinload(UserSkill.skill)
-    ).filter(User.is_public == True, User.is_banned == False)
-    
-    # Apply search filter with optimized subquery
-    if search_query:
-        skill_users = db.session.query(User.id).join(UserSkill).join(Skill).filter(
-            Skill.name.ilike(f'%{search_query}%'),
-            Skill.is_approved == True
-        ).subquery()
-        
-        query = query.filter(or_(
-            User.name.ilike(f'%{search_query}%'),
-            User.location.ilike(f'%{search_query}%'),
-            User.id.in_(skill_users)
-        ))
-    
-    # Apply availability filter
-    if availability_filter:
-        query = query.filter(User.availability.ilike(f'%{availability_filter}%'))
-    
-    # Paginate results with increased page size for better performance
-    per_page = 12
-    users = query.order_by(User.created_at.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
+    ).filter(*directory_filters(search_query, availability_filter))
     
-    # Get cached availability options
+    # Paginate results with increased page size for better performance; the
+    # queries run while the page streams, after the head and navbar are sent
+    users = Deferred(lambda: query.order_by(User.created_at.desc()).paginate(
+        page=page, per_page=DIRECTORY_PER_PAGE, error_out=False
+    ))
+    
+    # Get cached availability options and facet counts
     availability_options = get_availability_options()
+    facets = Deferred(lambda: get_directory_facets(search_query, availability_filter))
     
-    return render_template('index.html', users=users, search_query=search_query,
+    return render_streamed('index.html', users=users, search_query=search_query,
                          availability_filter=availability_filter,
-                         availability_options=availability_options)
+                         availability_options=availability_options, facets=facets)
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -101,7 +181,7 @@ def login():
             
             session['user_id'] = user.id
             # Clear user cache when logging in
-            cache.delete_memoized(get_current_user)
+            cache.delete_memoized(get_cached_user, user.id)
             flash('Login successful!', 'success')
             return redirect(url_for('index'))
         else:
@@ -144,6 +224,10 @@ def register():
         
         try:
             db.session.add(user)
+            db.session.flush()
+            # Earlier announcements don't count as unread for new users
+            start_cursor(user.id)
+            record_change('user', user.id)
             db.session.commit()
             
             session['user_id'] = user.id
@@ -161,11 +245,12 @@ def logout():
     session.pop('user_id', None)
     # Clear user cache when logging out
     if user_id:
-        cache.delete_memoized(get_current_user)
+        cache.delete_memoized(get_cached_user, user_id)
     flash('You have been logged out.', 'info')
     return redirect(url_for('index'))
 
 @app.route('/profile')
+@read_replica
 def profile():
     if not is_logged_in():
         flash('Please log in to view your profile.', 'error')
@@ -199,42 +284,50 @@ def edit_profile():
         offered_skills = request.form.getlist('offered_skills')
         wanted_skills = request.form.getlist('wanted_skills')
         
+        # Remember what was offered before so only new offers trigger alerts
+        previous_offered = {row[0] for row in db.session.query(UserSkill.skill_id).filter_by(
+            user_id=user.id, skill_type='offered'
+        )}
+        
         # Remove existing skills efficiently
         UserSkill.query.filter_by(user_id=user.id).delete()
         
-        # Add offered skills
-        for skill_name in offered_skills:
-            if skill_name.strip():
-                skill = Skill.query.filter_by(name=skill_name.strip()).first()
-                if not skill:
-                    skill = Skill(name=skill_name.strip())
-                    db.session.add(skill)
-                    db.session.flush()
+        # Add offered and wanted skills, matching existing ones by canonical name
+        skill_ids = {'offered': set(), 'wanted': set()}
+        for skill_type, skill_names in (('offered', offered_skills), ('wanted', wanted_skills)):
+            seen = skill_ids[skill_type]
+            for skill_name in skill_names:
+                if not skill_name.strip():
+                    continue
+                skill, created = get_or_create_skill(skill_name)
+                if created:
                     # Clear skills cache when new skill is added
-                    cache.delete_memoized(get_all_skills_cached)
+                    clear_skill_caches()
+                    record_change('skill', skill.id)
+                if skill.id in seen:
+                    continue
+                seen.add(skill.id)
                 
-                user_skill = UserSkill(user_id=user.id, skill_id=skill.id, skill_type='offered')
+                user_skill = UserSkill(user_id=user.id, skill_id=skill.id, skill_type=skill_type)
                 db.session.add(user_skill)
         
-        # Add wanted skills
-        for skill_name in wanted_skills:
-            if skill_name.strip():
-                skill = Skill.query.filter_by(name=skill_name.strip()).first()
-                if not skill:
-                    skill = Skill(name=skill_name.strip())
-                    db.session.add(skill)
-                    db.session.flush()
-                    # Clear skills cache when new skill is added
-                    cache.delete_memoized(get_all_skills_cached)
-                
-                user_skill = UserSkill(user_id=user.id, skill_id=skill.id, skill_type='wanted')
-                db.session.add(user_skill)
+        record_change('user', user.id)
+        
+        # Fan out match alerts to subscribers of newly offered skills
+        alerted_user_ids = []
+        if user.is_public:
+            alerted_user_ids = fan_out_new_offers(user.id, skill_ids['offered'] - previous_offered)
+        
+        # Availability options and leaderboard entries are recomputed off-request
+        enqueue('refresh_availability_options', dedup_key='refresh_availability_options')
+        enqueue('refresh_leaderboard_user', {'user_id': user.id}, dedup_key=f'refresh_leaderboard_user:{user.id}')
         
         try:
             db.session.commit()
-            # Clear user cache after update
-            cache.delete_memoized(get_current_user)
-            cache.delete_memoized(get_availability_options)
+            # Invalidate here rather than in the jobs, which may run in another process
+            cache.delete_memoized(get_cached_user, user.id)
+            get_availability_options.invalidate()
+            clear_alert_counts(alerted_user_ids)
             flash('Profile updated successfully!', 'success')
             return redirect(url_for('profile'))
         except Exception as e:
@@ -246,7 +339,50 @@ def edit_profile():
     
     return render_template('edit_profile.html', user=user, all_skills=all_skills)
 
+@app.route('/upload_photo', methods=['POST'])
+def upload_photo():
+    if not is_logged_in():
+        flash('Please log in to upload a profile photo.', 'error')
+        return redirect(url_for('login'))
+    
+    photo = request.files.get('photo')
+    if not photo or not photo.filename:
+        flash('Please choose a photo to upload.', 'error')
+        return redirect(url_for('edit_profile'))
+    
+    if not allowed_file(secure_filename(photo.filename)):
+        flash('Photos must be PNG, JPG, GIF or WebP images.', 'error')
+        return redirect(url_for('edit_profile'))
+    
+    current_user = get_current_user()
+    
+    try:
+        digest = store_upload(photo)
+        # Thumbnails are rendered off-request; the photo appears once they exist
+        enqueue('process_profile_photo', {'user_id': current_user.id, 'digest': digest},
+                dedup_key=f'process_profile_photo:{current_user.id}:{digest}')
+        db.session.commit()
+        flash('Photo uploaded! It will appear on your profile in a moment.', 'success')
+    except ValueError:
+        db.session.rollback()
+        flash('That file is not a valid PNG, JPG, GIF or WebP image.', 'error')
+    except Exception as e:
+        db.session.rollback()
+        flash('An error occurred while uploading the photo.', 'error')
+    
+    return redirect(url_for('edit_profile'))
+
+@app.route('/media/thumbs/<path:filename>')
+def media_file(filename):
+    # Served from the thumbnail directory itself, so `..` can't reach the originals next to it.
+    # Paths are content hashes, so a file never changes once written
+    response = send_from_directory(THUMBNAIL_ROOT, filename, conditional=True, max_age=31536000)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
 @app.route('/user/<int:user_id>')
+@read_replica
 def user_detail(user_id):
     # Use eager loading for better performance
     user = User.query.options(
@@ -270,7 +406,11 @@ def user_detail(user_id):
         joinedload(Rating.swap_request)
     ).filter_by(rated_id=user.id).order_by(Rating.created_at.desc()).limit(20).all()
     
-    return render_template('user_detail.html', user=user, ratings=ratings)
+    # Buffered in memory and flushed in batches, so busy profiles don't contend on a row per view
+    if not current_user or current_user.id != user.id:
+        count_event('profile_view', user.id)
+    
+    return render_template('user_detail.html', user=user, ratings=ratings, engagement=get_engagement(user.id))
 
 @app.route('/send_request/<int:receiver_id>', methods=['GET', 'POST'])
 def send_request(receiver_id):
@@ -279,9 +419,6 @@ def send_request(receiver_id):
         return redirect(url_for('login'))
     
     current_user = get_current_user()
-    receiver = User.query.options(
-        selectinload(User.skills_offered).selectinload(UserSkill.skill)
-    ).get_or_404(receiver_id)
     
     if current_user.id == receiver_id:
         flash('You cannot send a swap request to yourself.', 'error')
@@ -296,38 +433,27 @@ def send_request(receiver_id):
             flash('Please select both skills for the swap.', 'error')
             return redirect(url_for('send_request', receiver_id=receiver_id))
         
-        # Check if skills are valid (using cache)
-        skill_ids = [skill[0] for skill in get_all_skills_cached()]
-        if offered_skill_id not in skill_ids or wanted_skill_id not in skill_ids:
+        # Check if skills are valid (using cached id set)
+        approved_skill_ids = get_approved_skill_ids()
+        if offered_skill_id not in approved_skill_ids or wanted_skill_id not in approved_skill_ids:
             flash('Invalid skill selection.', 'error')
             return redirect(url_for('send_request', receiver_id=receiver_id))
         
-        # Check if user has the offered skill and receiver has the wanted skill
-        user_has_offered = UserSkill.query.filter_by(
-            user_id=current_user.id, skill_id=offered_skill_id, skill_type='offered'
-        ).first()
-        receiver_has_wanted = UserSkill.query.filter_by(
-            user_id=receiver_id, skill_id=wanted_skill_id, skill_type='offered'
-        ).first()
+        # Check receiver, skill ownership and duplicates in one query
+        checks = validate_swap_request(current_user.id, receiver_id, offered_skill_id, wanted_skill_id)
         
-        if not user_has_offered:
+        if not checks.receiver_exists:
+            abort(404)
+        
+        if not checks.user_has_offered:
             flash('You do not have the selected offered skill.', 'error')
             return redirect(url_for('send_request', receiver_id=receiver_id))
         
-        if not receiver_has_wanted:
+        if not checks.receiver_has_wanted:
             flash('The user does not offer the selected skill.', 'error')
             return redirect(url_for('send_request', receiver_id=receiver_id))
         
-        # Check for duplicate requests
-        existing_request = SwapRequest.query.filter_by(
-            requester_id=current_user.id,
-            receiver_id=receiver_id,
-            offered_skill_id=offered_skill_id,
-            wanted_skill_id=wanted_skill_id,
-            status='pending'
-        ).first()
-        
-        if existing_request:
+        if checks.duplicate_pending:
             flash('You already have a pending request for this skill swap.', 'error')
             return redirect(url_for('user_detail', user_id=receiver_id))
         
@@ -342,13 +468,21 @@ def send_request(receiver_id):
         
         try:
             db.session.add(swap_request)
+            db.session.flush()
+            record_swap_change(swap_request)
             db.session.commit()
+            count_event('request_sent', current_user.id)
+            count_event('request_received', receiver_id)
             flash('Swap request sent successfully!', 'success')
             return redirect(url_for('user_detail', user_id=receiver_id))
         except Exception as e:
             db.session.rollback()
             flash('An error occurred while sending the request.', 'error')
     
+    receiver = User.query.options(
+        selectinload(User.skills_offered).selectinload(UserSkill.skill)
+    ).get_or_404(receiver_id)
+    
     # Get skills for dropdowns with optimized queries
     user_offered_skills = [us.skill for us in current_user.skills_offered]
     receiver_offered_skills = [us.skill for us in receiver.skills_offered]
@@ -358,6 +492,7 @@ def send_request(receiver_id):
                          receiver_offered_skills=receiver_offered_skills)
 
 @app.route('/swap_requests')
+@read_replica
 def swap_requests():
     if not is_logged_in():
         flash('Please log in to view swap requests.', 'error')
@@ -377,21 +512,25 @@ def swap_requests():
     if status_filter:
         received_query = received_query.filter_by(status=status_filter)
     
-    received_requests = received_query.order_by(SwapRequest.created_at.desc()).paginate(
+    received_requests = Deferred(lambda: received_query.order_by(SwapRequest.created_at.desc()).paginate(
         page=page, per_page=20, error_out=False
-    )
+    ))
     
     # Get sent requests with eager loading and limit
-    sent_requests = SwapRequest.query.options(
+    sent_requests = Deferred(lambda: SwapRequest.query.options(
         joinedload(SwapRequest.receiver),
         joinedload(SwapRequest.offered_skill),
         joinedload(SwapRequest.wanted_skill)
     ).filter_by(requester_id=current_user.id).order_by(
         SwapRequest.created_at.desc()
-    ).limit(50).all()
+    ).limit(50).all())
+    
+    # Long-closed swaps whose rows were moved to the archive
+    archived_requests = Deferred(lambda: get_archived_swaps(current_user.id, status_filter))
     
-    return render_template('swap_requests.html', received_requests=received_requests,
-                         sent_requests=sent_requests, status_filter=status_filter)
+    return render_streamed('swap_requests.html', received_requests=received_requests,
+                         sent_requests=sent_requests, archived_requests=archived_requests,
+                         current_user_id=current_user.id, status_filter=status_filter)
 
 @app.route('/handle_request/<int:request_id>/<action>')
 def handle_request(request_id, action):
@@ -414,6 +553,9 @@ def handle_request(request_id, action):
     if action in ['accept', 'reject']:
         swap_request.status = 'accepted' if action == 'accept' else 'rejected'
         swap_request.updated_at = datetime.utcnow()
+        if action == 'accept':
+            open_conversation(swap_request)
+        record_swap_change(swap_request)
         
         try:
             db.session.commit()
@@ -445,6 +587,7 @@ def delete_request(request_id):
         return redirect(url_for('swap_requests'))
     
     try:
+        record_swap_change(swap_request)
         db.session.delete(swap_request)
         db.session.commit()
         flash('Request deleted successfully!', 'success')
@@ -507,9 +650,14 @@ def rate_user(swap_request_id):
             )
             db.session.add(rating)
         
+        # Recompute the rated user's aggregates and leaderboard entries off-request
+        enqueue('refresh_user_rating', {'user_id': rated_user_id}, dedup_key=f'refresh_user_rating:{rated_user_id}')
+        enqueue('refresh_leaderboard_user', {'user_id': rated_user_id}, dedup_key=f'refresh_leaderboard_user:{rated_user_id}')
+        record_change('user', rated_user_id)
+        
         try:
             db.session.commit()
-            # Clear user's rating cache
+            # Invalidate here rather than in the job, which may run in another process
             cache.delete_memoized(rated_user.get_average_rating)
             cache.delete_memoized(rated_user.get_rating_count)
             flash('Rating submitted successfully!', 'success')
@@ -531,7 +679,15 @@ def messages(swap_request_id):
     swap_request = SwapRequest.query.options(
         joinedload(SwapRequest.requester),
         joinedload(SwapRequest.receiver)
-    ).get_or_404(swap_request_id)
+    ).get(swap_request_id)
+    
+    # Closed swaps may have been moved to the archive
+    if swap_request is None or swap_request.status != 'accepted':
+        archived = load_archived_swap(swap_request_id)
+        if archived:
+            return archived_messages(current_user, *archived)
+        if swap_request is None:
+            abort(404)
     
     # Check if user is part of this swap and if it's accepted
     if current_user.id not in [swap_request.requester_id, swap_request.receiver_id]:
@@ -542,32 +698,150 @@ def messages(swap_request_id):
         flash('Messages are only available for accepted swap requests.', 'error')
         return redirect(url_for('swap_requests'))
     
-    # Get messages with eager loading
-    messages = Message.query.options(
-        joinedload(Message.sender)
-    ).filter_by(swap_request_id=swap_request_id).order_by(Message.created_at.asc()).all()
-    
-    # Mark messages as read for current user efficiently
-    unread_messages = Message.query.filter_by(
+    # Mark messages as read for current user efficiently; this commits before the page starts streaming
+    updated = Message.query.filter_by(
         swap_request_id=swap_request_id,
         receiver_id=current_user.id,
         is_read=False
-    ).all()
-    
-    if unread_messages:
-        for msg in unread_messages:
-            msg.is_read = True
+    ).update({'is_read': True}, synchronize_session=False)
+    if updated:
+        mark_conversation_read(swap_request_id, current_user.id)
         
         try:
             db.session.commit()
         except:
             db.session.rollback()
     
+    # Get messages with eager loading
+    messages = Deferred(lambda: Message.query.options(
+        joinedload(Message.sender)
+    ).filter_by(swap_request_id=swap_request_id).order_by(Message.created_at.asc()).all())
+    
     # Determine the other user
     other_user_id = swap_request.receiver_id if current_user.id == swap_request.requester_id else swap_request.requester_id
     other_user = User.query.get(other_user_id)
     
-    return render_template('messages.html', swap_request=swap_request, messages=messages, other_user=other_user)
+    return render_streamed('messages.html', swap_request=swap_request, messages=messages, other_user=other_user)
+
+def archived_messages(current_user, swap_request, messages):
+    """Render an archived conversation read-only"""
+    if current_user.id not in [swap_request.requester_id, swap_request.receiver_id]:
+        flash('You are not authorized to view these messages.', 'error')
+        return redirect(url_for('swap_requests'))
+    
+    other_user_id = swap_request.receiver_id if current_user.id == swap_request.requester_id else swap_request.requester_id
+    other_user = User.query.get_or_404(other_user_id)
+    
+    return render_template('messages.html', swap_request=swap_request, messages=messages,
+                         other_user=other_user, read_only=True)
+
+@app.route('/notifications')
+def notifications():
+    if not is_logged_in():
+        flash('Please log in to view notifications.', 'error')
+        return redirect(url_for('login'))
+    
+    current_user = get_current_user()
+    admin_messages = get_notifications(current_user.id)
+    broadcast_cursor, direct_cursor, _ = get_admin_message_state(current_user.id)
+    unread_ids = {m.id for m in admin_messages
+                  if m.id > (broadcast_cursor if m.is_broadcast else direct_cursor)}
+    
+    match_alerts = get_match_alerts(current_user.id)
+    
+    # Viewing the list moves the read cursors past everything shown
+    try:
+        mark_notifications_read(current_user.id, admin_messages)
+        mark_alerts_read(current_user.id)
+    except Exception as e:
+        db.session.rollback()
+    
+    return render_template('notifications.html', admin_messages=admin_messages, unread_ids=unread_ids,
+                         match_alerts=match_alerts, saved_searches=get_saved_searches(current_user.id),
+                         subscriptions=get_subscriptions(current_user.id))
+
+@app.route('/saved_searches', methods=['POST'])
+def create_saved_search():
+    if not is_logged_in():
+        flash('Please log in to save searches.', 'error')
+        return redirect(url_for('login'))
+    
+    search = request.form.get('search', '').strip()[:100]
+    availability = request.form.get('availability', '').strip()[:200]
+    if not search and not availability:
+        flash('Enter a search before saving it.', 'error')
+        return redirect(url_for('index'))
+    
+    try:
+        _, skill = save_search(session['user_id'], search, availability)
+        if skill:
+            flash(f'Search saved. You will be notified when someone starts offering {skill.name}.', 'success')
+        else:
+            flash('Search saved. Alerts only cover searches that name a skill, so this one sends none.', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash('An error occurred while saving the search.', 'error')
+    
+    return redirect(url_for('index', search=search, availability=availability))
+
+@app.route('/saved_searches/<int:saved_search_id>/delete', methods=['POST'])
+def remove_saved_search(saved_search_id):
+    if not is_logged_in():
+        return redirect(url_for('login'))
+    
+    if delete_saved_search(session['user_id'], saved_search_id):
+        flash('Saved search removed.', 'success')
+    return redirect(url_for('notifications'))
+
+@app.route('/skill_alerts', methods=['POST'])
+def create_skill_alert():
+    if not is_logged_in():
+        flash('Please log in to create alerts.', 'error')
+        return redirect(url_for('login'))
+    
+    skill_name = request.form.get('skill', '').strip()
+    if not skill_name:
+        flash('Enter a skill to be notified about.', 'error')
+        return redirect(request.referrer or url_for('notifications'))
+    
+    try:
+        skill, created = get_or_create_skill(skill_name)
+        if created:
+            record_change('skill', skill.id)
+        subscribe_skill(session['user_id'], skill.id)
+        db.session.commit()
+        if created:
+            clear_skill_caches()
+        flash(f'You will be notified when someone offers {skill.name}.', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash('An error occurred while creating the alert.', 'error')
+    
+    return redirect(request.referrer or url_for('notifications'))
+
+@app.route('/skill_alerts/<int:subscription_id>/delete', methods=['POST'])
+def remove_skill_alert(subscription_id):
+    if not is_logged_in():
+        return redirect(url_for('login'))
+    
+    if unsubscribe_skill(session['user_id'], subscription_id):
+        flash('Alert removed.', 'success')
+    return redirect(url_for('notifications'))
+
+@app.route('/inbox')
+@read_replica
+def inbox():
+    if not is_logged_in():
+        flash('Please log in to view your conversations.', 'error')
+        return redirect(url_for('login'))
+    
+    current_user = get_current_user()
+    page = max(request.args.get('page', 1, type=int), 1)
+    
+    # Single indexed query on (user_id, last_activity)
+    conversations, has_next = get_inbox_page(current_user.id, page, per_page=20)
+    
+    return render_template('inbox.html', conversations=conversations, page=page, has_next=has_next)
 
 @app.route('/send_message/<int:swap_request_id>', methods=['POST'])
 def send_message(swap_request_id):
@@ -605,6 +879,7 @@ def send_message(swap_request_id):
     
     try:
         db.session.add(message)
+        record_message(message)
         db.session.commit()
         flash('Message sent successfully!', 'success')
     except Exception as e:
@@ -613,6 +888,17 @@ def send_message(swap_request_id):
     
     return redirect(url_for('messages', swap_request_id=swap_request_id))
 
+@app.route('/leaderboard')
+@read_replica
+def leaderboard():
+    skill_id = request.args.get('skill', type=int)
+    category = request.args.get('category', '', type=str)
+    
+    entries = get_leaderboard(skill_id=skill_id, category=category)
+    
+    return render_template('leaderboard.html', entries=entries, skill_id=skill_id, category=category,
+                         all_skills=get_all_skills_cached(), categories=get_skill_categories())
+
 @app.route('/admin')
 @cache.cached(timeout=60)  # Cache admin dashboard for 1 minute
 def admin_dashboard():
@@ -640,7 +926,77 @@ def admin_dashboard():
                          total_users=total_users, total_swaps=total_swaps,
                          pending_swaps=pending_swaps, banned_users=banned_users,
                          recent_users=recent_users, recent_swaps=recent_swaps,
-                         recent_skills=recent_skills)
+                         recent_skills=recent_skills, engagement=get_engagement(PLATFORM))
+
+@app.route('/admin/send_message', methods=['POST'])
+def admin_send_message():
+    if not is_admin():
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('index'))
+    
+    subject = request.form.get('message_title', '').strip()
+    content = request.form.get('message_content', '').strip()
+    recipient_username = request.form.get('recipient', '').strip()
+    
+    if not subject or not content:
+        flash('Please enter both a title and a message.', 'error')
+        return redirect(url_for('admin_dashboard'))
+    
+    recipient_id = None
+    if recipient_username:
+        recipient = User.query.filter_by(username=recipient_username).first()
+        if not recipient:
+            flash(f'User {recipient_username} does not exist.', 'error')
+            return redirect(url_for('admin_dashboard'))
+        recipient_id = recipient.id
+    
+    try:
+        send_admin_message(get_current_user().id, subject, content, recipient_id)
+        flash('Message sent to all users.' if recipient_id is None else f'Message sent to {recipient_username}.', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash('An error occurred while sending the message.', 'error')
+    
+    return redirect(url_for('admin_dashboard'))
+
+def invalidate_moderated(users=(), skills_changed=False, alert_users=()):
+    """One targeted cache invalidation for a whole moderation batch"""
+    for user_id in users:
+        cache.delete_memoized(get_cached_user, user_id)
+        cache.delete(f'view//api/user_skills/{user_id}')
+    if users:
+        clear_directory_facets()
+        get_availability_options.invalidate()
+    if skills_changed:
+        clear_skill_caches()
+        cache.delete('view//api/skills')
+    clear_alert_counts(alert_users)
+    cache.delete('view//admin')
+
+def moderate_users(user_ids, banned):
+    result = set_users_banned(user_ids, banned)
+    # Jobs join the moderation transaction, so they are enqueued before it commits
+    if result['users']:
+        enqueue('refresh_availability_options', dedup_key='refresh_availability_options')
+        if not banned:
+            enqueue('refresh_leaderboard_users', {'user_ids': result['users']})
+    db.session.commit()
+    invalidate_moderated(users=result['users'])
+    return result
+
+def moderate_skills(skill_ids, action):
+    if action == 'approve':
+        approved = approve_skills(skill_ids)
+        # Offerers gain the approved skills' leaderboard and directory entries
+        result = {'skills': approved, 'kept': [], 'users': skill_offerers(approved), 'alert_users': [], 'swaps': 0}
+    else:
+        result = delete_skills(skill_ids)
+    if result['users']:
+        enqueue('refresh_leaderboard_users', {'user_ids': result['users']})
+    db.session.commit()
+    invalidate_moderated(users=result['users'], skills_changed=bool(result['skills'] or result['kept']),
+                         alert_users=result['alert_users'])
+    return result
 
 @app.route('/admin/ban_user/<int:user_id>')
 def ban_user(user_id):
@@ -654,14 +1010,10 @@ def ban_user(user_id):
         flash('Cannot ban admin users.', 'error')
         return redirect(url_for('admin_dashboard'))
     
-    user.is_banned = not user.is_banned
-    
+    banned = not user.is_banned
     try:
-        db.session.commit()
-        # Clear caches
-        cache.delete_memoized(get_current_user)
-        cache.clear()
-        action = 'banned' if user.is_banned else 'unbanned'
+        moderate_users([user.id], banned)
+        action = 'banned' if banned else 'unbanned'
         flash(f'User {user.username} has been {action}.', 'success')
     except Exception as e:
         db.session.rollback()
@@ -676,13 +1028,11 @@ def approve_skill(skill_id):
         return redirect(url_for('index'))
     
     skill = Skill.query.get_or_404(skill_id)
-    skill.is_approved = True
+    skill_name = skill.name
     
     try:
-        db.session.commit()
-        # Clear skills cache
-        cache.delete_memoized(get_all_skills_cached)
-        flash(f'Skill "{skill.name}" has been approved.', 'success')
+        moderate_skills([skill_id], 'approve')
+        flash(f'Skill "{skill_name}" has been approved.', 'success')
     except Exception as e:
         db.session.rollback()
         flash('An error occurred while approving the skill.', 'error')
@@ -699,20 +1049,205 @@ def delete_skill(skill_id):
     skill_name = skill.name
     
     try:
-        # Delete related UserSkill entries first
-        UserSkill.query.filter_by(skill_id=skill_id).delete()
-        db.session.delete(skill)
-        db.session.commit()
-        
-        # Clear skills cache
-        cache.delete_memoized(get_all_skills_cached)
-        flash(f'Skill "{skill_name}" has been deleted.', 'success')
+        result = moderate_skills([skill_id], 'delete')
+        if result['kept']:
+            flash(f'Skill "{skill_name}" is used by past swaps, so it was removed from profiles and the catalog but kept for those swaps.', 'info')
+        else:
+            flash(f'Skill "{skill_name}" has been deleted.', 'success')
     except Exception as e:
         db.session.rollback()
         flash('An error occurred while deleting the skill.', 'error')
     
     return redirect(url_for('admin_dashboard'))
 
+@app.route('/admin/moderation')
+def admin_moderation():
+    if not is_admin():
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('index'))
+    
+    user_search = request.args.get('user_search', '', type=str).strip()
+    user_status = request.args.get('user_status', '', type=str)
+    skill_search = request.args.get('skill_search', '', type=str).strip()
+    skill_status = request.args.get('skill_status', 'pending', type=str)
+    
+    users = moderation_users(user_search, user_status, request.args.get('user_page', 1, type=int))
+    skills = moderation_skills(skill_search, skill_status, request.args.get('skill_page', 1, type=int))
+    
+    return render_template('admin_moderation.html', users=users, skills=skills,
+                         user_search=user_search, user_status=user_status,
+                         skill_search=skill_search, skill_status=skill_status)
+
+def _bulk_ids(field):
+    ids = parse_ids(request.form.getlist(field))
+    if not ids:
+        flash('Select at least one entry first.', 'error')
+    elif len(ids) > MODERATION_MAX_BATCH:
+        flash(f'At most {MODERATION_MAX_BATCH} entries can be moderated at once.', 'error')
+        ids = []
+    return ids
+
+def _moderation_redirect():
+    # Back to the filtered page the form was on
+    next_url = request.form.get('next', '')
+    return redirect(next_url if next_url.startswith('/admin/') else url_for('admin_moderation'))
+
+@app.route('/admin/bulk/users', methods=['POST'])
+def admin_bulk_users():
+    if not is_admin():
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('index'))
+    
+    action = request.form.get('action', '')
+    user_ids = _bulk_ids('user_ids')
+    if action not in ('ban', 'unban'):
+        flash('Unknown moderation action.', 'error')
+    elif user_ids:
+        try:
+            result = moderate_users(user_ids, action == 'ban')
+            message = f'{len(result["users"])} users {action}ned'
+            if result['swaps']:
+                message += f', {result["swaps"]} pending requests rejected'
+            flash(message + '.', 'success')
+        except Exception as e:
+            db.session.rollback()
+            flash('An error occurred while updating user status.', 'error')
+    
+    return _moderation_redirect()
+
+@app.route('/admin/bulk/skills', methods=['POST'])
+def admin_bulk_skills():
+    if not is_admin():
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('index'))
+    
+    action = request.form.get('action', '')
+    skill_ids = _bulk_ids('skill_ids')
+    if action not in ('approve', 'delete'):
+        flash('Unknown moderation action.', 'error')
+    elif skill_ids:
+        try:
+            result = moderate_skills(skill_ids, action)
+            if action == 'approve':
+                flash(f'{len(result["skills"])} skills approved.', 'success')
+            else:
+                message = f'{len(result["skills"])} skills deleted'
+                if result['swaps']:
+                    message += f', {result["swaps"]} pending requests removed'
+                if result['kept']:
+                    message += f'; {len(result["kept"])} used by past swaps were removed from profiles and the catalog but kept for those swaps'
+                flash(message + '.', 'success')
+        except Exception as e:
+            db.session.rollback()
+            flash('An error occurred while moderating skills.', 'error')
+    
+    return _moderation_redirect()
+
+@app.route('/admin/jobs')
+def admin_jobs():
+    if not is_admin():
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    return jsonify(job_metrics())
+
+@app.route('/admin/pool')
+def admin_pool():
+    if not is_admin():
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    return jsonify(pool_metrics())
+
+@app.route('/admin/profiles')
+def admin_profiles():
+    if not is_admin():
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('index'))
+    
+    return render_template('admin_profiles.html', profiles=list_profiles())
+
+@app.route('/admin/profiles/<filename>')
+def admin_profile_file(filename):
+    if not is_admin():
+        abort(403)
+    
+    return send_from_directory(PROFILE_DIR, filename, as_attachment=True)
+
+# Background job handlers
+@job('refresh_user_rating')
+def refresh_user_rating(user_id):
+    user = User.query.get(user_id)
+    if user:
+        # The request already invalidated; this drops the worker process's own copy and recomputes
+        # it, so with a shared cache the next page view is warm
+        cache.delete_memoized(user.get_average_rating)
+        cache.delete_memoized(user.get_rating_count)
+        user.get_average_rating()
+        user.get_rating_count()
+
+@job('process_profile_photo')
+def process_profile_photo(user_id, digest):
+    try:
+        generate_thumbnails(digest)
+    except Exception as e:
+        # An image that can't be thumbnailed never will be; don't keep the original around
+        if not User.query.filter_by(profile_photo=digest).first():
+            discard_original(digest)
+        logger.warning(f'Discarded profile photo {digest} of user {user_id}: {e}')
+        return
+    User.query.filter_by(id=user_id).update({'profile_photo': digest})
+    record_change('user', user_id)
+    db.session.commit()
+    cache.delete_memoized(get_cached_user, user_id)
+
+@job('refresh_leaderboard_user')
+def refresh_leaderboard_user(user_id):
+    refresh_user_leaderboard(user_id)
+    db.session.commit()
+
+@job('refresh_leaderboard_users')
+def refresh_leaderboard_users(user_ids):
+    for user_id in user_ids:
+        refresh_user_leaderboard(user_id)
+    db.session.commit()
+
+@job('refresh_availability_options')
+def refresh_availability_options():
+    get_availability_options.refresh()
+
+# Cache warmers
+@warmer
+def warm_directory_profiles():
+    """Precompute per-user lookups for the first directory pages and the most-rated profiles"""
+    directory_users = User.query.options(
+        selectinload(User.skills_offered).selectinload(UserSkill.skill),
+        selectinload(User.skills_wanted).selectinload(UserSkill.skill)
+    ).filter(User.is_public == True, User.is_banned == False).order_by(
+        User.created_at.desc()
+    ).limit(DIRECTORY_PER_PAGE * WARM_DIRECTORY_PAGES).all()
+    
+    top_rated_ids = [row[0] for row in db.session.query(Rating.rated_id).group_by(
+        Rating.rated_id
+    ).order_by(func.count(Rating.id).desc()).limit(DIRECTORY_PER_PAGE).all()]
+    top_users = User.query.options(
+        selectinload(User.skills_offered).selectinload(UserSkill.skill),
+        selectinload(User.skills_wanted).selectinload(UserSkill.skill)
+    ).filter(User.id.in_(top_rated_ids)).all() if top_rated_ids else []
+    
+    for user in directory_users + top_users:
+        user.get_average_rating()
+        user.get_rating_count()
+        user.get_offered_skills_list()
+        user.get_wanted_skills_list()
+
+@app.route('/sw.js')
+def service_worker():
+    # Served from the root so it controls every page; revalidated on each check for updates
+    response = make_response(service_worker_script())
+    response.mimetype = 'application/javascript'
+    response.headers['Cache-Control'] = 'no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('404.html'), 404
@@ -722,20 +1257,77 @@ def internal_error(error):
     db.session.rollback()
     return render_template('500.html'), 500
 
+app.add_template_global(avatar_url)
+
 # Template context processors
 @app.context_processor
 def inject_user():
-    return dict(current_user=get_current_user(), is_logged_in=is_logged_in(), is_admin=is_admin())
+    current_user = get_current_user()
+    admin_unread_count = get_admin_unread_count(current_user.id) if current_user else 0
+    alert_unread_count = get_unread_alert_count(current_user.id) if current_user else 0
+    return dict(current_user=current_user, is_logged_in=is_logged_in(), is_admin=is_admin(),
+                admin_unread_count=admin_unread_count, alert_unread_count=alert_unread_count)
 
 # API endpoints for faster data loading
 @app.route('/api/skills')
 @cache.cached(timeout=300)  # Cache for 5 minutes
+@read_replica
 def api_skills():
     skills = get_all_skills_cached()
     return jsonify([{'id': skill[0], 'name': skill[1]} for skill in skills])
 
+@app.route('/api/sync')
+def api_sync():
+    # Without ?since= the client gets a full snapshot to start from
+    since = request.args.get('since', type=int)
+    return jsonify(get_sync_payload(session.get('user_id'), since))
+
+@app.route('/api/skill_suggestions')
+def api_skill_suggestions():
+    query = request.args.get('q', '').strip()
+    return jsonify([{'id': skill_id, 'name': name, 'similarity': similarity}
+                    for skill_id, name, similarity in suggest_skills(query)])
+
+@app.route('/api/leaderboard')
+@read_replica
+def api_leaderboard():
+    skill_id = request.args.get('skill', type=int)
+    category = request.args.get('category', '', type=str)
+    
+    return jsonify([{
+        'user_id': entry.user_id,
+        'name': entry.user.name or entry.user.username,
+        'average_rating': round(entry.average_rating, 2),
+        'rating_count': entry.rating_count,
+        'score': round(entry.score, 3)
+    } for entry in get_leaderboard(skill_id=skill_id, category=category)])
+
+@app.route('/api/messages/<int:swap_request_id>')
+def api_messages(swap_request_id):
+    """Messages after ?after=<id>. Under ASGI, ?wait=<seconds> long-polls instead (see asgi.py)."""
+    if not is_logged_in():
+        return jsonify({'error': 'Login required'}), 401
+    
+    current_user = get_current_user()
+    swap_request = SwapRequest.query.get_or_404(swap_request_id)
+    if current_user.id not in [swap_request.requester_id, swap_request.receiver_id]:
+        return jsonify({'error': 'Not a participant of this swap'}), 403
+    
+    after_id = request.args.get('after', 0, type=int)
+    new_messages = Message.query.filter(
+        Message.swap_request_id == swap_request_id, Message.id > after_id
+    ).order_by(Message.id).limit(100).all()
+    
+    return jsonify([{
+        'id': msg.id,
+        'sender_id': msg.sender_id,
+        'content': msg.content,
+        'created_at': msg.created_at.isoformat()
+    } for msg in new_messages])
+
 @app.route('/api/user_skills/<int:user_id>')
 @cache.cached(timeout=60)  # Cache for 1 minute
+@read_replica
 def api_user_skills(user_id):
     user = User.query.options(
         selectinload(User.skills_offered).selectinload(UserSkill.skill),
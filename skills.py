@@ -0,0 +1,209 @@
+import os
+import logging
+import click
+from collections import Counter, defaultdict
+from sqlalchemy import inspect, text, select, update, delete, func, or_
+from app import db, cache
+from models import Skill, UserSkill, SwapRequest, LeaderboardEntry, SkillSubscription, MatchAlert, canonical_skill_key
+from warmup import coalesced_cache, warm_caches
+from leaderboard import refresh_user_leaderboard
+from sync import record_change, record_swap_change
+
+logger = logging.getLogger(__name__)
+
+# Minimum trigram similarity (shared / total trigrams) for a suggestion, as pg_trgm's default
+SUGGEST_THRESHOLD = float(os.environ.get('SKILL_SUGGEST_THRESHOLD', 0.3))
+SUGGEST_LIMIT = 5
+# Cache backends a CLI process can't clear for the running app
+PROCESS_LOCAL_CACHES = {'simple', 'simplecache', 'null', 'nullcache'}
+
+
+def trigrams(key):
+    padded = f'  {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+@coalesced_cache(timeout=300)  # Cache for 5 minutes
+def get_skill_trigram_index():
+    """Inverted trigram index over the approved catalog: (names, trigram counts, postings)"""
+    names, sizes, postings = {}, {}, defaultdict(list)
+    for skill_id, name in db.session.query(Skill.id, Skill.name).filter(Skill.is_approved == True):
+        grams = trigrams(canonical_skill_key(name))
+        names[skill_id] = name
+        sizes[skill_id] = len(grams)
+        for gram in grams:
+            postings[gram].append(skill_id)
+    return names, sizes, dict(postings)
+
+
+def suggest_skills(name, limit=SUGGEST_LIMIT):
+    """Approved skills similar to `name` as (id, name, similarity), best first"""
+    key = canonical_skill_key(name)
+    if not key:
+        return []
+    grams = trigrams(key)
+    names, sizes, postings = get_skill_trigram_index()
+
+    shared = Counter()
+    for gram in grams:
+        shared.update(postings.get(gram, ()))
+
+    scored = []
+    for skill_id, count in shared.items():
+        similarity = count / (len(grams) + sizes[skill_id] - count)
+        if similarity >= SUGGEST_THRESHOLD:
+            scored.append((skill_id, names[skill_id], round(similarity, 2)))
+    scored.sort(key=lambda item: (-item[2], item[1]))
+    return scored[:limit]
+
+
+def get_or_create_skill(name):
+    """Return (skill, created) for the skill whose canonical key matches `name`"""
+    name = ' '.join(name.split())
+    skill = Skill.query.filter_by(canonical_key=canonical_skill_key(name)).first()
+    if skill:
+        return skill, False
+    skill = Skill(name=name)
+    db.session.add(skill)
+    db.session.flush()
+    return skill, True
+
+
+def merge_skills(target_id, source_ids):
+    """Re-point user skills, swap requests, subscriptions and alerts from `source_ids` to `target_id` and delete the sources.
+
+    Every step is one set-based statement regardless of how many rows refer
+    to the sources. The caller commits.
+    """
+    source_ids = sorted(set(source_ids) - {target_id})
+    target = db.session.get(Skill, target_id)
+    sources = Skill.query.filter(Skill.id.in_(source_ids)).all()
+    if target is None or len(sources) != len(source_ids):
+        raise ValueError('Unknown skill id')
+
+    affected_users = [row[0] for row in db.session.query(UserSkill.user_id).filter(
+        UserSkill.skill_id.in_(source_ids)
+    ).distinct()]
+
+    affected_swaps = SwapRequest.query.filter(or_(
+        SwapRequest.offered_skill_id.in_(source_ids), SwapRequest.wanted_skill_id.in_(source_ids)
+    )).all()
+
+    db.session.execute(update(UserSkill).where(UserSkill.skill_id.in_(source_ids)).values(skill_id=target_id))
+    # A user who listed several spellings keeps one row per skill type
+    keep = select(func.min(UserSkill.id)).where(UserSkill.skill_id == target_id).group_by(
+        UserSkill.user_id, UserSkill.skill_type
+    )
+    db.session.execute(delete(UserSkill).where(UserSkill.skill_id == target_id, UserSkill.id.not_in(keep)))
+
+    for column in (SwapRequest.offered_skill_id, SwapRequest.wanted_skill_id):
+        db.session.execute(update(SwapRequest).where(column.in_(source_ids)).values({column: target_id}))
+
+    # One subscription per user, explicit if any of the merged ones was
+    merged_ids = [target_id] + source_ids
+    explicit = db.session.scalars(select(SkillSubscription.user_id).where(
+        SkillSubscription.skill_id.in_(merged_ids), SkillSubscription.saved_search_id.is_(None)).distinct()).all()
+    keep = select(func.min(SkillSubscription.id)).where(SkillSubscription.skill_id.in_(merged_ids)).group_by(
+        SkillSubscription.user_id
+    )
+    db.session.execute(delete(SkillSubscription).where(
+        SkillSubscription.skill_id.in_(merged_ids), SkillSubscription.id.not_in(keep)))
+    db.session.execute(update(SkillSubscription).where(SkillSubscription.skill_id.in_(merged_ids)).values(
+        skill_id=target_id))
+    db.session.execute(update(SkillSubscription).where(
+        SkillSubscription.skill_id == target_id, SkillSubscription.user_id.in_(explicit)
+    ).values(saved_search_id=None))
+    db.session.execute(update(MatchAlert).where(MatchAlert.skill_id.in_(source_ids)).values(skill_id=target_id))
+
+    db.session.execute(delete(LeaderboardEntry).where(
+        LeaderboardEntry.scope == 'skill',
+        LeaderboardEntry.scope_key.in_([str(skill_id) for skill_id in source_ids])
+    ))
+
+    if not target.category:
+        target.category = next((skill.category for skill in sources if skill.category), None)
+    if any(skill.is_approved for skill in sources):
+        target.is_approved = True
+    db.session.execute(delete(Skill).where(Skill.id.in_(source_ids)))
+
+    for skill_id in [target_id] + source_ids:
+        record_change('skill', skill_id)
+    for user_id in affected_users:
+        refresh_user_leaderboard(user_id)
+        record_change('user', user_id)
+    for swap in affected_swaps:
+        record_swap_change(swap)
+    return len(source_ids)
+
+
+def merge_duplicate_skills():
+    """Merge every group of skills that share a canonical key, one transaction per group"""
+    groups = defaultdict(list)
+    for skill in Skill.query.order_by(Skill.id).all():
+        groups[canonical_skill_key(skill.name)].append(skill)
+
+    merged = 0
+    for key, skills in groups.items():
+        if len(skills) < 2:
+            continue
+        # Keep the row that already holds the key, else the oldest approved one
+        target = min(skills, key=lambda skill: (skill.canonical_key != key, not skill.is_approved, skill.id))
+        merged += merge_skills(target.id, [skill.id for skill in skills])
+        target.canonical_key = key
+        db.session.commit()
+    return merged
+
+
+def backfill_canonical_keys():
+    """Add the canonical_key column to databases created before it existed and fill it in"""
+    columns = {column['name'] for column in inspect(db.engine).get_columns('skill')}
+    if 'canonical_key' not in columns:
+        with db.engine.begin() as connection:
+            connection.execute(text('ALTER TABLE skill ADD COLUMN canonical_key VARCHAR(100)'))
+        for index in Skill.__table__.indexes:
+            if 'canonical_key' in index.columns:
+                index.create(db.engine)
+
+    missing = Skill.query.filter(Skill.canonical_key.is_(None)).order_by(Skill.id).all()
+    if not missing:
+        return
+    taken = {row[0] for row in db.session.query(Skill.canonical_key).filter(Skill.canonical_key.isnot(None))}
+    duplicates = 0
+    for skill in missing:
+        key = canonical_skill_key(skill.name)
+        if key in taken:
+            duplicates += 1
+            continue
+        skill.canonical_key = key
+        taken.add(key)
+    db.session.commit()
+    if duplicates:
+        logger.warning(f'{duplicates} skills duplicate another skill name; '
+                       'run `flask --app main merge-skills --duplicates` to merge them')
+
+
+def init_skills(app):
+    backfill_canonical_keys()
+
+    @app.cli.command('merge-skills')
+    @click.argument('skill_ids', nargs=-1, type=int)
+    @click.option('--into', 'target_id', type=int, help='Skill id to keep; SKILL_IDS are merged into it.')
+    @click.option('--duplicates', is_flag=True, help='Merge every group of skills with the same canonical name.')
+    def merge_skills_command(skill_ids, target_id, duplicates):
+        """Merge skills, re-pointing user skills and swap requests in bulk."""
+        if duplicates:
+            merged = merge_duplicate_skills()
+        elif target_id and skill_ids:
+            merged = merge_skills(target_id, skill_ids)
+        else:
+            raise click.UsageError('Pass --into TARGET with the skill ids to merge, or --duplicates.')
+        db.session.commit()
+        # Reaches running app processes only with a shared cache (CACHE_TYPE=RedisCache)
+        cache.clear()
+        print(f'Merged {merged} skills')
+        if app.config['CACHE_TYPE'].lower() in PROCESS_LOCAL_CACHES:
+            print('The cache is per process: restart the app to show the merge now, '
+                  'otherwise its skill lists catch up within 5 minutes')
+        else:
+            # Refill the shared cache so the app's next requests don't all start cold
+            warm_caches()
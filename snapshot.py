@@ -0,0 +1,294 @@
+import os
+import time
+import logging
+import threading
+import tracemalloc
+from array import array
+from collections import Counter
+from flask_sqlalchemy.pagination import Pagination
+from sqlalchemy import select, func
+from sqlalchemy.orm import selectinload
+from app import db
+from models import User, Skill, UserSkill, Rating, ChangeLog
+from directory import TOP_SKILL_FACETS, availability_facet
+from sync import PUBLIC, settled_version, snapshot_version
+from warmup import warmer
+
+logger = logging.getLogger(__name__)
+
+# Serve directory pages without a search term from an in-memory snapshot
+SNAPSHOT_ENABLED = os.environ.get('DIRECTORY_SNAPSHOT', '1') == '1'
+# Seconds between change log checks; edits show up in the directory within this (plus the sync settle window)
+SNAPSHOT_REFRESH_SECONDS = float(os.environ.get('DIRECTORY_SNAPSHOT_REFRESH', 2))
+# More pending changes than this and the snapshot is rebuilt instead of patched
+SNAPSHOT_MAX_CHANGES = int(os.environ.get('DIRECTORY_SNAPSHOT_MAX_CHANGES', 1000))
+# Availability filters whose matching rows are kept per snapshot
+FILTER_CACHE_SIZE = 64
+
+
+class DirectoryCard:
+    """The parts of a User that index.html reads, for one snapshot row"""
+    __slots__ = ('id', 'username', 'name', 'location', 'availability', 'profile_photo',
+                 'offered', 'wanted', 'average_rating')
+
+    def __init__(self, **fields):
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    def get_average_rating(self):
+        return self.average_rating
+
+    def get_offered_skills_list(self):
+        return self.offered
+
+    def get_wanted_skills_list(self):
+        return self.wanted
+
+
+class SnapshotPagination(Pagination):
+    """Pagination over matching snapshot rows, turned into cards only for the current page"""
+
+    def _query_items(self):
+        snapshot, rows = self._query_args['snapshot'], self._query_args['rows']
+        start = (self.page - 1) * self.per_page
+        return [snapshot.card(row) for row in rows[start:start + self.per_page]]
+
+    def _query_count(self):
+        return len(self._query_args['rows'])
+
+
+def _csr(skill_lists):
+    # Row i's skills are ids[start[i]:start[i + 1]]
+    start, ids = array('l', [0]), array('l')
+    for skill_ids in skill_lists:
+        ids.extend(skill_ids)
+        start.append(len(ids))
+    return start, ids
+
+
+class DirectorySnapshot:
+    """Public, unbanned users in directory order (newest first), stored column by column.
+
+    Row i of every column is the same user. Snapshots are never modified;
+    refreshing builds a new one and swaps it in.
+    """
+
+    def __init__(self, rows, skills, version):
+        rows = sorted(rows, key=lambda row: (row[1], row[0]), reverse=True)
+        self.version = version
+        self.skills = skills  # skill id -> (name, category, is_approved)
+        self.ids = array('l', (row[0] for row in rows))
+        self.created = array('d', (row[1] for row in rows))
+        self.usernames = [row[2] for row in rows]
+        self.names = [row[3] for row in rows]
+        self.locations = [row[4] for row in rows]
+        self.photos = [row[6] for row in rows]
+        # Each distinct availability string is stored once; rows hold its code
+        self.availability_values = sorted({row[5] or '' for row in rows})
+        codes = {value: code for code, value in enumerate(self.availability_values)}
+        self.availability = array('L', (codes[row[5] or ''] for row in rows))
+        self.offered_start, self.offered_ids = _csr(row[7] for row in rows)
+        self.wanted_start, self.wanted_ids = _csr(row[8] for row in rows)
+        self.rating_sum = array('l', (row[9] for row in rows))
+        self.rating_count = array('l', (row[10] for row in rows))
+        self._matching = {}
+        self._facets = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _skill_ids(self, start, ids, i):
+        return ids[start[i]:start[i + 1]]
+
+    def rows(self):
+        for i in range(len(self.ids)):
+            yield (self.ids[i], self.created[i], self.usernames[i], self.names[i], self.locations[i],
+                   self.availability_values[self.availability[i]] or None, self.photos[i],
+                   tuple(self._skill_ids(self.offered_start, self.offered_ids, i)),
+                   tuple(self._skill_ids(self.wanted_start, self.wanted_ids, i)),
+                   self.rating_sum[i], self.rating_count[i])
+
+    def patched(self, changed_rows, changed_ids, skills, version):
+        """A new snapshot with `changed_ids` replaced by `changed_rows` (users no longer listed are dropped)"""
+        kept = [row for row in self.rows() if row[0] not in changed_ids]
+        return DirectorySnapshot(kept + changed_rows, skills, version)
+
+    def card(self, i):
+        count = self.rating_count[i]
+        return DirectoryCard(
+            id=self.ids[i],
+            username=self.usernames[i],
+            name=self.names[i],
+            location=self.locations[i],
+            availability=self.availability_values[self.availability[i]] or None,
+            profile_photo=self.photos[i],
+            offered=[self.skills[s][0] for s in self._skill_ids(self.offered_start, self.offered_ids, i)
+                     if s in self.skills],
+            wanted=[self.skills[s][0] for s in self._skill_ids(self.wanted_start, self.wanted_ids, i)
+                    if s in self.skills],
+            average_rating=self.rating_sum[i] / count if count else 0.0,
+        )
+
+    def matching(self, availability_filter):
+        """Row numbers of users whose availability contains `availability_filter`, in order"""
+        if not availability_filter:
+            return range(len(self.ids))
+        key = availability_filter.lower()
+        rows = self._matching.get(key)
+        if rows is None:
+            # One bit per distinct availability string that matches
+            mask = 0
+            for code, value in enumerate(self.availability_values):
+                if key in value.lower():
+                    mask |= 1 << code
+            rows = array('l', (i for i, code in enumerate(self.availability) if mask >> code & 1))
+            if len(self._matching) >= FILTER_CACHE_SIZE:
+                self._matching.clear()
+            self._matching[key] = rows
+        return rows
+
+    def page(self, page, per_page, availability_filter=''):
+        return SnapshotPagination(page=page, per_page=per_page, error_out=False,
+                                  snapshot=self, rows=self.matching(availability_filter))
+
+    def facets(self, availability_filter=''):
+        """Same result as directory.get_directory_facets for a search without a search term"""
+        key = availability_filter.lower()
+        facets = self._facets.get(key)
+        if facets is not None:
+            return facets
+
+        categories, skill_names, availability = Counter(), Counter(), Counter()
+        for i in self.matching(availability_filter):
+            offered = {self.skills[s] for s in self._skill_ids(self.offered_start, self.offered_ids, i)
+                       if s in self.skills and self.skills[s][2]}
+            skill_names.update({name for name, _, _ in offered})
+            categories.update({category for _, category, _ in offered if category is not None})
+            if self.availability_values[self.availability[i]]:
+                availability[self.availability_values[self.availability[i]]] += 1
+
+        def ordered(counts):
+            return sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+
+        facets = {'category': ordered(categories), 'skill': ordered(skill_names)[:TOP_SKILL_FACETS],
+                  'availability': ordered(dict(availability_facet(list(availability.items()))))}
+        if len(self._facets) >= FILTER_CACHE_SIZE:
+            self._facets.clear()
+        self._facets[key] = facets
+        return facets
+
+
+def _load_skills():
+    return {skill_id: (name, category, is_approved) for skill_id, name, category, is_approved in
+            db.session.query(Skill.id, Skill.name, Skill.category, Skill.is_approved)}
+
+
+def _load_rows(user_ids=None):
+    """Snapshot rows for every listed user, or only for those of `user_ids` still listed"""
+    listed = [User.is_public == True, User.is_banned == False]
+    if user_ids is not None:
+        listed.append(User.id.in_(user_ids))
+    listed_ids = select(User.id).where(*listed)
+
+    skills = {}
+    for user_id, skill_type, skill_id in db.session.query(
+        UserSkill.user_id, UserSkill.skill_type, UserSkill.skill_id
+    ).filter(UserSkill.user_id.in_(listed_ids)).order_by(UserSkill.id):
+        skills.setdefault((user_id, skill_type), []).append(skill_id)
+
+    ratings = {rated_id: (total, count) for rated_id, total, count in db.session.query(
+        Rating.rated_id, func.sum(Rating.rating), func.count(Rating.id)
+    ).filter(Rating.rated_id.in_(listed_ids)).group_by(Rating.rated_id)}
+
+    return [
+        (user_id, created_at.timestamp() if created_at else 0.0, username, name, location, availability, photo,
+         tuple(skills.get((user_id, 'offered'), ())), tuple(skills.get((user_id, 'wanted'), ())),
+         *ratings.get(user_id, (0, 0)))
+        for user_id, created_at, username, name, location, availability, photo in db.session.query(
+            User.id, User.created_at, User.username, User.name, User.location, User.availability,
+            User.profile_photo
+        ).filter(*listed)
+    ]
+
+
+def build_directory_snapshot():
+    # Take the version first, so the rows read next are at least that new
+    version = snapshot_version()
+    return DirectorySnapshot(_load_rows(), _load_skills(), version)
+
+
+def _apply_changes(snapshot):
+    changes = ChangeLog.query.filter(ChangeLog.id > snapshot.version, ChangeLog.audience_id == PUBLIC).order_by(
+        ChangeLog.id
+    ).limit(SNAPSHOT_MAX_CHANGES + 1).all()
+    if not changes:
+        return snapshot
+    if len(changes) > SNAPSHOT_MAX_CHANGES:
+        return build_directory_snapshot()
+
+    # Changes inside the settle window are applied now and again on the next check; reloading is idempotent
+    version = settled_version(changes, snapshot.version)
+    user_ids = {change.entity_id for change in changes if change.entity == 'user'}
+    skills = _load_skills() if any(change.entity == 'skill' for change in changes) else snapshot.skills
+    return snapshot.patched(_load_rows(user_ids) if user_ids else [], user_ids, skills, version)
+
+
+_snapshot = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def get_directory_snapshot():
+    """This worker's snapshot, patched from the change log at most every SNAPSHOT_REFRESH_SECONDS"""
+    global _snapshot, _checked_at
+    if _snapshot is None:
+        with _lock:
+            if _snapshot is None:
+                _snapshot = build_directory_snapshot()
+                _checked_at = time.monotonic()
+        return _snapshot
+
+    # Only one thread refreshes; the others keep serving the current snapshot meanwhile
+    if time.monotonic() - _checked_at >= SNAPSHOT_REFRESH_SECONDS and _lock.acquire(blocking=False):
+        try:
+            _checked_at = time.monotonic()
+            _snapshot = _apply_changes(_snapshot)
+        except Exception as e:
+            logger.error(f'Directory snapshot refresh failed: {e}')
+        finally:
+            _lock.release()
+    return _snapshot
+
+
+@warmer
+def warm_directory_snapshot():
+    global _snapshot, _checked_at
+    if SNAPSHOT_ENABLED:
+        _snapshot = build_directory_snapshot()
+        _checked_at = time.monotonic()
+
+
+def init_snapshot(app):
+    @app.cli.command('directory-snapshot')
+    def directory_snapshot_command():
+        """Compare the directory snapshot's memory with the same users loaded as ORM objects."""
+        # Build once first so SQLAlchemy's statement caches aren't counted
+        build_directory_snapshot()
+        db.session.remove()
+
+        tracemalloc.start()
+        snapshot = build_directory_snapshot()
+        snapshot_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        db.session.remove()
+
+        tracemalloc.start()
+        users = User.query.options(
+            selectinload(User.skills_offered).selectinload(UserSkill.skill),
+            selectinload(User.skills_wanted).selectinload(UserSkill.skill)
+        ).filter(User.is_public == True, User.is_banned == False).all()
+        orm_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        print(f'{len(snapshot)} users (version {snapshot.version}): snapshot {snapshot_bytes / 1024:.0f} KiB, '
+              f'ORM objects {orm_bytes / 1024:.0f} KiB for {len(users)} users')
@@ -1,25 +1,28 @@
 // Service Worker for Skill Swap Platform
+// ASSET_VERSION and ASSET_URLS (/static path -> fingerprinted path) are prepended by the /sw.js route
 const CACHE_NAME = 'skillswap-v1';
-const STATIC_CACHE = 'skillswap-static-v1';
+const STATIC_CACHE = `skillswap-static-${ASSET_VERSION}`;
 const API_CACHE = 'skillswap-api-v1';
+const SYNC_CACHE = 'skillswap-sync-v1';
+const SYNC_VERSION_KEY = '/api/sync/version';
+// Minimum milliseconds between change checks against /api/sync
+const SYNC_INTERVAL = 60 * 1000;
+let lastSync = 0;
 
-// Static assets to cache
+function assetUrl(path) {
+    return ASSET_URLS[path] || path;
+}
+
+// Static assets to cache; fingerprinted URLs never change, so the cache only turns over on a new build
 const STATIC_ASSETS = [
     '/',
-    '/static/css/style.css',
-    '/static/js/main.js',
-    '/static/favicon.ico',
+    assetUrl('/static/css/style.css'),
+    assetUrl('/static/js/main.js'),
     'https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css',
     'https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/js/bootstrap.bundle.min.js',
     'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css'
 ];
 
-// API endpoints to cache
-const API_ENDPOINTS = [
-    '/api/skills',
-    '/api/user_skills/'
-];
-
 // Install event - cache static assets
 self.addEventListener('install', event => {
     console.log('Service Worker installing...');
@@ -40,7 +43,7 @@ self.addEventListener('activate', event => {
         caches.keys().then(cacheNames => {
             return Promise.all(
                 cacheNames.map(cacheName => {
-                    if (cacheName !== STATIC_CACHE && cacheName !== API_CACHE) {
+                    if (cacheName !== STATIC_CACHE && cacheName !== API_CACHE && cacheName !== SYNC_CACHE) {
                         console.log('Deleting old cache:', cacheName);
                         return caches.delete(cacheName);
                     }
@@ -72,14 +75,30 @@ self.addEventListener('fetch', event => {
     }
 });
 
+// Endpoints kept fresh through /api/sync instead of being re-downloaded
+function isSyncedEndpoint(pathname) {
+    return pathname === '/api/skills' || pathname.startsWith('/api/user_skills/');
+}
+
 // Handle API requests with cache-first strategy
 async function handleApiRequest(request) {
+    const pathname = new URL(request.url).pathname;
+    if (pathname === '/api/sync') {
+        return fetch(request);
+    }
+    
     const cache = await caches.open(API_CACHE);
     const cachedResponse = await cache.match(request);
     
     if (cachedResponse) {
         // Return cached response and update in background
-        updateApiCache(request, cache);
+        if (isSyncedEndpoint(pathname)) {
+            if (Date.now() - lastSync > SYNC_INTERVAL) {
+                syncApiCache();
+            }
+        } else {
+            updateApiCache(request, cache);
+        }
         return cachedResponse;
     }
     
@@ -225,17 +244,46 @@ self.addEventListener('periodicsync', event => {
 
 async function updateCaches() {
     console.log('Updating caches...');
-    
-    // Update API cache
-    const apiCache = await caches.open(API_CACHE);
-    for (const endpoint of API_ENDPOINTS) {
-        try {
-            const response = await fetch(endpoint);
-            if (response.ok) {
-                apiCache.put(endpoint, response.clone());
+    await syncApiCache();
+}
+
+// Drop only the cached API responses that changed since the last sync
+async function syncApiCache() {
+    lastSync = Date.now();
+    try {
+        const syncCache = await caches.open(SYNC_CACHE);
+        const apiCache = await caches.open(API_CACHE);
+        const stored = await syncCache.match(SYNC_VERSION_KEY);
+        let version = stored ? await stored.text() : null;
+        let more = true;
+        
+        while (more) {
+            const response = await fetch(version === null ? '/api/sync' : `/api/sync?since=${version}`);
+            if (!response.ok) {
+                return;
+            }
+            const changes = await response.json();
+            
+            if (changes.reset) {
+                for (const request of await apiCache.keys()) {
+                    if (isSyncedEndpoint(new URL(request.url).pathname)) {
+                        await apiCache.delete(request);
+                    }
+                }
+            } else {
+                if (changes.skills.length) {
+                    await apiCache.delete('/api/skills');
+                }
+                for (const user of changes.users) {
+                    await apiCache.delete(`/api/user_skills/${user.id}`);
+                }
             }
-        } catch (error) {
-            console.log(`Failed to update cache for ${endpoint}:`, error);
+            
+            version = String(changes.version);
+            more = changes.more;
+            await syncCache.put(SYNC_VERSION_KEY, new Response(version));
         }
+    } catch (error) {
+        console.log('API sync failed:', error);
     }
 } 
\ No newline at end of file
@@ -0,0 +1,82 @@
+import os
+import stat
+import logging
+from flask import Response, current_app, render_template, get_flashed_messages, stream_with_context
+from jinja2 import FileSystemBytecodeCache
+from profiling import is_profiling
+
+logger = logging.getLogger(__name__)
+
+# Stream index, swap requests and messages so the head and navbar flush before the rows render
+STREAM_TEMPLATES = os.environ.get('STREAM_TEMPLATES', '1') == '1'
+# Template output chunks joined into each network write
+STREAM_BUFFER = int(os.environ.get('STREAM_BUFFER', 20))
+# Compiled templates shared by every worker on the host; unset uses Jinja's per-user temp directory, empty disables the cache
+JINJA_CACHE_DIR = os.environ.get('JINJA_CACHE_DIR')
+
+_UNSET = object()
+
+
+class Deferred:
+    """Run `load` on first use, so a streamed page can flush its head before the query runs"""
+
+    def __init__(self, load):
+        self._load = load
+        self._value = _UNSET
+
+    def _resolve(self):
+        if self._value is _UNSET:
+            self._value = self._load()
+        return self._value
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __iter__(self):
+        return iter(self._resolve())
+
+    def __len__(self):
+        return len(self._resolve())
+
+    def __bool__(self):
+        return bool(self._resolve())
+
+    def __getitem__(self, key):
+        return self._resolve()[key]
+
+
+def render_streamed(template_name, **context):
+    """Like render_template, but sends the page as it renders"""
+    # A profiled request renders whole, so its deferred queries and rendering land in the profile
+    if not STREAM_TEMPLATES or is_profiling():
+        return render_template(template_name, **context)
+    app = current_app._get_current_object()
+    # Pop flashes now: the session cookie is sent with the headers, before the template reads them
+    get_flashed_messages(with_categories=True)
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(STREAM_BUFFER)
+    return Response(stream_with_context(stream), mimetype='text/html')
+
+
+def _private_dir(path):
+    # Cached bytecode is executed, so nobody but this user may be able to write it
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise OSError(f'{path} must be a directory owned by this user with mode 0700')
+    return path
+
+
+def init_templates(app):
+    if JINJA_CACHE_DIR != '':
+        try:
+            # Without a directory Jinja makes a per-user 0700 one and refuses one it doesn't own
+            app.jinja_env.bytecode_cache = (FileSystemBytecodeCache(_private_dir(JINJA_CACHE_DIR))
+                                            if JINJA_CACHE_DIR else FileSystemBytecodeCache())
+        except (OSError, RuntimeError) as e:
+            logger.warning(f'Jinja bytecode cache disabled: {e}')
+
+    # Compile every template at boot; with `gunicorn --preload` forked workers share them
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
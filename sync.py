@@ -0,0 +1,170 @@
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import exists, or_
+from sqlalchemy.orm import aliased, selectinload
+from app import db
+from models import User, Skill, UserSkill, SwapRequest, ChangeLog
+from jobs import job, enqueue
+from media import avatar_url
+
+PUBLIC = 0
+# Most changes returned per sync response; clients call again while `more` is true
+SYNC_PAGE_SIZE = int(os.environ.get('SYNC_PAGE_SIZE', 500))
+# The returned version stays below changes newer than this, so a transaction that
+# took an id earlier but committed later is still picked up on the next sync
+SYNC_SETTLE_SECONDS = float(os.environ.get('SYNC_SETTLE_SECONDS', 5))
+# Seconds between automatic change log compactions
+COMPACT_INTERVAL = int(os.environ.get('SYNC_COMPACT_INTERVAL', 3600))
+
+
+def record_change(entity, entity_id, audience_ids=(PUBLIC,)):
+    """Log that an entity changed, visible to everyone or only to `audience_ids`. The caller commits."""
+    record_changes(entity, [entity_id], audience_ids)
+
+
+def record_changes(entity, entity_ids, audience_ids=(PUBLIC,)):
+    """record_change for many entities at once; the rows go out in one batched INSERT"""
+    db.session.add_all([ChangeLog(entity=entity, entity_id=entity_id, audience_id=audience_id)
+                        for entity_id in entity_ids for audience_id in audience_ids])
+
+
+def record_swap_change(swap_request):
+    record_change('swap', swap_request.id, (swap_request.requester_id, swap_request.receiver_id))
+
+
+def _skill_rows(skill_ids=None):
+    query = Skill.query.filter(Skill.is_approved == True)
+    if skill_ids is not None:
+        query = query.filter(Skill.id.in_(skill_ids))
+    return {skill.id: {'id': skill.id, 'name': skill.name, 'category': skill.category} for skill in query}
+
+
+def _user_cards(user_ids=None):
+    query = User.query.options(
+        selectinload(User.skills_offered).selectinload(UserSkill.skill),
+        selectinload(User.skills_wanted).selectinload(UserSkill.skill)
+    ).filter(User.is_public == True, User.is_banned == False)
+    if user_ids is not None:
+        query = query.filter(User.id.in_(user_ids))
+    return {user.id: {
+        'id': user.id,
+        'name': user.name,
+        'location': user.location,
+        'availability': user.availability,
+        'photo': avatar_url(user.profile_photo, 80) if user.profile_photo else None,
+        'average_rating': user.get_average_rating(),
+        'rating_count': user.get_rating_count(),
+        'offered': user.get_offered_skills_list(),
+        'wanted': user.get_wanted_skills_list(),
+    } for user in query}
+
+
+def _swaps(user_id, swap_ids=None):
+    query = SwapRequest.query.filter(or_(SwapRequest.requester_id == user_id, SwapRequest.receiver_id == user_id))
+    if swap_ids is not None:
+        query = query.filter(SwapRequest.id.in_(swap_ids))
+    return {swap.id: {
+        'id': swap.id,
+        'requester_id': swap.requester_id,
+        'receiver_id': swap.receiver_id,
+        'offered_skill': swap.offered_skill.name,
+        'wanted_skill': swap.wanted_skill.name,
+        'status': swap.status,
+        'updated_at': swap.updated_at.isoformat() if swap.updated_at else None,
+    } for swap in query}
+
+
+def _with_deletions(ids, current):
+    # Anything that changed but is no longer visible is sent as a tombstone
+    return [current.get(entity_id, {'id': entity_id, 'deleted': True}) for entity_id in sorted(ids)]
+
+
+def settled_version(rows, fallback):
+    """Highest version the client can safely resume from"""
+    cutoff = datetime.utcnow() - timedelta(seconds=SYNC_SETTLE_SECONDS)
+    version = fallback
+    for row in rows:
+        if row.created_at > cutoff:
+            break
+        version = row.id
+    return version
+
+
+def snapshot_version():
+    """Version a full snapshot read right after this call can resume from, behind the settle window"""
+    recent = ChangeLog.query.order_by(ChangeLog.id.desc()).limit(100).all()[::-1]
+    return settled_version(recent, recent[0].id - 1 if recent else 0)
+
+
+def get_sync_payload(user_id, since):
+    """Skills, user cards and the user's swaps changed after version `since`.
+
+    `since=None` returns a full snapshot. Changed entities are sent in their
+    current state, so replaying a change twice is harmless.
+    """
+    if since is None:
+        # Taken before the rows, so changes still settling are sent again on the next sync
+        version = snapshot_version()
+        return {
+            'version': version,
+            'reset': True,
+            'more': False,
+            'skills': list(_skill_rows().values()),
+            'users': list(_user_cards().values()),
+            'swaps': list(_swaps(user_id).values()) if user_id else [],
+        }
+
+    audiences = [PUBLIC, user_id] if user_id else [PUBLIC]
+    rows = ChangeLog.query.filter(ChangeLog.id > since, ChangeLog.audience_id.in_(audiences)).order_by(
+        ChangeLog.id
+    ).limit(SYNC_PAGE_SIZE + 1).all()
+    more = len(rows) > SYNC_PAGE_SIZE
+    rows = rows[:SYNC_PAGE_SIZE]
+
+    changed = {'skill': set(), 'user': set(), 'swap': set()}
+    for row in rows:
+        changed[row.entity].add(row.entity_id)
+
+    return {
+        'version': settled_version(rows, since),
+        'reset': False,
+        'more': more,
+        'skills': _with_deletions(changed['skill'], _skill_rows(changed['skill'])) if changed['skill'] else [],
+        'users': _with_deletions(changed['user'], _user_cards(changed['user'])) if changed['user'] else [],
+        'swaps': _with_deletions(changed['swap'], _swaps(user_id, changed['swap'])) if changed['swap'] else [],
+    }
+
+
+def compact_change_log():
+    """Delete entries superseded by a newer entry for the same entity and audience.
+
+    A client that skipped the deleted entries still receives the newer one,
+    so the log stays bounded by the number of entities without forcing resyncs.
+    """
+    newer = aliased(ChangeLog)
+    removed = ChangeLog.query.filter(exists().where(
+        newer.entity == ChangeLog.entity,
+        newer.entity_id == ChangeLog.entity_id,
+        newer.audience_id == ChangeLog.audience_id,
+        newer.id > ChangeLog.id
+    )).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
+
+
+@job('compact_change_log')
+def compact_change_log_job():
+    compact_change_log()
+    enqueue('compact_change_log', dedup_key='compact_change_log', delay=COMPACT_INTERVAL)
+    db.session.commit()
+
+
+def init_sync(app):
+    # Keep exactly one compaction job scheduled
+    enqueue('compact_change_log', dedup_key='compact_change_log', delay=COMPACT_INTERVAL)
+    db.session.commit()
+
+    @app.cli.command('compact-changes')
+    def compact_changes_command():
+        """Drop change log entries superseded by newer ones."""
+        print(f'Removed {compact_change_log()} change log entries')
@@ -0,0 +1,185 @@
+# Measure what streamed templates and the Jinja bytecode cache change: time to first
+# byte, full response time, boot time and worker memory, before and after.
+#
+#   python templatebench.py --requests 50 --workers 4
+#   python templatebench.py --preload --output templatebench.json
+#
+# The app is started under Gunicorn twice against the same seeded SQLite database:
+# once rendering whole pages without a bytecode cache (before) and once streaming
+# with the cache (after). Pages are fetched as the sample user marc_demo.
+import os
+import re
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import subprocess
+from urllib.parse import urlencode
+from loadcompare import percentile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODES = {
+    'before': {'STREAM_TEMPLATES': '0', 'JINJA_CACHE_DIR': ''},
+    'after': {'STREAM_TEMPLATES': '1'},
+}
+
+
+def prepare_database(database_url):
+    # Create and seed the tables once, so workers booting together don't race to do it
+    os.environ.update(DATABASE_URL=database_url, JOBS_INPROCESS='0', CACHE_WARM_ON_BOOT='0')
+    import app  # noqa: F401
+
+
+def timed_request(port, method, path, headers=None, body=b''):
+    """Plain HTTP/1.1 request; returns (status, headers, body, seconds to first byte, seconds total)"""
+    started = time.perf_counter()
+    sock = socket.create_connection(('127.0.0.1', port), timeout=60)
+    try:
+        lines = [f'{method} {path} HTTP/1.1', f'Host: 127.0.0.1:{port}', 'Connection: close',
+                 f'Content-Length: {len(body)}']
+        lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+        sock.sendall(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        chunks = [sock.recv(65536)]
+        first_byte = time.perf_counter() - started
+        while chunks[-1]:
+            chunks.append(sock.recv(65536))
+        total = time.perf_counter() - started
+    finally:
+        sock.close()
+    head, _, payload = b''.join(chunks).partition(b'\r\n\r\n')
+    status_line, *header_lines = head.decode('latin-1').split('\r\n')
+    response_headers = [tuple(line.split(': ', 1)) for line in header_lines if ': ' in line]
+    return int(status_line.split()[1]), response_headers, payload, first_byte, total
+
+
+def login(port, username, password):
+    body = urlencode({'username': username, 'password': password}).encode()
+    _, headers, _, _, _ = timed_request(port, 'POST', '/login', {
+        'Content-Type': 'application/x-www-form-urlencoded'}, body)
+    for name, value in headers:
+        if name.lower() == 'set-cookie' and value.startswith('session='):
+            return value.split(';', 1)[0]
+    raise SystemExit('Login failed')
+
+
+def worker_rss_mb(server_pid):
+    """Resident memory of each Gunicorn worker (children of the master), from /proc"""
+    rss = []
+    for pid in filter(str.isdigit, os.listdir('/proc')):
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                parent = int(f.read().rsplit(')', 1)[1].split()[1])
+            if parent != server_pid:
+                continue
+            with open(f'/proc/{pid}/status') as f:
+                rss += [int(line.split()[1]) / 1024 for line in f if line.startswith('VmRSS:')]
+        except (OSError, IndexError, ValueError):
+            continue
+    return rss
+
+
+def start_server(args, database_url, mode_env):
+    env = dict(os.environ, DATABASE_URL=database_url, RATE_LIMIT_ENABLED='0', **mode_env)
+    command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{args.port}',
+               '--workers', str(args.workers), '--log-level', 'warning']
+    if args.preload:
+        command.append('--preload')
+    return subprocess.Popen(command + ['main:app'], cwd=HERE, env=env)
+
+
+def wait_until_ready(port, server, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit('Gunicorn exited during startup')
+        try:
+            if timed_request(port, 'GET', '/login')[0] == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit('Server did not become ready')
+
+
+def run_mode(args, database_url, mode_env):
+    started = time.monotonic()
+    server = start_server(args, database_url, mode_env)
+    try:
+        wait_until_ready(args.port, server)
+        boot_seconds = time.monotonic() - started
+        cookie = login(args.port, args.username, args.password)
+        headers = {'Cookie': cookie}
+
+        _, _, page, _, _ = timed_request(args.port, 'GET', '/swap_requests', headers)
+        paths = ['/', '/swap_requests']
+        swap_ids = re.findall(rb'/messages/(\d+)', page)
+        if swap_ids:
+            paths.append(f'/messages/{int(swap_ids[0])}')
+
+        pages = {}
+        for path in paths:
+            first_bytes, totals = [], []
+            for _ in range(args.requests):
+                status, _, _, first_byte, total = timed_request(args.port, 'GET', path, headers)
+                if status != 200:
+                    raise SystemExit(f'GET {path} returned {status}')
+                first_bytes.append(first_byte)
+                totals.append(total)
+            pages[path] = {
+                'ttfb_p50_ms': round(percentile(first_bytes, 50) * 1000, 2),
+                'ttfb_p95_ms': round(percentile(first_bytes, 95) * 1000, 2),
+                'total_p50_ms': round(percentile(totals, 50) * 1000, 2),
+                'total_p95_ms': round(percentile(totals, 95) * 1000, 2),
+            }
+        rss = worker_rss_mb(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        'boot_seconds': round(boot_seconds, 2),
+        'worker_rss_mb': [round(value, 1) for value in rss],
+        'worker_rss_mb_total': round(sum(rss), 1),
+        'pages': pages,
+    }
+
+
+def print_report(report):
+    before, after = report['before'], report['after']
+    print(f"{'':<32}{'before':>12}{'after':>12}")
+    print(f"{'boot s':<32}{before['boot_seconds']:>12}{after['boot_seconds']:>12}")
+    print(f"{'worker RSS MB total':<32}{before['worker_rss_mb_total']:>12}{after['worker_rss_mb_total']:>12}")
+    for path, page in after['pages'].items():
+        old = before['pages'].get(path, {})
+        for metric in ('ttfb_p50_ms', 'ttfb_p95_ms', 'total_p50_ms', 'total_p95_ms'):
+            print(f"{path + ' ' + metric:<32}{old.get(metric, '-'):>12}{page[metric]:>12}")
+
+
+def main(args):
+    database_url = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'templatebench.db')
+    prepare_database(database_url)
+    cache_dir = tempfile.mkdtemp(prefix='jinja-')
+    report = {}
+    for name, mode_env in MODES.items():
+        if name == 'after':
+            mode_env = dict(mode_env, JINJA_CACHE_DIR=cache_dir)
+        report[name] = run_mode(args, database_url, mode_env)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Results saved to {args.output}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark streamed templates and the Jinja bytecode cache')
+    parser.add_argument('--requests', type=int, default=50, help='Requests per page and mode')
+    parser.add_argument('--workers', type=int, default=4, help='Gunicorn worker processes')
+    parser.add_argument('--preload', action='store_true', help='Load the app before forking workers')
+    parser.add_argument('--port', type=int, default=5056)
+    parser.add_argument('--username', default='marc_demo')
+    parser.add_argument('--password', default='password123')
+    parser.add_argument('--database-url', help='Database to serve (default: a fresh SQLite file)')
+    parser.add_argument('--output', help='Where to save the JSON results')
+    main(parser.parse_args())
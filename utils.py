@@ -1,5 +1,7 @@
 from app import db
 from models import User, Skill, UserSkill, SwapRequest, Rating
+from leaderboard import rebuild_leaderboard
+from inbox import rebuild_conversation_summaries
 from datetime import datetime, timedelta
 import random
 
@@ -253,6 +255,8 @@ def create_sample_data():
     
     try:
         db.session.commit()
+        rebuild_leaderboard()
+        rebuild_conversation_summaries()
         print("Sample data created successfully!")
         print("\nSample users created:")
         print("- admin (password: admin123) - Admin user")
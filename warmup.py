@@ -0,0 +1,92 @@
+import time
+import logging
+from functools import wraps
+from app import cache
+
+logger = logging.getLogger(__name__)
+
+# Longest a single recomputation may hold the refresh lock
+REFRESH_LOCK_TIMEOUT = 30
+
+# Functions run by warm_caches(), in registration order
+_warmers = []
+
+
+def warmer(func):
+    """Register a function to run at startup and after `flask merge-skills` clears a shared cache.
+
+    Targeted invalidations don't re-warm: the next request recomputes the entry.
+    """
+    _warmers.append(func)
+    return func
+
+
+def warm_caches():
+    """Precompute every registered hot cache entry"""
+    started = time.perf_counter()
+    for func in _warmers:
+        try:
+            func()
+        except Exception as e:
+            logger.error(f'Cache warmer {func.__name__} failed: {e}')
+    logger.info(f'Warmed {len(_warmers)} cache groups in {time.perf_counter() - started:.3f}s')
+
+
+def coalesced_cache(timeout=300, stale_ttl=300, cold_wait=0.5):
+    """Cache a zero-argument function with single-flight refresh.
+
+    Values are fresh for `timeout` seconds and then kept for another
+    `stale_ttl`. When a value goes stale only the caller that wins the
+    refresh lock recomputes it; everyone else keeps getting the stale value.
+    On a cold key, losers wait up to `cold_wait` seconds for the winner.
+    The wrapper gains refresh() and invalidate(), and is registered as a warmer.
+
+    The lock and values live in the app cache, so they are only as shared as
+    the cache backend. With the default per-process cache each worker process
+    refreshes on its own (only its threads are coalesced); across workers it
+    takes CACHE_TYPE=RedisCache, whose add() is atomic.
+    """
+    def decorator(func):
+        key = f'coalesced:{func.__module__}.{func.__qualname__}'
+        lock_key = f'{key}:lock'
+
+        def refresh():
+            value = func()
+            cache.set(key, (value, time.time() + timeout), timeout=timeout + stale_ttl)
+            return value
+
+        def invalidate():
+            # Keep the old value around so it can be served while one caller recomputes
+            entry = cache.get(key)
+            if entry is not None:
+                cache.set(key, (entry[0], 0), timeout=stale_ttl)
+
+        @wraps(func)
+        def wrapper():
+            entry = cache.get(key)
+            if entry is not None and entry[1] > time.time():
+                return entry[0]
+
+            if cache.add(lock_key, True, timeout=REFRESH_LOCK_TIMEOUT):
+                try:
+                    return refresh()
+                finally:
+                    cache.delete(lock_key)
+
+            if entry is not None:
+                return entry[0]
+
+            deadline = time.time() + cold_wait
+            while time.time() < deadline:
+                time.sleep(0.01)
+                entry = cache.get(key)
+                if entry is not None:
+                    return entry[0]
+            return func()
+
+        refresh.__name__ = func.__name__
+        wrapper.refresh = refresh
+        wrapper.invalidate = invalidate
+        warmer(refresh)
+        return wrapper
+    return decorator